@@ -15,6 +15,15 @@ namespace UnityAIAgent.Editor
         private static dynamic agentCore;
         private static bool isInitialized = false;
 
+        // 流式拉取参数：每批最多帧数、没有帧时Python端最长等待时间
+        private const int StreamPollMaxFrames = 64;
+        private const int StreamPollTimeoutMs = 100;
+        // 取消时等待Python端停止模型流和工具的最长时间
+        private const int StreamCancelDeadlineMs = 2000;
+        // 主线程尚未处理的批次达到该数量时暂停拉取
+        private const int StreamMaxPendingBatches = 2;
+        private const int StreamPendingWaitMs = 20;
+
         /// <summary>
         /// 初始化Python桥接
         /// </summary>
@@ -147,69 +156,57 @@ namespace UnityAIAgent.Editor
                             return;
                         }
 
+                        // 在Python端的常驻事件循环上启动流，只在每次批量拉取时持有GIL
+                        string handle;
                         using (Py.GIL())
                         {
-                        dynamic asyncio = Py.Import("asyncio");
-                        dynamic loop = asyncio.new_event_loop();
-                        asyncio.set_event_loop(loop);
-
+                            handle = agentCore.start_stream(message).ToString();
+                        }
+                        
                         try
                         {
-                            // 获取流式生成器
-                            // 使用agent_core的流式处理功能
-                            dynamic unityAgent = agentCore.get_agent();
-                            dynamic streamGen = unityAgent.process_message_stream(message);
-                            
-                            // 处理流式数据
-                            int chunkIndex = 0;
-                            while (true)
+                            int batchIndex = 0;
+                            bool finished = false;
+                            // 已拉取但主线程尚未处理的批次数；编辑器忙时停止拉取，让Python端缓冲产生背压
+                            int pendingBatches = 0;
+                            while (!finished)
                             {
-                                try
+                                // 检查取消令牌：让Python端停止模型流和正在执行的工具
+                                if (cancellationToken.IsCancellationRequested)
                                 {
-                                    // 检查取消令牌
-                                    if (cancellationToken.IsCancellationRequested)
-                                    {
-                                        EditorApplication.delayCall += () => onError?.Invoke("用户取消了流式处理");
-                                        break;
-                                    }
-                                    
-                                    // 在每个循环中检查Unity状态
-                                    if (ThreadProtection.IsUnityChangingMode || !PythonEngine.IsInitialized)
-                                    {
-                                        Debug.LogWarning("[Unity] 检测到Unity状态变化或Python引擎关闭，退出流处理");
-                                        EditorApplication.delayCall += () => onError?.Invoke("Unity状态变化，流处理被中断");
-                                        break;
-                                    }
-                                    
-                                    chunkIndex++;
-                                    dynamic chunk = loop.run_until_complete(streamGen.__anext__());
-                                    string chunkStr = chunk.ToString();
-                                    
-                                    // 解析JSON
-                                    var chunkData = JsonUtility.FromJson<StreamChunk>(chunkStr);
-                                    
-                                    if (chunkData.type == "chunk")
-                                    {
-                                        string content = chunkData.content;
-                                        EditorApplication.delayCall += () => onChunk?.Invoke(content);
-                                    }
-                                    else if (chunkData.type == "complete")
+                                    using (Py.GIL())
                                     {
-                                        EditorApplication.delayCall += () => onComplete?.Invoke();
-                                        break;
-                                    }
-                                    else if (chunkData.type == "error")
-                                    {
-                                        Debug.LogError($"[Unity] Agent响应错误: {chunkData.error}");
-                                        EditorApplication.delayCall += () => onError?.Invoke(chunkData.error);
-                                        break;
+                                        string cancelResult = agentCore.cancel_stream(handle, StreamCancelDeadlineMs).ToString();
+                                        Debug.Log($"[Unity] 流式处理已取消: {cancelResult}");
                                     }
+                                    EditorApplication.delayCall += () => onError?.Invoke("用户取消了流式处理");
+                                    break;
                                 }
-                                catch (PythonException stopIteration) when (stopIteration.Message.Contains("StopAsyncIteration"))
+                                
+                                // 在每个循环中检查Unity状态
+                                if (ThreadProtection.IsUnityChangingMode || !PythonEngine.IsInitialized)
                                 {
-                                    EditorApplication.delayCall += () => onComplete?.Invoke();
+                                    Debug.LogWarning("[Unity] 检测到Unity状态变化或Python引擎关闭，退出流处理");
+                                    EditorApplication.delayCall += () => onError?.Invoke("Unity状态变化，流处理被中断");
                                     break;
                                 }
+                                
+                                if (Interlocked.CompareExchange(ref pendingBatches, 0, 0) >= StreamMaxPendingBatches)
+                                {
+                                    System.Threading.Thread.Sleep(StreamPendingWaitMs);
+                                    continue;
+                                }
+                                
+                                batchIndex++;
+                                string batchStr;
+                                try
+                                {
+                                    // poll_stream在等待帧时会释放GIL
+                                    using (Py.GIL())
+                                    {
+                                        batchStr = agentCore.poll_stream(handle, StreamPollMaxFrames, StreamPollTimeoutMs).ToString();
+                                    }
+                                }
                                 catch (System.Threading.ThreadAbortException)
                                 {
                                     // Unity进入播放模式或重新编译时的正常行为
@@ -217,19 +214,79 @@ namespace UnityAIAgent.Editor
                                     EditorApplication.delayCall += () => onError?.Invoke("AI响应被中断（Unity进入播放模式）");
                                     break;
                                 }
-                                catch (Exception chunkError)
+                                catch (Exception pollError)
                                 {
-                                    Debug.LogError($"[Unity] 处理第 {chunkIndex} 个chunk时出错: {chunkError.Message}");
-                                    Debug.LogError($"[Unity] 错误详情: {chunkError}");
-                                    // 继续处理下一个chunk，不要中断整个流
+                                    Debug.LogError($"[Unity] 拉取第 {batchIndex} 批数据时出错: {pollError.Message}");
+                                    EditorApplication.delayCall += () => onError?.Invoke(pollError.Message);
+                                    break;
+                                }
+                                
+                                var batch = JsonUtility.FromJson<StreamBatch>(batchStr);
+                                var frames = new System.Collections.Generic.List<StreamChunk>();
+                                bool terminated = false;
+                                if (batch.frames != null)
+                                {
+                                    foreach (var chunkData in batch.frames)
+                                    {
+                                        frames.Add(chunkData);
+                                        if (chunkData.type == "complete" || chunkData.type == "cancelled" || chunkData.type == "error")
+                                        {
+                                            terminated = true;
+                                            break;
+                                        }
+                                    }
                                 }
+                                
+                                // 生成器结束但没有发送完成帧
+                                bool completeAfterBatch = !terminated && batch.finished;
+                                finished = terminated || batch.finished;
+                                if (frames.Count == 0 && !completeAfterBatch)
+                                {
+                                    continue;
+                                }
+                                
+                                // 整批帧在主线程的一次回调中按顺序处理
+                                Interlocked.Increment(ref pendingBatches);
+                                EditorApplication.delayCall += () =>
+                                {
+                                    Interlocked.Decrement(ref pendingBatches);
+                                    foreach (var chunkData in frames)
+                                    {
+                                        if (chunkData.type == "chunk")
+                                        {
+                                            onChunk?.Invoke(chunkData.content);
+                                        }
+                                        else if (chunkData.type == "complete")
+                                        {
+                                            onComplete?.Invoke();
+                                        }
+                                        else if (chunkData.type == "cancelled")
+                                        {
+                                            onError?.Invoke("用户取消了流式处理");
+                                        }
+                                        else if (chunkData.type == "error")
+                                        {
+                                            Debug.LogError($"[Unity] Agent响应错误: {chunkData.error}");
+                                            onError?.Invoke(chunkData.error);
+                                        }
+                                    }
+                                    if (completeAfterBatch)
+                                    {
+                                        onComplete?.Invoke();
+                                    }
+                                };
                             }
                         }
                         finally
                         {
-                            loop.close();
+                            if (PythonEngine.IsInitialized)
+                            {
+                                using (Py.GIL())
+                                {
+                                    agentCore.close_stream(handle);
+                                }
+                            }
                         }
-                        } // 关闭 using (Py.GIL())
                     }
                     catch (System.Threading.ThreadAbortException)
                     {
@@ -412,6 +469,14 @@ print('[Python] Unity日志处理器配置完成')
             public bool done;
         }
         
+        [Serializable]
+        private class StreamBatch
+        {
+            public string handle;
+            public StreamChunk[] frames;
+            public bool finished;
+        }
+        
         /// <summary>
         /// 清理Python桥接资源
         /// </summary>
@@ -34,6 +34,7 @@ else:
 
 # 导入重构的模块
 from unity_agent import UnityAgent
+from stream_runtime import get_stream_runtime
 
 # Configure detailed logging for debugging
 logging.basicConfig(
@@ -88,17 +89,221 @@ def process_sync(message: str) -> str:
     result = agent.process_message(message)
     return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
 
-def health_check() -> str:
+def health_check(reset_stats: bool = False) -> str:
     """
     健康检查端点（供Unity调用）
     
+    参数:
+        reset_stats: 读取后是否清空MCP调用统计
+    
     返回:
         包含状态的JSON字符串
     """
     agent = get_agent()
-    result = agent.health_check()
+    result = agent.health_check(reset_stats)
     return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
 
+def configure_stream_coalescing(window_ms: int = None, max_bytes: int = None) -> str:
+    """
+    调整流式正文合并参数（供Unity调用）
+    
+    参数:
+        window_ms: 合并时间窗口（毫秒），0表示不合并
+        max_bytes: 缓冲正文达到该字节数时立即发送
+        
+    返回:
+        包含当前配置和统计的JSON字符串
+    """
+    agent = get_agent()
+    coalescer = agent.streaming_processor.coalescer
+    coalescer.configure(window_ms, max_bytes)
+    return json.dumps(coalescer.get_stats(), ensure_ascii=False, separators=(',', ':'))
+
+def get_stream_coalescing_stats() -> str:
+    """
+    获取流式正文合并统计：每秒帧数、平均帧大小等（供Unity调用）
+    
+    返回:
+        包含统计的JSON字符串
+    """
+    agent = get_agent()
+    stats = agent.streaming_processor.coalescer.get_stats()
+    return json.dumps(stats, ensure_ascii=False, separators=(',', ':'))
+
+def get_stream_metrics(reset: bool = False) -> str:
+    """
+    获取流式延迟统计：最近N个流的首字节/首文本时间、chunk间隔、工具耗时、处理与等待时间的p50/p95/p99（供Unity调用）
+    
+    参数:
+        reset: 读取后是否清空统计
+    
+    返回:
+        包含统计的JSON字符串
+    """
+    agent = get_agent()
+    metrics = agent.streaming_processor.metrics
+    summary = metrics.summary()
+    if reset:
+        metrics.reset()
+    return json.dumps(summary, ensure_ascii=False, separators=(',', ':'))
+
+def start_stream(message: str) -> str:
+    """
+    在常驻事件循环上开始流式处理消息（供Unity调用）
+    
+    参数:
+        message: 用户输入
+    
+    返回:
+        流句柄ID，之后通过poll_stream拉取帧
+    """
+    agent = get_agent()
+    return get_stream_runtime().start(lambda: agent.streaming_processor.process_frames(message))
+
+def poll_stream(handle: str, max_frames: int = 64, timeout_ms: int = 100) -> str:
+    """
+    批量拉取流式帧（供Unity调用）
+    
+    没有帧时最多等待timeout_ms毫秒，等待期间释放GIL。
+    
+    参数:
+        handle: start_stream返回的句柄ID
+        max_frames: 本次最多返回的帧数
+        timeout_ms: 没有帧时的最长等待时间（毫秒）
+    
+    返回:
+        JSON字符串 {"handle": ..., "frames": [StreamChunk...], "finished": bool}
+    """
+    runtime = get_stream_runtime()
+    frames = runtime.poll(handle, max_frames, timeout_ms) or []
+    finished = runtime.is_finished(handle)
+    # 帧本身已是JSON字符串，直接拼接避免重复序列化
+    return '{"handle":%s,"frames":[%s],"finished":%s}' % (
+        json.dumps(handle), ','.join(frames), 'true' if finished else 'false')
+
+def close_stream(handle: str) -> str:
+    """
+    关闭流并释放句柄（供Unity调用）
+    
+    参数:
+        handle: start_stream返回的句柄ID
+    
+    返回:
+        包含结果的JSON字符串
+    """
+    get_stream_runtime().close(handle)
+    return json.dumps({"success": True, "handle": handle}, ensure_ascii=False, separators=(',', ':'))
+
+def cancel_stream(handle: str, deadline_ms: int = 2000) -> str:
+    """
+    取消正在进行的流（供Unity调用）
+    
+    通知Agent停止并终止工具执行，然后取消流所在的asyncio任务。
+    期限内流会以一个cancelled帧结束，之后仍需poll_stream取走该帧或直接close_stream。
+    
+    参数:
+        handle: start_stream返回的句柄ID
+        deadline_ms: 等待流停止的最长时间（毫秒）
+    
+    返回:
+        包含取消结果的JSON字符串
+    """
+    on_cancel = _agent_instance.cancel if _agent_instance is not None else None
+    result = get_stream_runtime().cancel(handle, deadline_ms / 1000.0, on_cancel)
+    return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+
+def configure_stream_buffer(capacity: int) -> str:
+    """
+    调整每个流的帧缓冲容量（供Unity调用）
+    
+    参数:
+        capacity: 最多缓冲的帧数，缓冲满时正文合并、每个工具的进度只保留最新、其他帧等待消费
+    
+    返回:
+        包含当前配置和统计的JSON字符串
+    """
+    runtime = get_stream_runtime()
+    runtime.configure_buffer(capacity)
+    return json.dumps(runtime.get_buffer_stats(), ensure_ascii=False, separators=(',', ':'))
+
+def get_stream_buffer_stats(reset: bool = False) -> str:
+    """
+    获取帧缓冲统计：各溢出策略的触发次数、背压等待时间、最高水位（供Unity调用）
+    
+    参数:
+        reset: 读取后是否清空已结束流的统计
+    
+    返回:
+        包含统计的JSON字符串
+    """
+    runtime = get_stream_runtime()
+    stats = runtime.get_buffer_stats()
+    if reset:
+        runtime.reset_buffer_stats()
+    return json.dumps(stats, ensure_ascii=False, separators=(',', ':'))
+
+def configure_tool_trace(record_path: str = None, events_path: str = None, replay_path: str = None) -> str:
+    """
+    设置工具调用录制/回放（供Unity调用），传入None的项关闭
+    
+    参数:
+        record_path: 工具调用轨迹文件（JSONL，追加写入）
+        events_path: 流式事件轨迹文件，可用于benchmark_stream_replay_call重放
+        replay_path: 回放使用的工具调用轨迹文件，启用后工具不会真正执行
+    
+    返回:
+        包含当前录制/回放状态的JSON字符串
+    """
+    agent = get_agent()
+    if not hasattr(agent, 'tool_trace'):
+        return json.dumps({"success": False, "message": "工具轨迹不可用"}, ensure_ascii=False)
+    status = agent.tool_trace.configure(record_path, events_path, replay_path)
+    return json.dumps(status, ensure_ascii=False, separators=(',', ':'))
+
+def get_tool_trace_summary(path: str) -> str:
+    """
+    统计工具调用轨迹中各工具的耗时和输出大小（供Unity调用）
+    
+    参数:
+        path: 工具调用轨迹文件
+    
+    返回:
+        按p95耗时排序的JSON字符串
+    """
+    from tool_recorder import summarize_tool_trace
+    return json.dumps(summarize_tool_trace(path), ensure_ascii=False, separators=(',', ':'))
+
+def get_mcp_stats(reset: bool = False) -> str:
+    """
+    获取各MCP服务器和工具的调用统计（供Unity调用）：次数、错误、超时、排队等待和往返时间直方图、
+    请求和结果字节数，以及按累计往返时间排序的工具，用来找出占用Agent回合时间最多的MCP工具；
+    另附会话、MCP事件循环、HTTP连接池、结果落盘和代理连接的状态
+    
+    参数:
+        reset: 读取后是否清空统计
+    
+    返回:
+        包含统计的JSON字符串
+    """
+    stats = get_agent().mcp_manager.get_mcp_stats(reset)
+    return json.dumps(stats, ensure_ascii=False, separators=(',', ':'))
+
+def shutdown_mcp(deadline_seconds: float = 3.0) -> str:
+    """
+    在总期限内并行关闭所有MCP客户端（供Unity调用，如域重载前），之后可用reload_mcp_config重新加载
+    
+    参数:
+        deadline_seconds: 总期限（秒），期限前未退出的stdio服务器被强制结束
+    
+    返回:
+        包含关闭报告的JSON字符串
+    """
+    if _agent_instance is None:
+        report = {"servers": 0, "closed": 0, "elapsed_ms": 0}
+    else:
+        report = _agent_instance.mcp_manager.shutdown(deadline_seconds)
+    return json.dumps(report, ensure_ascii=False, separators=(',', ':'))
+
 def reload_mcp_config() -> str:
     """
     重新加载MCP配置（供Unity调用）
@@ -111,39 +316,28 @@ def reload_mcp_config() -> str:
     try:
         logger.info("=== 开始重新加载MCP配置 ===")
         
-        # 清理现有的MCP资源
+        # 已有代理时增量重载：只重启变化的服务器，保留对话和未变化的会话
         if _agent_instance is not None:
-            logger.info("清理现有MCP资源...")
-            _agent_instance._cleanup_resources()
-        
-        # 重新创建代理实例
-        logger.info("重新创建Unity代理实例...")
-        _agent_instance = UnityAgent()
-        
-        # 获取新的MCP配置信息
-        mcp_config = _agent_instance.mcp_manager._load_unity_mcp_config()
-        
-        if mcp_config:
-            enabled_servers = [s for s in mcp_config.get('servers', []) if s.get('enabled', False)]
-            result = {
-                "success": True,
-                "message": "MCP配置重新加载成功",
-                "mcp_enabled": mcp_config.get('enable_mcp', False),
-                "server_count": len(mcp_config.get('servers', [])),
-                "enabled_server_count": len(enabled_servers),
-                "servers": [{
-                    "name": s.get('name'),
-                    "transport_type": s.get('transport_type'),
-                    "enabled": s.get('enabled')
-                } for s in mcp_config.get('servers', [])]
-            }
+            result = _agent_instance.reload_mcp_config()
         else:
-            result = {
-                "success": False,
-                "message": "MCP配置加载失败",
-                "mcp_enabled": False,
-                "server_count": 0
-            }
+            logger.info("创建Unity代理实例...")
+            _agent_instance = UnityAgent()
+            mcp_manager = _agent_instance.mcp_manager
+            mcp_config = mcp_manager._config or mcp_manager._load_unity_mcp_config()
+            
+            if mcp_config:
+                result = {
+                    "success": True,
+                    "message": "MCP配置重新加载成功",
+                    **mcp_manager._config_summary(mcp_config)
+                }
+            else:
+                result = {
+                    "success": False,
+                    "message": "MCP配置加载失败",
+                    "mcp_enabled": False,
+                    "server_count": 0
+                }
         
         logger.info(f"MCP配置重新加载结果: {result}")
         return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
@@ -167,6 +361,21 @@ def diagnose_unity_mcp_issue_call() -> str:
     from diagnostic_utils import diagnose_unity_mcp_issue
     return diagnose_unity_mcp_issue()
 
+def benchmark_chunk_dispatch_call(iterations: int = 20, events_path: str = None) -> str:
+    """对比流式chunk处理的逐chunk开销（旧版一侧为合成估算）"""
+    from diagnostic_utils import benchmark_chunk_dispatch
+    return benchmark_chunk_dispatch(iterations, events_path)
+
+def benchmark_stream_replay_call(iterations: int = 5, events_path: str = None) -> str:
+    """用录制的事件流重放完整的流式管线"""
+    from diagnostic_utils import benchmark_stream_replay
+    return benchmark_stream_replay(iterations, events_path)
+
+def benchmark_mcp_transports_call(calls: int = 200, concurrency: int = 8, sleep_ms: int = 0) -> str:
+    """比较stdio、sse和streamable_http传输的MCP调用吞吐量"""
+    from diagnostic_utils import benchmark_mcp_transports
+    return benchmark_mcp_transports(calls, concurrency, sleep_ms)
+
 if __name__ == "__main__":
     # 测试代理
     print("测试Unity代理...")
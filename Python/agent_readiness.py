@@ -0,0 +1,172 @@
+"""
+Agent就绪状态管理模块
+通过后台存活探测缓存模型可用性，避免每次流式请求前都进行一次完整的模型调用
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 探测使用的系统提示词和问题，尽量让模型只输出极少的token
+PROBE_SYSTEM_PROMPT = "You are a health probe. Reply with a single word."
+PROBE_MESSAGE = "ping"
+
+
+class AgentReadiness:
+    """
+    Agent就绪状态管理器
+    
+    在后台线程中使用独立的一次性对话探测模型是否可用，
+    结果带TTL缓存，探测永远不会写入用户的对话历史。
+    """
+    
+    # 探测结果的有效期（秒）
+    DEFAULT_TTL_SECONDS = 300
+    # 已知不健康时，流式请求最多等待新探测结果的时间（秒）
+    DEFAULT_UNHEALTHY_WAIT_SECONDS = 15
+    
+    def __init__(self, agent_instance, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 unhealthy_wait_seconds: float = DEFAULT_UNHEALTHY_WAIT_SECONDS):
+        """
+        初始化就绪状态管理器
+        
+        参数:
+            agent_instance: Unity Agent实例
+            ttl_seconds: 探测结果缓存有效期
+            unhealthy_wait_seconds: 已知不健康时流式请求的最长等待时间
+        """
+        self.agent_instance = agent_instance
+        self.ttl_seconds = ttl_seconds
+        self.unhealthy_wait_seconds = unhealthy_wait_seconds
+        
+        self._lock = threading.Lock()
+        self._probe_done = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+        
+        # 缓存的探测结果
+        self._healthy: Optional[bool] = None
+        self._latency: Optional[float] = None
+        self._checked_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._probe_count = 0
+    
+    @property
+    def is_known_unhealthy(self) -> bool:
+        """最近一次探测是否明确失败"""
+        return self._healthy is False
+    
+    def is_stale(self) -> bool:
+        """缓存的探测结果是否已过期或不存在"""
+        if self._checked_at is None:
+            return True
+        return time.monotonic() - self._checked_at > self.ttl_seconds
+    
+    def refresh_async(self, force: bool = False) -> bool:
+        """
+        在后台启动一次探测（已有探测在进行时不会重复启动）
+        
+        参数:
+            force: 即使缓存未过期也重新探测
+        
+        返回:
+            是否启动了新的探测
+        """
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return False
+            if not force and not self.is_stale():
+                return False
+            
+            self._probe_done.clear()
+            self._probe_thread = threading.Thread(
+                target=self._run_probe, name="AgentReadinessProbe", daemon=True
+            )
+            self._probe_thread.start()
+            return True
+    
+    def wait_for_probe(self, timeout: float) -> bool:
+        """
+        阻塞等待当前探测完成
+        
+        返回:
+            探测完成后Agent是否健康
+        """
+        self._probe_done.wait(timeout)
+        return self._healthy is True
+    
+    async def ensure_ready(self) -> bool:
+        """
+        流式处理开始前调用：健康或状态未知时立即返回，
+        只有已知不健康时才重新探测并等待结果
+        
+        返回:
+            Agent是否被认为可用
+        """
+        if not self.is_known_unhealthy:
+            # 缓存过期时只在后台刷新，不阻塞流式请求
+            self.refresh_async()
+            return True
+        
+        logger.warning(f"Agent上次探测失败 ({self._last_error})，等待重新探测...")
+        self.refresh_async(force=True)
+        loop = asyncio.get_event_loop()
+        healthy = await loop.run_in_executor(None, self.wait_for_probe, self.unhealthy_wait_seconds)
+        if not healthy:
+            logger.warning("Agent重新探测仍未通过，继续尝试流式处理")
+        return healthy
+    
+    def _create_probe_agent(self):
+        """创建与主Agent共用模型但拥有独立对话的一次性探测Agent"""
+        from strands import Agent
+        
+        kwargs = {"system_prompt": PROBE_SYSTEM_PROMPT, "callback_handler": None}
+        model = getattr(getattr(self.agent_instance, 'agent', None), 'model', None)
+        if model is not None:
+            kwargs["model"] = model
+        return Agent(**kwargs)
+    
+    def _run_probe(self):
+        """执行一次存活探测并更新缓存"""
+        start = time.monotonic()
+        try:
+            probe_agent = self._create_probe_agent()
+            probe_agent(PROBE_MESSAGE)
+            latency = time.monotonic() - start
+            with self._lock:
+                self._healthy = True
+                self._latency = latency
+                self._last_error = None
+            logger.info(f"Agent存活探测成功，耗时 {latency:.2f}秒")
+        except Exception as e:
+            latency = time.monotonic() - start
+            with self._lock:
+                self._healthy = False
+                self._latency = latency
+                self._last_error = str(e)
+            logger.error(f"Agent存活探测失败: {e}")
+        finally:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                self._probe_count += 1
+            self._probe_done.set()
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取缓存的探测状态（供health_check使用）"""
+        with self._lock:
+            probing = self._probe_thread is not None and self._probe_thread.is_alive()
+            age = None if self._checked_at is None else time.monotonic() - self._checked_at
+            return {
+                "healthy": self._healthy,
+                "probe_latency_seconds": None if self._latency is None else round(self._latency, 3),
+                "probe_age_seconds": None if age is None else round(age, 1),
+                "stale": self.is_stale(),
+                "probing": probing,
+                "probe_count": self._probe_count,
+                "last_error": self._last_error,
+                "ttl_seconds": self.ttl_seconds
+            }
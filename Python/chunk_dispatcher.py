@@ -0,0 +1,224 @@
+"""
+流式数据块分发器
+对agent.stream_async产生的每个chunk只做一次形状分类，再按类别分发给已注册的处理器
+"""
+
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from stream_frames import StreamFrame, FRAME_TOOL
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# chunk类别
+TEXT_DELTA = "text_delta"              # 模型正文增量 event.contentBlockDelta.delta.text
+TOOL_USE_START = "tool_use_start"      # 工具调用块开始 event.contentBlockStart
+TOOL_INPUT_DELTA = "tool_input_delta"  # 工具参数增量 event.contentBlockDelta.delta.toolUse.input
+BLOCK_STOP = "block_stop"              # 内容块结束 event.contentBlockStop
+MESSAGE = "message"                    # 完整消息（包含toolUse/toolResult内容块）
+TOOL_RESULT = "tool_result"            # 工具执行结果事件
+TOOL_STREAM = "tool_stream"            # 工具执行过程中产出的流式数据 tool_stream_event
+TOOL_USE = "tool_use"                  # 直接的工具使用chunk（type == 'tool_use'）
+TEXT = "text"                          # 纯文本chunk（字符串/字节/text/content字段）
+LIFECYCLE = "lifecycle"                # 事件循环生命周期及其他模型事件
+IGNORED = "ignored"                    # 元数据等无需处理的chunk
+
+CHUNK_KINDS = (
+    TEXT_DELTA, TOOL_USE_START, TOOL_INPUT_DELTA, BLOCK_STOP, MESSAGE,
+    TOOL_RESULT, TOOL_STREAM, TOOL_USE, TEXT, LIFECYCLE, IGNORED
+)
+
+# 生命周期相关的顶层键
+_LIFECYCLE_KEYS = ('init_event_loop', 'start', 'start_event_loop', 'complete', 'force_stop', 'result')
+# 包含复杂元数据、不需要展示的顶层键
+_METADATA_KEYS = ('agent', 'event_loop_metrics', 'traces', 'spans')
+
+
+class ClassifiedChunk:
+    """分类后的chunk，payload为该类别关心的子结构"""
+    
+    __slots__ = ('kind', 'chunk', 'payload', 'index', 'tool_results')
+    
+    def __init__(self, kind: str, chunk: Any, payload: Any = None, index: Optional[int] = None):
+        self.kind = kind
+        self.chunk = chunk
+        self.payload = payload
+        self.index = index
+        # MESSAGE类chunk的工具结果视图，首次使用时构建（见tool_result_view.chunk_tool_results）
+        self.tool_results = None
+
+
+def classify_chunk(chunk: Any) -> ClassifiedChunk:
+    """
+    根据chunk的形状进行一次性分类
+    
+    参数:
+        chunk: agent.stream_async产生的原始chunk
+    
+    返回:
+        ClassifiedChunk实例
+    """
+    if isinstance(chunk, str):
+        return ClassifiedChunk(TEXT, chunk, chunk)
+    if isinstance(chunk, bytes):
+        text = chunk.decode('utf-8')
+        return ClassifiedChunk(TEXT, text, text)
+    if not isinstance(chunk, dict) or not chunk:
+        return ClassifiedChunk(IGNORED, chunk)
+    
+    event = chunk.get('event')
+    if event is not None:
+        if not isinstance(event, dict):
+            return ClassifiedChunk(IGNORED, chunk)
+        
+        block_delta = event.get('contentBlockDelta')
+        if block_delta is not None:
+            index = block_delta.get('contentBlockIndex')
+            delta = block_delta.get('delta') or {}
+            if 'text' in delta:
+                return ClassifiedChunk(TEXT_DELTA, chunk, delta['text'], index)
+            if 'toolUse' in delta:
+                return ClassifiedChunk(TOOL_INPUT_DELTA, chunk, delta['toolUse'].get('input'), index)
+            if 'input' in delta:
+                return ClassifiedChunk(TOOL_INPUT_DELTA, chunk, delta['input'], index)
+            return ClassifiedChunk(IGNORED, chunk, None, index)
+        
+        block_start = event.get('contentBlockStart')
+        if block_start is not None:
+            index = block_start.get('contentBlockIndex')
+            # Bedrock格式: start.toolUse = {name, toolUseId}
+            tool_use = (block_start.get('start') or {}).get('toolUse')
+            if tool_use:
+                return ClassifiedChunk(TOOL_USE_START, chunk, {
+                    'name': tool_use.get('name', '未知工具'),
+                    'toolUseId': tool_use.get('toolUseId', '')
+                }, index)
+            # 兼容格式: contentBlock = {type: tool_use, name, id}
+            content_block = block_start.get('contentBlock') or {}
+            if content_block.get('type') == 'tool_use':
+                return ClassifiedChunk(TOOL_USE_START, chunk, {
+                    'name': content_block.get('name', '未知工具'),
+                    'toolUseId': content_block.get('id', '')
+                }, index)
+            return ClassifiedChunk(LIFECYCLE, chunk, None, index)
+        
+        block_stop = event.get('contentBlockStop')
+        if block_stop is not None:
+            return ClassifiedChunk(BLOCK_STOP, chunk, None, block_stop.get('contentBlockIndex'))
+        
+        return ClassifiedChunk(LIFECYCLE, chunk, event)
+    
+    if 'message' in chunk:
+        return ClassifiedChunk(MESSAGE, chunk, chunk['message'])
+    if 'tool_result' in chunk:
+        return ClassifiedChunk(TOOL_RESULT, chunk, chunk['tool_result'])
+    if 'tool_stream_event' in chunk:
+        return ClassifiedChunk(TOOL_STREAM, chunk, chunk['tool_stream_event'])
+    if chunk.get('type') == 'tool_use':
+        return ClassifiedChunk(TOOL_USE, chunk, chunk)
+    
+    for key in _LIFECYCLE_KEYS:
+        if key in chunk:
+            return ClassifiedChunk(LIFECYCLE, chunk)
+    for key in _METADATA_KEYS:
+        if key in chunk:
+            return ClassifiedChunk(IGNORED, chunk)
+    
+    if 'text' in chunk:
+        return ClassifiedChunk(TEXT, chunk, chunk['text'])
+    if 'content' in chunk and isinstance(chunk['content'], str):
+        return ClassifiedChunk(TEXT, chunk, chunk['content'])
+    
+    return ClassifiedChunk(IGNORED, chunk)
+
+
+def iter_message_tool_blocks(message: Any):
+    """
+    遍历消息中的工具内容块，同时兼容Bedrock格式({'toolUse': ...}/{'toolResult': ...})
+    和旧格式({'type': 'tool_use'|'tool_result', ...})
+    
+    生成:
+        ('tool_use', tool_use_id, name, input) 或 ('tool_result', tool_use_id, content, status)
+    """
+    if not isinstance(message, dict):
+        return
+    content = message.get('content')
+    if not isinstance(content, list):
+        return
+    
+    for item in content:
+        if not isinstance(item, dict):
+            continue
+        if 'toolUse' in item:
+            tool_use = item['toolUse']
+            yield 'tool_use', tool_use.get('toolUseId', ''), tool_use.get('name', '未知工具'), tool_use.get('input', {})
+        elif 'toolResult' in item:
+            tool_result = item['toolResult']
+            yield 'tool_result', tool_result.get('toolUseId', ''), tool_result.get('content', []), tool_result.get('status', 'success')
+        elif item.get('type') == 'tool_use':
+            yield 'tool_use', item.get('id', ''), item.get('name', '未知工具'), item.get('input', {})
+        elif item.get('type') == 'tool_result':
+            yield 'tool_result', item.get('tool_use_id', ''), item.get('content', []), item.get('status', 'success')
+
+
+def first_text(content: Any, default: str = '') -> str:
+    """取工具结果内容中第一个文本块"""
+    if isinstance(content, list):
+        if content and isinstance(content[0], dict):
+            return content[0].get('text', default)
+        return default
+    if isinstance(content, str):
+        return content
+    return str(content) if content is not None else default
+
+
+# 处理器签名: handler(item: ClassifiedChunk, context) -> Optional[str]
+ChunkHandler = Callable[[ClassifiedChunk, Any], Optional[str]]
+
+
+class ChunkDispatcher:
+    """表驱动的chunk分发器"""
+    
+    def __init__(self):
+        self._handlers: Dict[str, List[tuple]] = {kind: [] for kind in CHUNK_KINDS}
+    
+    def register(self, kind: str, handler: ChunkHandler, frame_kind: str = FRAME_TOOL):
+        """
+        为某类chunk注册处理器
+        
+        参数:
+            kind: chunk类别
+            handler: 处理函数，返回要输出的文本或None
+            frame_kind: 处理器输出内容对应的帧类别
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"未知的chunk类别: {kind}")
+        self._handlers[kind].append((handler, frame_kind))
+    
+    def handlers_for(self, kind: str) -> List[tuple]:
+        """获取某类chunk已注册的处理器"""
+        return self._handlers.get(kind, [])
+    
+    def dispatch(self, chunk: Any, context: Any = None) -> List[StreamFrame]:
+        """
+        分类chunk并调用对应的处理器
+        
+        返回:
+            处理器产生的帧列表（可能为空）
+        """
+        item = classify_chunk(chunk)
+        return self.dispatch_classified(item, context)
+    
+    def dispatch_classified(self, item: ClassifiedChunk, context: Any = None) -> List[StreamFrame]:
+        """将已分类的chunk分发给处理器"""
+        frames = []
+        for handler, frame_kind in self._handlers[item.kind]:
+            try:
+                content = handler(item, context)
+            except Exception as e:
+                logger.warning(f"chunk处理器 {getattr(handler, '__name__', handler)} 出错: {e}")
+                continue
+            if content:
+                frames.append(StreamFrame(frame_kind, content))
+        return frames
@@ -342,4 +342,381 @@ def diagnose_unity_mcp_issue() -> str:
             "success": False, 
             "error": str(e),
             "traceback": traceback.format_exc()
-        }, ensure_ascii=False)
\ No newline at end of file
+        }, ensure_ascii=False)
+
+def build_sample_event_stream(text_tokens: int = 400, tool_result_chars: int = 50000) -> list:
+    """
+    构造一段模拟Strands/Bedrock事件流，用于在没有模型连接时进行基准测试
+    
+    包含：正文增量、一次file_read工具调用（参数增量）、工具结果消息和后续正文
+    """
+    events = [{"init_event_loop": True}, {"start": True}, {"start_event_loop": True},
+              {"event": {"messageStart": {"role": "assistant"}}}]
+    
+    def text_block(index, count):
+        block = []
+        for i in range(count):
+            token = f"token{i} "
+            block.append({"event": {"contentBlockDelta": {"delta": {"text": token}, "contentBlockIndex": index}}})
+            block.append({"data": token, "delta": {"text": token}})
+        block.append({"event": {"contentBlockStop": {"contentBlockIndex": index}}})
+        return block
+    
+    events.extend(text_block(0, text_tokens // 2))
+    
+    tool_input = {"path": "Assets/Scripts/PlayerController.cs", "mode": "view"}
+    tool_input_json = json.dumps(tool_input)
+    events.append({"event": {"contentBlockStart": {
+        "start": {"toolUse": {"toolUseId": "tooluse_bench_1", "name": "file_read"}}, "contentBlockIndex": 1}}})
+    for i in range(0, len(tool_input_json), 8):
+        fragment = tool_input_json[i:i + 8]
+        events.append({"event": {"contentBlockDelta": {"delta": {"toolUse": {"input": fragment}}, "contentBlockIndex": 1}}})
+    events.append({"event": {"contentBlockStop": {"contentBlockIndex": 1}}})
+    events.append({"event": {"messageStop": {"stopReason": "tool_use"}}})
+    events.append({"message": {"role": "assistant", "content": [
+        {"text": "让我读取这个文件。"},
+        {"toolUse": {"toolUseId": "tooluse_bench_1", "name": "file_read", "input": tool_input}}]}})
+    
+    line = "public class PlayerController : MonoBehaviour { /* ... */ }\n"
+    result_text = (line * (tool_result_chars // len(line) + 1))[:tool_result_chars]
+    events.append({"message": {"role": "user", "content": [
+        {"toolResult": {"toolUseId": "tooluse_bench_1", "status": "success", "content": [{"text": result_text}]}}]}})
+    
+    events.append({"event": {"messageStart": {"role": "assistant"}}})
+    events.extend(text_block(0, text_tokens - text_tokens // 2))
+    events.append({"event": {"messageStop": {"stopReason": "end_turn"}}})
+    events.append({"event": {"metadata": {"usage": {"inputTokens": 1000, "outputTokens": text_tokens}}}})
+    return events
+
+
+def load_event_stream(events_path: str) -> list:
+    """从JSONL文件加载录制的事件流（每行一个chunk）"""
+    events = []
+    with open(events_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    return events
+
+
+def _legacy_process_chunk(chunk, tracker):
+    """
+    旧版逐chunk处理开销的合成估算（不是旧版代码本身）：按旧版流程复现日志格式化、file_read检查、
+    强制工具检查、两次工具跟踪调用以及文本提取各自重新遍历chunk，
+    其中工具跟踪调用的是当前的ToolTracker，结果只能作为估算
+    """
+    _ = f"Chunk内容: {str(chunk)[:500]}..."
+    if not isinstance(chunk, dict):
+        return
+    tool_keys = ['contentBlockStart', 'contentBlockDelta', 'contentBlockStop', 'message']
+    
+    # _log_chunk_details
+    event = chunk.get('event')
+    if isinstance(event, dict):
+        for key in tool_keys:
+            if key in event:
+                break
+    any(key in chunk for key in tool_keys)
+    
+    # _check_file_read_tool
+    if isinstance(event, dict) and 'contentBlockDelta' in event:
+        delta = event['contentBlockDelta'].get('delta', {})
+        if 'input' in delta:
+            'path' in delta['input']
+    if 'message' in chunk:
+        for content in chunk['message'].get('content', []):
+            result = content.get('toolResult', {}).get('content', [])
+            if result:
+                result_text = result[0].get('text', '')
+                if len(result_text) > 100:
+                    result_text.split('\n')
+    
+    # _force_check_tool_calls / _parse_tool_details
+    tool_patterns = ['tool_use', 'tool_call', 'function_call', 'action', 'contentBlockStart',
+                     'contentBlockDelta', 'contentBlockStop', 'message', 'tool_result', 'input', 'output']
+    for pattern in tool_patterns:
+        if pattern in chunk:
+            if pattern == 'message':
+                for item in chunk['message'].get('content', []):
+                    if 'toolUse' in item:
+                        json.dumps(item['toolUse'].get('input', {}), ensure_ascii=False, indent=2)
+                    elif 'toolResult' in item:
+                        item['toolResult']['content'][0].get('text', '')[:500]
+            _ = str(chunk)[:800]
+            break
+    
+    # tool_tracker.process_event 对 chunk['event'] 和顶层各调用一次
+    if isinstance(event, dict):
+        tracker.process_event(event)
+    if any(key in chunk for key in tool_keys):
+        tracker.process_event(chunk)
+    
+    # _extract_text_from_chunk
+    if any(key in chunk for key in ['init_event_loop', 'start', 'start_event_loop']):
+        return
+    if isinstance(event, dict) and 'contentBlockDelta' in event:
+        delta = event['contentBlockDelta']
+        if 'delta' in delta and 'text' in delta['delta']:
+            _ = f"提取文本内容: {delta['delta']['text']}"
+
+
+def benchmark_chunk_dispatch(iterations: int = 20, events_path: str = None) -> str:
+    """
+    对比旧版多次扫描与单次分类分发的逐chunk开销
+    
+    旧版一侧是合成估算（见_legacy_process_chunk），输出中标注为synthetic_estimate，
+    不代表旧版流式管线的实测结果。
+    
+    参数:
+        iterations: 重复处理整段事件流的次数
+        events_path: 可选的录制事件流JSONL文件路径，默认使用模拟事件流
+    
+    返回:
+        包含每个chunk平均耗时（微秒）和估算加速比的JSON字符串
+    """
+    import asyncio
+    from tool_tracker import ToolTracker
+    from streaming_processor import StreamingProcessor, StreamContext
+    
+    events = load_event_stream(events_path) if events_path else build_sample_event_stream()
+    
+    def run_legacy():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            tracker = ToolTracker()
+            for chunk in events:
+                _legacy_process_chunk(chunk, tracker)
+        return time.perf_counter() - start
+    
+    async def run_dispatcher():
+        processor = StreamingProcessor(None)
+        frame_count = 0
+        start = time.perf_counter()
+        for _ in range(iterations):
+            context = StreamContext(ToolTracker(), asyncio.get_event_loop().time())
+            for chunk in events:
+                context.chunk_count += 1
+                frame_count += len(processor.process_chunk(chunk, context))
+        return time.perf_counter() - start, frame_count
+    
+    # 基准测试只衡量处理开销，暂时关闭日志输出
+    logging.disable(logging.CRITICAL)
+    try:
+        legacy_seconds = run_legacy()
+        dispatcher_seconds, frame_count = asyncio.run(run_dispatcher())
+    finally:
+        logging.disable(logging.NOTSET)
+    
+    total_chunks = len(events) * iterations
+    legacy_us = legacy_seconds / total_chunks * 1e6
+    dispatcher_us = dispatcher_seconds / total_chunks * 1e6
+    result = {
+        "events": len(events),
+        "iterations": iterations,
+        "source": events_path or "sample",
+        "legacy_baseline": "synthetic_estimate",
+        "legacy_estimate_us_per_chunk": round(legacy_us, 2),
+        "dispatcher_us_per_chunk": round(dispatcher_us, 2),
+        "estimated_speedup": round(legacy_us / dispatcher_us, 2) if dispatcher_us else None,
+        "frames_per_iteration": frame_count // iterations if iterations else 0
+    }
+    logger.info(f"chunk分发基准测试: {result}")
+    return json.dumps(result, ensure_ascii=False)
+
+
+class _ReplayAgentInstance:
+    """用录制的事件流代替模型和工具的Agent实例，供流式管线重放基准测试使用"""
+    
+    def __init__(self, events: list):
+        self.agent = self
+        self._events = events
+    
+    async def stream_async(self, message):
+        for chunk in self._events:
+            yield chunk
+    
+    def begin_stream(self):
+        return True
+    
+    def end_stream(self):
+        pass
+    
+    def repair_history_after_cancel(self, partial_text):
+        pass
+
+
+def benchmark_stream_replay(iterations: int = 5, events_path: str = None) -> str:
+    """
+    用录制的事件流重放完整的流式管线（分发、工具跟踪、心跳、文本合并），
+    不访问模型、文件系统、Shell或MCP服务器
+    
+    参数:
+        iterations: 重放次数
+        events_path: 录制的事件流JSONL文件（UNITY_AGENT_EVENT_TRACE），默认使用模拟事件流
+    
+    返回:
+        包含每个chunk平均耗时、输出帧数和工具统计的JSON字符串
+    """
+    import asyncio
+    from streaming_processor import StreamingProcessor
+    
+    events = load_event_stream(events_path) if events_path else build_sample_event_stream()
+    processor = StreamingProcessor(_ReplayAgentInstance(events))
+    # 重放时不合并文本，输出帧数与逐chunk处理结果一致
+    processor.coalescer.configure(window_ms=0)
+    
+    async def run():
+        frame_count = 0
+        start = time.perf_counter()
+        for _ in range(iterations):
+            async for _frame in processor.process_frames("replay"):
+                frame_count += 1
+        return time.perf_counter() - start, frame_count
+    
+    logging.disable(logging.CRITICAL)
+    try:
+        seconds, frame_count = asyncio.run(run())
+    finally:
+        logging.disable(logging.NOTSET)
+    
+    total_chunks = len(events) * iterations
+    metrics = processor.metrics.summary()
+    result = {
+        "events": len(events),
+        "iterations": iterations,
+        "source": events_path or "sample",
+        "us_per_chunk": round(seconds / total_chunks * 1e6, 2) if total_chunks else 0.0,
+        "frames_per_iteration": frame_count // iterations if iterations else 0,
+        "tools": metrics["tools"]
+    }
+    logger.info(f"流式管线重放基准测试: {result}")
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float) -> bool:
+    import socket
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def _run_transport_benchmark(client, calls: int, concurrency: int, tool: str, arguments: dict) -> Dict[str, Any]:
+    """在已连接的客户端上以固定并发数调用工具，统计吞吐量和延迟"""
+    from stream_metrics import percentile
+    
+    slots = threading.Semaphore(max(1, concurrency))
+    latencies = []
+    errors = [0]
+    done = threading.Event()
+    remaining = [calls]
+    lock = threading.Lock()
+    
+    def on_done(future, submitted):
+        elapsed_ms = (time.perf_counter() - submitted) * 1000
+        try:
+            failed = future.result().get('status') != 'success'
+        except BaseException:
+            failed = True
+        with lock:
+            latencies.append(elapsed_ms)
+            errors[0] += failed
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+        slots.release()
+    
+    start = time.perf_counter()
+    for i in range(calls):
+        slots.acquire()
+        submitted = time.perf_counter()
+        future = client.submit_call(f"bench-{i}", tool, arguments)
+        future.add_done_callback(lambda f, s=submitted: on_done(f, s))
+    if calls:
+        done.wait()
+    seconds = time.perf_counter() - start
+    return {
+        "calls": calls,
+        "errors": errors[0],
+        "calls_per_second": round(calls / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None
+    }
+
+
+def benchmark_mcp_transports(calls: int = 200, concurrency: int = 8, sleep_ms: int = 0) -> str:
+    """
+    用本地测试服务器（mcp_test_server.py）比较stdio、sse和streamable_http传输的吞吐量和延迟
+    
+    参数:
+        calls: 每种传输的调用次数
+        concurrency: 同时进行的调用数
+        sleep_ms: 大于0时调用服务器端异步等待的sleep工具，否则调用echo
+    
+    返回:
+        包含各传输连接耗时、吞吐量、延迟分位数和HTTP连接池统计的JSON字符串
+    """
+    from mcp import StdioServerParameters, stdio_client
+    from mcp_client import MCPClient
+    from mcp_http import http_transport_factory, get_http_pool
+    from mcp_test_server import HTTP_PATHS
+    
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcp_test_server.py')
+    if sleep_ms > 0:
+        tool, arguments = 'sleep', {"seconds": sleep_ms / 1000.0}
+    else:
+        tool, arguments = 'echo', {"text": "ping"}
+    
+    results = {}
+    for transport in ('stdio', 'sse', 'streamable_http'):
+        process = None
+        try:
+            if transport == 'stdio':
+                def factory():
+                    return stdio_client(StdioServerParameters(
+                        command=sys.executable, args=[server_path, '--transport', 'stdio']
+                    ))
+            else:
+                port = _free_port()
+                process = subprocess.Popen(
+                    [sys.executable, server_path, '--transport', transport, '--port', str(port)],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                if not _wait_for_port(port, 30):
+                    raise RuntimeError(f"测试服务器未能在30秒内监听端口 {port}")
+                factory = http_transport_factory(transport, f"http://127.0.0.1:{port}{HTTP_PATHS[transport]}")
+            
+            connect_start = time.perf_counter()
+            with MCPClient(factory, timeout_seconds=30, name=f"benchmark-{transport}") as client:
+                connect_ms = round((time.perf_counter() - connect_start) * 1000, 1)
+                result = _run_transport_benchmark(client, calls, concurrency, tool, arguments)
+                result["connect_ms"] = connect_ms
+                if transport != 'stdio':
+                    result["pool"] = get_http_pool().get_stats()
+            results[transport] = result
+        except Exception as e:
+            logger.error(f"MCP传输基准测试失败 ({transport}): {e}")
+            results[transport] = {"error": str(e)}
+        finally:
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    
+    result = {"calls": calls, "concurrency": concurrency, "tool": tool, "transports": results}
+    logger.info(f"MCP传输基准测试: {result}")
+    return json.dumps(result, ensure_ascii=False)
@@ -0,0 +1,186 @@
+"""
+有界帧缓冲模块
+位于Agent生产者（事件循环线程）和Unity消费者（宿主线程）之间，容量有限：
+缓冲满时正文帧合并到末尾正文帧，每个工具的进度帧只保留最新一条，状态、工具帧和终止帧从不丢弃（生产者等待）
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from stream_frames import StreamFrame, FRAME_TEXT, FRAME_PROGRESS
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认容量（帧数）
+DEFAULT_CAPACITY = int(os.environ.get('UNITY_AGENT_STREAM_BUFFER_CAPACITY', '256'))
+
+
+class BufferStats:
+    """缓冲策略触发次数统计"""
+    
+    FIELDS = ('frames_in', 'frames_out', 'text_merged', 'progress_collapsed',
+              'backpressure_waits', 'high_watermark')
+    
+    def __init__(self):
+        self.frames_in = 0
+        self.frames_out = 0
+        self.text_merged = 0
+        self.progress_collapsed = 0
+        self.backpressure_waits = 0
+        self.backpressure_seconds = 0.0
+        self.high_watermark = 0
+    
+    def add(self, other: 'BufferStats'):
+        """累加另一个缓冲的统计"""
+        for field in self.FIELDS:
+            if field == 'high_watermark':
+                self.high_watermark = max(self.high_watermark, other.high_watermark)
+            else:
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.backpressure_seconds += other.backpressure_seconds
+    
+    def snapshot(self) -> Dict[str, Any]:
+        result = {field: getattr(self, field) for field in self.FIELDS}
+        result["backpressure_ms"] = round(self.backpressure_seconds * 1000, 1)
+        return result
+
+
+class FrameBuffer:
+    """单个流的有界帧缓冲"""
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """
+        参数:
+            capacity: 最多缓冲的帧数
+        """
+        self.capacity = max(1, capacity)
+        self._frames = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._space_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._ended = False
+        self.stats = BufferStats()
+    
+    def __len__(self):
+        return len(self._frames)
+    
+    @property
+    def ended(self) -> bool:
+        """生产者是否已结束"""
+        return self._ended
+    
+    async def put(self, frame: StreamFrame) -> bool:
+        """
+        写入一帧，缓冲满时按帧类别应用溢出策略，必要时等待消费者取走帧
+        
+        参数:
+            frame: 要写入的帧
+        
+        返回:
+            是否写入成功（缓冲已结束时返回False，生产者应停止）
+        """
+        waited_since = None
+        while True:
+            with self._lock:
+                if self._ended:
+                    return False
+                if self._offer(frame):
+                    if waited_since is not None:
+                        self.stats.backpressure_seconds += time.perf_counter() - waited_since
+                    self._not_empty.notify()
+                    return True
+                # 工具帧、状态帧等不可丢弃的帧：等待消费者腾出空间
+                loop = asyncio.get_running_loop()
+                waiter = loop.create_future()
+                self._space_waiters.append((loop, waiter))
+                self.stats.backpressure_waits += 1
+                if waited_since is None:
+                    waited_since = time.perf_counter()
+            await waiter
+    
+    def _offer(self, frame: StreamFrame) -> bool:
+        """在持有锁时尝试写入，返回是否成功"""
+        frames = self._frames
+        self.stats.frames_in += 1
+        if len(frames) < self.capacity:
+            frames.append(frame)
+            if len(frames) > self.stats.high_watermark:
+                self.stats.high_watermark = len(frames)
+            return True
+        
+        if frame.kind == FRAME_TEXT and frames[-1].kind == FRAME_TEXT:
+            # 正文合并到末尾的正文帧，保持顺序
+            frames[-1] = StreamFrame(FRAME_TEXT, frames[-1].content + frame.content)
+            self.stats.text_merged += 1
+            return True
+        
+        if frame.kind == FRAME_PROGRESS:
+            # 同一工具的进度帧只保留最新一条，移到末尾以保持与其他帧的先后顺序
+            for index in range(len(frames) - 1, -1, -1):
+                if frames[index].kind == FRAME_PROGRESS and frames[index].key == frame.key:
+                    del frames[index]
+                    frames.append(frame)
+                    self.stats.progress_collapsed += 1
+                    return True
+        
+        self.stats.frames_in -= 1
+        return False
+    
+    def finish(self, final_frame: Optional[StreamFrame] = None):
+        """
+        结束缓冲：追加最后一帧（不受容量限制），之后的写入都会失败
+        
+        参数:
+            final_frame: 可选的最后一帧（例如取消帧）
+        """
+        with self._lock:
+            if self._ended:
+                return
+            if final_frame is not None:
+                self._frames.append(final_frame)
+                self.stats.frames_in += 1
+            self._ended = True
+            self._not_empty.notify_all()
+            self._wake_producers()
+    
+    def get_batch(self, max_frames: int, timeout: float) -> Tuple[List[StreamFrame], bool]:
+        """
+        取出一批帧：没有帧时最多等待timeout秒
+        
+        参数:
+            max_frames: 最多取出的帧数
+            timeout: 等待时间（秒）
+        
+        返回:
+            (帧列表, 是否已全部取完且生产者已结束)
+        """
+        with self._not_empty:
+            if not self._frames and not self._ended and timeout > 0:
+                self._not_empty.wait(timeout)
+            batch = []
+            while self._frames and len(batch) < max_frames:
+                batch.append(self._frames.popleft())
+            if batch:
+                self.stats.frames_out += len(batch)
+                self._wake_producers()
+            return batch, self._ended and not self._frames
+    
+    def _wake_producers(self):
+        waiters, self._space_waiters = self._space_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
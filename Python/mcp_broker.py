@@ -0,0 +1,945 @@
+"""
+MCP代理进程（broker）
+可选的本地常驻进程，持有stdio MCP服务器子进程和会话，生命周期与Unity内嵌解释器无关：
+域重载或重新加载配置后，MCPManager通过Unix域套接字重新连接代理，直接复用已在运行的服务器，
+不再重复每个服务器的冷启动。一条连接上的请求按id多路复用，没有连接使用的服务器空闲一段时间后由代理关闭，
+没有连接也没有服务器时代理自行退出：
+
+    python mcp_broker.py --socket /tmp/unity_ai_agent_mcp.sock
+"""
+
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from mcp_spill import get_spill_store
+from mcp_stats import MCPServerStats, content_bytes, error_outcome
+from stream_cancel import current_scope
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+try:
+    from mcp.types import Tool
+except ImportError:
+    Tool = None
+
+# list_tools_sync与MCPClient一样返回Strands的MCPAgentTool
+try:
+    from strands.tools.mcp import MCPAgentTool
+except ImportError:
+    MCPAgentTool = None
+
+# 协议版本，代理和内嵌进程不一致时拒绝连接
+PROTOCOL_VERSION = 1
+# 没有连接使用的服务器保留多久后关闭（秒）
+DEFAULT_SERVER_IDLE_SECONDS = 600
+# 没有连接也没有服务器时代理进程保留多久后退出（秒）
+DEFAULT_BROKER_IDLE_SECONDS = 600
+# 启动代理进程后等待套接字可连接的最长时间（秒）
+BROKER_START_TIMEOUT_SECONDS = 10
+# 代理检查服务器存活和空闲的间隔（秒）
+MONITOR_INTERVAL_SECONDS = 1.0
+# 单条消息的长度上限（字节）
+MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+# 连接和短请求（打开、释放、统计）的默认超时（秒）
+REQUEST_TIMEOUT_SECONDS = 5
+
+
+class MCPBrokerError(RuntimeError):
+    """代理不可用、连接断开或代理返回的错误"""
+    pass
+
+
+def broker_supported() -> bool:
+    """当前平台是否支持Unix域套接字"""
+    return hasattr(socket, 'AF_UNIX')
+
+
+def default_socket_path() -> str:
+    """
+    默认套接字路径：临时目录下每个用户一个目录，目录中按Unity项目区分
+    （套接字路径长度有限，不放在项目目录中）
+    """
+    project_root = os.path.abspath(os.environ.get('PROJECT_ROOT_PATH') or os.getcwd())
+    digest = hashlib.sha256(project_root.encode('utf-8')).hexdigest()[:12]
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), f"unity_ai_agent_mcp_{uid}", f"{digest}.sock")
+
+
+def _ensure_socket_dir(socket_path: str):
+    """创建套接字所在的目录（只有当前用户可以访问）"""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+
+def _peer_uid(sock: socket.socket, socket_path: str) -> Optional[int]:
+    """
+    套接字对端进程的用户ID：支持SO_PEERCRED时取对端进程的凭据，否则取套接字文件的所有者
+    
+    返回:
+        用户ID；平台没有用户ID时返回None
+    """
+    if not hasattr(os, 'getuid'):
+        return None
+    if hasattr(socket, 'SO_PEERCRED'):
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', credentials)[1]
+    return os.stat(socket_path).st_uid
+
+
+def default_python() -> str:
+    """启动代理进程的Python解释器（内嵌时sys.executable可能是Unity本身）"""
+    executable = sys.executable or ''
+    if os.path.basename(executable).lower().startswith('python'):
+        return executable
+    return shutil.which('python3') or shutil.which('python') or executable
+
+
+def server_key(server_config: Dict[str, Any]) -> str:
+    """服务器配置的指纹，配置完全相同的服务器在代理中共用一个会话"""
+    canonical = json.dumps(server_config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:24]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+
+def _object_hook(value: Dict[str, Any]) -> Any:
+    if len(value) == 1 and "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    """编码一条消息：一行JSON，工具结果中的图片字节用base64表示"""
+    return json.dumps(message, ensure_ascii=False, default=_json_default).encode('utf-8') + b"\n"
+
+
+def decode_message(line: bytes) -> Dict[str, Any]:
+    """解码一条消息"""
+    return json.loads(line, object_hook=_object_hook)
+
+
+class _ManagedServer:
+    """代理中的一个MCP服务器"""
+    
+    def __init__(self, key: str, config: Dict[str, Any]):
+        self.key = key
+        self.config = config
+        self.name = config.get('name', 'unknown')
+        self.client = None
+        self.start_lock = asyncio.Lock()
+        # 正在使用该服务器的连接
+        self.attached = set()
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+        self.starts = 0
+        self.calls = 0
+        self.errors = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "alive": self.client is not None and self.client.is_alive(),
+            "attached": len(self.attached),
+            "in_flight": self.in_flight,
+            "starts": self.starts,
+            "calls": self.calls,
+            "errors": self.errors,
+            "idle_seconds": round(time.monotonic() - self.last_used, 2)
+        }
+
+
+class MCPBroker:
+    """代理进程的服务端：接受内嵌进程的连接，按配置指纹启动、复用和回收MCP服务器"""
+    
+    def __init__(self, socket_path: str, client_factory: Callable[[Dict[str, Any]], Any],
+                 server_idle_seconds: float = DEFAULT_SERVER_IDLE_SECONDS,
+                 broker_idle_seconds: float = DEFAULT_BROKER_IDLE_SECONDS):
+        """
+        参数:
+            socket_path: 监听的Unix域套接字路径
+            client_factory: 根据服务器配置创建MCP客户端的函数
+            server_idle_seconds: 没有连接使用的服务器保留多久后关闭（秒）
+            broker_idle_seconds: 没有连接也没有服务器时多久后退出（秒）
+        """
+        self.socket_path = socket_path
+        self._client_factory = client_factory
+        self.server_idle_seconds = server_idle_seconds
+        self.broker_idle_seconds = broker_idle_seconds
+        self._servers: Dict[str, _ManagedServer] = {}
+        # 连接ID -> (写入流, 写入锁)
+        self._connections: Dict[int, Any] = {}
+        # (连接ID, 请求ID) -> 正在执行的请求任务，用于取消
+        self._tasks: Dict[Any, asyncio.Task] = {}
+        self._ids = itertools.count(1)
+        self._started = time.monotonic()
+        self._last_activity = time.monotonic()
+        self._stop: Optional[asyncio.Event] = None
+        self._handlers = {
+            "hello": self._op_hello,
+            "open": self._op_open,
+            "release": self._op_release,
+            "list_tools": self._op_list_tools,
+            "call_tool": self._op_call_tool,
+            "ping": self._op_ping,
+            "cancel": self._op_cancel,
+            "stats": self._op_stats,
+            "shutdown": self._op_shutdown
+        }
+    
+    async def serve(self):
+        """监听套接字直到被要求关闭或空闲退出"""
+        self._stop = asyncio.Event()
+        if os.path.exists(self.socket_path):
+            if _probe(self.socket_path):
+                logger.info(f"MCP代理已在运行: {self.socket_path}")
+                return
+            # 上一个代理异常退出留下的套接字文件
+            os.unlink(self.socket_path)
+        
+        _ensure_socket_dir(self.socket_path)
+        # 绑定前收紧umask，套接字文件创建时就只有当前用户可以连接（绑定后再chmod会留下一段可连接的时间）
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path,
+                                                     limit=MAX_MESSAGE_BYTES)
+        finally:
+            os.umask(umask)
+        inode = os.stat(self.socket_path).st_ino
+        logger.info(f"MCP代理已启动（pid {os.getpid()}）: {self.socket_path}")
+        try:
+            await self._monitor()
+        finally:
+            server.close()
+            for task in list(self._tasks.values()):
+                task.cancel()
+            loop = asyncio.get_running_loop()
+            for server_entry in list(self._servers.values()):
+                await loop.run_in_executor(None, self._stop_client, server_entry)
+            self._servers.clear()
+            try:
+                # 只删除自己创建的套接字文件
+                if os.stat(self.socket_path).st_ino == inode:
+                    os.unlink(self.socket_path)
+            except OSError:
+                pass
+            logger.info("MCP代理已退出")
+    
+    async def _monitor(self):
+        """定期检查：通知服务器断开、关闭空闲服务器、空闲时退出"""
+        loop = asyncio.get_running_loop()
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), MONITOR_INTERVAL_SECONDS)
+                return
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            for server in list(self._servers.values()):
+                if server.start_lock.locked():
+                    continue
+                client = server.client
+                if client is not None and not client.is_alive():
+                    reason = getattr(client, 'disconnect_reason', None) or "会话已断开"
+                    logger.warning(f"MCP服务器 '{server.name}' 已断开: {reason}")
+                    await loop.run_in_executor(None, self._stop_client, server)
+                    for conn_id in list(server.attached):
+                        await self._send(conn_id, {"event": "server_down", "key": server.key, "reason": reason})
+                elif (not server.attached and server.in_flight == 0
+                      and now - server.last_used > self.server_idle_seconds):
+                    logger.info(f"关闭空闲的MCP服务器 '{server.name}'")
+                    del self._servers[server.key]
+                    await loop.run_in_executor(None, self._stop_client, server)
+            if (not self._connections and not self._servers
+                    and now - self._last_activity > self.broker_idle_seconds):
+                logger.info(f"MCP代理空闲超过 {self.broker_idle_seconds}秒，退出")
+                return
+    
+    @staticmethod
+    def _stop_client(server: _ManagedServer):
+        client, server.client = server.client, None
+        MCPBroker._close_client(server.name, client)
+    
+    @staticmethod
+    def _close_client(name: str, client):
+        if client is not None:
+            try:
+                client.stop()
+            except Exception as e:
+                logger.warning(f"关闭MCP服务器 '{name}' 时出错: {e}")
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn_id = next(self._ids)
+        self._connections[conn_id] = (writer, asyncio.Lock())
+        self._last_activity = time.monotonic()
+        logger.info(f"连接 {conn_id} 已建立")
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+                    logger.warning(f"连接 {conn_id} 读取失败: {e}")
+                    break
+                if not line:
+                    break
+                try:
+                    message = decode_message(line)
+                except ValueError as e:
+                    logger.warning(f"连接 {conn_id} 收到无法解析的消息: {e}")
+                    continue
+                task_key = (conn_id, message.get("id"))
+                task = asyncio.ensure_future(self._dispatch(conn_id, message))
+                self._tasks[task_key] = task
+                task.add_done_callback(lambda _, task_key=task_key: self._tasks.pop(task_key, None))
+        finally:
+            for (owner, _), task in list(self._tasks.items()):
+                if owner == conn_id:
+                    task.cancel()
+            self._connections.pop(conn_id, None)
+            for server in self._servers.values():
+                if conn_id in server.attached:
+                    server.attached.discard(conn_id)
+                    server.last_used = time.monotonic()
+            self._last_activity = time.monotonic()
+            writer.close()
+            logger.info(f"连接 {conn_id} 已断开")
+    
+    async def _dispatch(self, conn_id: int, message: Dict[str, Any]):
+        request_id = message.get("id")
+        handler = self._handlers.get(message.get("op"))
+        try:
+            if handler is None:
+                raise MCPBrokerError(f"未知的操作: {message.get('op')}")
+            response = {"id": request_id, "ok": True, "result": await handler(conn_id, message)}
+        except asyncio.CancelledError:
+            response = {"id": request_id, "ok": False, "error": "调用已被取消", "cancelled": True}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "error": str(e) or type(e).__name__,
+                        "timeout": error_outcome(e) == "timeout"}
+        await self._send(conn_id, response)
+    
+    async def _send(self, conn_id: int, message: Dict[str, Any]):
+        connection = self._connections.get(conn_id)
+        if connection is None:
+            return
+        writer, lock = connection
+        async with lock:
+            try:
+                writer.write(encode_message(message))
+                await writer.drain()
+            except (ConnectionError, RuntimeError) as e:
+                logger.debug(f"连接 {conn_id} 写入失败: {e}")
+    
+    def _require_server(self, message: Dict[str, Any]) -> _ManagedServer:
+        server = self._servers.get(message.get("key"))
+        if server is None or server.client is None:
+            raise MCPBrokerError(f"MCP服务器未在代理中运行: {message.get('key')}")
+        return server
+    
+    async def _op_hello(self, conn_id: int, message: Dict[str, Any]) -> Dict[str, Any]:
+        if message.get("version") != PROTOCOL_VERSION:
+            raise MCPBrokerError(f"协议版本不一致: 代理 {PROTOCOL_VERSION}，客户端 {message.get('version')}")
+        return {"pid": os.getpid(), "version": PROTOCOL_VERSION, "servers": len(self._servers)}
+    
+    async def _op_open(self, conn_id: int, message: Dict[str, Any]) -> Dict[str, Any]:
+        key = message["key"]
+        server = self._servers.get(key)
+        if server is None:
+            server = self._servers[key] = _ManagedServer(key, message["config"])
+        async with server.start_lock:
+            reused = server.client is not None and server.client.is_alive()
+            if not reused:
+                loop = asyncio.get_running_loop()
+                if server.client is not None:
+                    await loop.run_in_executor(None, self._stop_client, server)
+                start = loop.run_in_executor(None, self._start_client, server.config)
+                # 客户端在回调中交给服务器：请求被取消（如内嵌进程的打开超时）时线程池中的启动仍会完成，
+                # 届时由回调接管或关闭，不会留下没有人持有的服务器进程
+                start.add_done_callback(functools.partial(self._on_client_started, server, time.monotonic()))
+                await asyncio.shield(start)
+        server.attached.add(conn_id)
+        server.last_used = time.monotonic()
+        server_info = getattr(server.client, 'server_info', None)
+        return {
+            "reused": reused,
+            "starts": server.starts,
+            "server_info": server_info.model_dump(mode='json') if hasattr(server_info, 'model_dump') else None
+        }
+    
+    def _on_client_started(self, server: _ManagedServer, started: float, future: asyncio.Future):
+        """启动完成的回调（在事件循环中）：把客户端交给服务器，服务器已被移除或已有可用客户端时关闭它"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        client = future.result()
+        current = server.client
+        if self._servers.get(server.key) is not server or (current is not None and current.is_alive()):
+            logger.info(f"MCP服务器 '{server.name}' 的启动结果已不需要，关闭")
+            asyncio.get_running_loop().run_in_executor(None, self._close_client, server.name, client)
+            return
+        server.client = client
+        server.starts += 1
+        logger.info(f"MCP服务器 '{server.name}' 已启动（第{server.starts}次），耗时 {time.monotonic() - started:.2f}秒")
+    
+    def _start_client(self, config: Dict[str, Any]):
+        client = self._client_factory(config)
+        if client is None:
+            raise MCPBrokerError(f"无法创建MCP服务器 '{config.get('name', 'unknown')}' 的客户端")
+        # 结果原样返回，由内嵌进程按自己的配置落盘
+        client.spill_store = None
+        client.start()
+        return client
+    
+    async def _op_release(self, conn_id: int, message: Dict[str, Any]) -> None:
+        server = self._servers.get(message.get("key"))
+        if server is not None and conn_id in server.attached:
+            server.attached.discard(conn_id)
+            server.last_used = time.monotonic()
+    
+    async def _op_list_tools(self, conn_id: int, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        server = self._require_server(message)
+        server.last_used = time.monotonic()
+        loop = asyncio.get_running_loop()
+        tools = await loop.run_in_executor(None, server.client.list_tools_sync)
+        return [getattr(tool, 'mcp_tool', tool).model_dump(mode='json', exclude_none=True) for tool in tools]
+    
+    async def _op_call_tool(self, conn_id: int, message: Dict[str, Any]) -> Dict[str, Any]:
+        server = self._require_server(message)
+        server.in_flight += 1
+        server.calls += 1
+        try:
+            return await server.client.call_tool_async(message["tool_use_id"], message["name"],
+                                                       message.get("arguments"), message.get("timeout"))
+        except Exception:
+            server.errors += 1
+            raise
+        finally:
+            server.in_flight -= 1
+            server.last_used = time.monotonic()
+    
+    async def _op_ping(self, conn_id: int, message: Dict[str, Any]) -> None:
+        server = self._require_server(message)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, server.client.ping_sync, float(message.get("ping_timeout") or 10))
+    
+    async def _op_cancel(self, conn_id: int, message: Dict[str, Any]) -> int:
+        cancelled = 0
+        for target in message.get("targets") or []:
+            task = self._tasks.get((conn_id, target))
+            if task is not None and task.cancel():
+                cancelled += 1
+        return cancelled
+    
+    async def _op_stats(self, conn_id: int, message: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.monotonic() - self._started, 2),
+            "connections": len(self._connections),
+            "servers": {key: server.to_dict() for key, server in self._servers.items()}
+        }
+    
+    async def _op_shutdown(self, conn_id: int, message: Dict[str, Any]) -> None:
+        logger.info(f"连接 {conn_id} 要求代理退出")
+        self._stop.set()
+
+
+def _probe(socket_path: str) -> bool:
+    """套接字上是否有代理在监听"""
+    sock = _connect(socket_path)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def _connect(socket_path: str, timeout: float = 1.0) -> Optional[socket.socket]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+class BrokerConnection:
+    """
+    内嵌进程到代理的连接
+    请求按id多路复用，后台线程读取响应和事件；连接断开后下一次请求时重新连接，代理不在运行时先启动它
+    """
+    
+    def __init__(self, socket_path: str, python: Optional[str] = None,
+                 server_idle_seconds: float = DEFAULT_SERVER_IDLE_SECONDS,
+                 broker_idle_seconds: float = DEFAULT_BROKER_IDLE_SECONDS):
+        """
+        参数:
+            socket_path: 代理的Unix域套接字路径
+            python: 启动代理进程的Python解释器，默认default_python()
+            server_idle_seconds: 传给新启动代理的服务器空闲关闭时间（秒）
+            broker_idle_seconds: 传给新启动代理的自行退出时间（秒）
+        """
+        self.socket_path = socket_path
+        self.python = python or default_python()
+        self.server_idle_seconds = server_idle_seconds
+        self.broker_idle_seconds = broker_idle_seconds
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[int, concurrent.futures.Future] = {}
+        self._ids = itertools.count(1)
+        # 服务器指纹 -> 使用该服务器的BrokerClient，接收服务器断开事件
+        self._clients: Dict[str, set] = {}
+        self.broker_pid: Optional[int] = None
+        self.connects = 0
+        self.spawns = 0
+    
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+    
+    def _ensure_connected(self):
+        """连接代理（调用方持有self._lock），代理不在运行时启动它"""
+        if self._sock is not None:
+            return
+        sock = _connect(self.socket_path)
+        if sock is None:
+            self._spawn()
+            deadline = time.monotonic() + BROKER_START_TIMEOUT_SECONDS
+            while sock is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+                sock = _connect(self.socket_path)
+            if sock is None:
+                raise MCPBrokerError(f"MCP代理未能在{BROKER_START_TIMEOUT_SECONDS}秒内启动: {self.socket_path}")
+        
+        # 只连接当前用户启动的代理，其他用户放置的套接字可能冒充代理
+        try:
+            uid = _peer_uid(sock, self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise MCPBrokerError(f"无法确认MCP代理的所有者: {e}")
+        if uid is not None and uid != os.getuid():
+            sock.close()
+            raise MCPBrokerError(f"MCP代理套接字属于其他用户（uid {uid}），拒绝连接: {self.socket_path}")
+        
+        hello_id = next(self._ids)
+        try:
+            sock.settimeout(REQUEST_TIMEOUT_SECONDS)
+            sock.sendall(encode_message({"id": hello_id, "op": "hello", "version": PROTOCOL_VERSION}))
+            reader = sock.makefile('rb')
+            response = decode_message(reader.readline())
+            sock.settimeout(None)
+        except (OSError, ValueError) as e:
+            sock.close()
+            raise MCPBrokerError(f"连接MCP代理失败: {e}")
+        if not response.get("ok"):
+            sock.close()
+            raise MCPBrokerError(response.get("error"))
+        self.broker_pid = response["result"]["pid"]
+        self._sock = sock
+        self.connects += 1
+        threading.Thread(target=self._read_loop, args=(sock, reader), name="MCPBrokerReader", daemon=True).start()
+        logger.info(f"已连接MCP代理（pid {self.broker_pid}，已有 {response['result']['servers']} 个服务器）")
+    
+    def _spawn(self):
+        """启动代理进程：独立的会话，不随Unity进程组一起退出，日志写在套接字旁边"""
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcp_broker.py')
+        command = [self.python, script, '--socket', self.socket_path,
+                   '--server-idle-seconds', str(self.server_idle_seconds),
+                   '--broker-idle-seconds', str(self.broker_idle_seconds)]
+        logger.info(f"启动MCP代理: {' '.join(command)}")
+        _ensure_socket_dir(self.socket_path)
+        with open(self.socket_path + '.log', 'ab') as log_file:
+            subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                             cwd=os.path.dirname(script), start_new_session=True, close_fds=True)
+        self.spawns += 1
+    
+    def _read_loop(self, sock: socket.socket, reader):
+        reason = "代理关闭了连接"
+        try:
+            for line in reader:
+                message = decode_message(line)
+                if "event" in message:
+                    self._on_event(message)
+                    continue
+                future = self._pending.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if message.get("ok"):
+                    future.set_result(message.get("result"))
+                elif message.get("cancelled"):
+                    future.cancel()
+                elif message.get("timeout"):
+                    future.set_exception(TimeoutError(message.get("error")))
+                else:
+                    future.set_exception(MCPBrokerError(message.get("error")))
+        except (OSError, ValueError) as e:
+            reason = str(e) or type(e).__name__
+        finally:
+            self._on_disconnected(sock, reason)
+    
+    def _on_event(self, message: Dict[str, Any]):
+        if message.get("event") == "server_down":
+            for client in list(self._clients.get(message.get("key"), ())):
+                client.on_server_down(message.get("reason"))
+    
+    def _on_disconnected(self, sock: socket.socket, reason: str):
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            pending, self._pending = self._pending, {}
+            clients = [client for group in self._clients.values() for client in group]
+        try:
+            sock.close()
+        except OSError:
+            pass
+        logger.warning(f"与MCP代理的连接已断开: {reason}")
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(MCPBrokerError(f"与MCP代理的连接已断开: {reason}"))
+        for client in clients:
+            client.on_server_down(f"与MCP代理的连接已断开: {reason}")
+    
+    def request(self, op: str, connect: bool = True, **params) -> concurrent.futures.Future:
+        """
+        发送一个请求，不等待结果
+        
+        参数:
+            op: 操作名称
+            connect: 未连接时是否连接（必要时启动代理）；为False且未连接时返回None
+            **params: 请求参数
+        
+        返回:
+            结果为代理返回值的Future，附带request_id属性
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if not connect and self._sock is None:
+                return None
+            self._ensure_connected()
+            request_id = next(self._ids)
+            future.request_id = request_id
+            future.op = op
+            self._pending[request_id] = future
+            try:
+                self._sock.sendall(encode_message({"id": request_id, "op": op, **params}))
+            except OSError as e:
+                self._pending.pop(request_id, None)
+                raise MCPBrokerError(f"向MCP代理发送请求失败: {e}")
+        return future
+    
+    def call(self, op: str, timeout: float = REQUEST_TIMEOUT_SECONDS, **params) -> Any:
+        """发送请求并等待结果，超时时取消代理中的请求"""
+        future = self.request(op, **params)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            self.cancel([future])
+            raise TimeoutError(f"MCP代理请求 {op} 超过 {timeout}秒未返回")
+    
+    def cancel(self, futures: List[concurrent.futures.Future]) -> int:
+        """取消等待中的请求，同时通知代理中止对应的调用"""
+        targets = []
+        for future in futures:
+            if self._pending.pop(future.request_id, None) is not None and future.cancel():
+                targets.append(future.request_id)
+        if targets:
+            try:
+                self.request("cancel", connect=False, targets=targets)
+            except MCPBrokerError as e:
+                logger.debug(f"通知MCP代理取消请求失败: {e}")
+        return len(targets)
+    
+    def add_client(self, key: str, client: 'BrokerClient'):
+        with self._lock:
+            self._clients.setdefault(key, set()).add(client)
+    
+    def remove_client(self, key: str, client: 'BrokerClient'):
+        with self._lock:
+            group = self._clients.get(key)
+            if group is not None:
+                group.discard(client)
+                if not group:
+                    del self._clients[key]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """连接状态，已连接时附带代理中的服务器状态"""
+        stats = {
+            "socket": self.socket_path,
+            "connected": self.connected,
+            "broker_pid": self.broker_pid,
+            "connects": self.connects,
+            "spawns": self.spawns,
+            "pending": len(self._pending)
+        }
+        if self.connected:
+            try:
+                stats["broker"] = self.call("stats", timeout=2)
+            except Exception as e:
+                stats["broker"] = {"error": str(e)}
+        return stats
+    
+    def shutdown_broker(self):
+        """要求代理关闭所有服务器并退出"""
+        future = self.request("shutdown")
+        future.result(timeout=REQUEST_TIMEOUT_SECONDS)
+
+
+class BrokerClient:
+    """通过代理访问的MCP客户端，接口与MCPClient一致，由MCPSession管理"""
+    
+    def __init__(self, connection: BrokerConnection, server_config: Dict[str, Any],
+                 timeout_seconds: float = 30, call_timeout_seconds: float = 30,
+                 stats: Optional[MCPServerStats] = None):
+        """
+        参数:
+            connection: 到代理的连接
+            server_config: 服务器配置（代理据此启动服务器，并发上限也由代理中的客户端执行）
+            timeout_seconds: 打开服务器（代理中冷启动时包括连接和握手）的最长时间（秒）
+            call_timeout_seconds: 每次工具调用的期限（秒）
+            stats: 调用统计，往返时间包括经过代理的开销（排队发生在代理进程中，不单独记录）
+        """
+        self.connection = connection
+        self.server_config = server_config
+        self.key = server_key(server_config)
+        self.name = server_config.get('name', 'mcp')
+        self.timeout_seconds = timeout_seconds
+        self.call_timeout_seconds = call_timeout_seconds
+        self.spill_store = get_spill_store()
+        self.stats = stats or MCPServerStats(self.name)
+        self.server_info = None
+        # 本次打开时代理中是否已有运行的服务器
+        self.reused = False
+        self.disconnect_reason: Optional[str] = None
+        self._started = False
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+    
+    def is_alive(self) -> bool:
+        """会话是否可用：已打开、代理连接未断开、服务器未断开"""
+        return self._started and self.disconnect_reason is None and self.connection.connected
+    
+    def on_server_down(self, reason: str):
+        """代理报告服务器断开或代理连接断开（在读取线程中调用）"""
+        if self._started and self.disconnect_reason is None:
+            self.disconnect_reason = reason
+            logger.warning(f"MCP会话 '{self.name}' 已断开: {reason}")
+    
+    def start(self):
+        """在代理中打开服务器，已在运行时直接复用"""
+        if self._started:
+            return
+        self.connection.add_client(self.key, self)
+        try:
+            result = self.connection.call("open", timeout=self.timeout_seconds, key=self.key,
+                                          config=self.server_config)
+        except Exception as e:
+            self.connection.remove_client(self.key, self)
+            from mcp_client import MCPClientInitializationError
+            raise MCPClientInitializationError(f"通过MCP代理打开服务器失败: {e}")
+        self.reused = result.get("reused", False)
+        self.server_info = result.get("server_info")
+        self.disconnect_reason = None
+        self._started = True
+        logger.info(f"MCP服务器 '{self.name}' 已通过代理打开（{'复用已运行的服务器' if self.reused else '新启动'}）")
+    
+    def stop(self):
+        """释放服务器，服务器留在代理中直到空闲超时"""
+        if not self._started:
+            return
+        self._started = False
+        self.connection.remove_client(self.key, self)
+        try:
+            self.connection.request("release", connect=False, key=self.key)
+        except MCPBrokerError as e:
+            logger.debug(f"释放MCP服务器 '{self.name}' 失败: {e}")
+    
+    def _require_started(self):
+        if not self._started:
+            raise RuntimeError(f"MCP客户端 '{self.name}' 未启动")
+    
+    def ping_sync(self, timeout_seconds: float = 10):
+        """通过代理向服务器发送ping，失败或超时时抛出异常"""
+        self._require_started()
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            self.connection.call("ping", timeout=timeout_seconds + 1, key=self.key, ping_timeout=timeout_seconds)
+        except Exception as e:
+            outcome = error_outcome(e)
+            raise
+        finally:
+            self.stats.record("ping", outcome, round_trip_ms=(time.monotonic() - started) * 1000)
+    
+    def list_tools_sync(self, timeout_seconds: float = 30) -> List[Any]:
+        """
+        同步获取工具列表
+        
+        返回:
+            MCPAgentTool列表（Strands不可用时为MCP原始Tool列表）
+        """
+        self._require_started()
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            tools = [Tool.model_validate(item) for item in
+                     self.connection.call("list_tools", timeout=timeout_seconds, key=self.key)]
+        except Exception as e:
+            outcome = error_outcome(e)
+            raise
+        finally:
+            self.stats.record("list_tools", outcome, round_trip_ms=(time.monotonic() - started) * 1000)
+        logger.info(f"MCP服务器 '{self.name}' 返回 {len(tools)} 个工具（经代理）")
+        if MCPAgentTool is None:
+            return tools
+        return [MCPAgentTool(tool, self) for tool in tools]
+    
+    def _timeout_seconds(self, read_timeout_seconds) -> float:
+        timeout = read_timeout_seconds or self.call_timeout_seconds
+        if hasattr(timeout, 'total_seconds'):
+            timeout = timeout.total_seconds()
+        return float(timeout)
+    
+    def submit_call(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                    read_timeout_seconds=None) -> concurrent.futures.Future:
+        """把一次工具调用发送给代理，不等待结果"""
+        self._require_started()
+        bytes_in = len(json.dumps(arguments or {}, ensure_ascii=False, default=str).encode('utf-8'))
+        started = time.monotonic()
+        future = self.connection.request("call_tool", key=self.key, tool_use_id=tool_use_id, name=name,
+                                         arguments=arguments, timeout=self._timeout_seconds(read_timeout_seconds))
+        future.add_done_callback(lambda done: self._record_call(name, done, started, bytes_in))
+        # 登记到发起调用的流，取消该流时只中止它自己的调用（同时通知代理）
+        scope = current_scope()
+        if scope is not None:
+            scope.add_call(future, lambda: self.connection.cancel([future]))
+        return future
+    
+    def _record_call(self, name: str, future: concurrent.futures.Future, started: float, bytes_in: int):
+        round_trip_ms = (time.monotonic() - started) * 1000
+        bytes_out = None
+        if future.cancelled():
+            outcome = "cancelled"
+        elif future.exception() is not None:
+            outcome = error_outcome(future.exception())
+        else:
+            result = future.result()
+            outcome = "tool_error" if result.get("status") == "error" else "ok"
+            bytes_out = content_bytes(result.get("content") or [])
+        self.stats.record("call_tool", outcome, round_trip_ms=round_trip_ms, bytes_in=bytes_in,
+                          bytes_out=bytes_out, tool=name)
+    
+    def _limit(self, result: Dict[str, Any], name: str) -> Dict[str, Any]:
+        if self.spill_store is not None:
+            result["content"] = self.spill_store.limit_blocks(result.get("content") or [], f"{self.name}/{name}")
+        return result
+    
+    async def call_tool_async(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                              read_timeout_seconds=None) -> Dict[str, Any]:
+        """在其他事件循环（如流式运行时）中等待工具调用"""
+        timeout = self._timeout_seconds(read_timeout_seconds)
+        future = self.submit_call(tool_use_id, name, arguments, timeout)
+        try:
+            # 比代理中的调用期限稍长，让代理先报告超时
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout + 1)
+        except asyncio.TimeoutError:
+            self.connection.cancel([future])
+            raise TimeoutError(f"MCP工具 {name} 超过 {timeout}秒未返回")
+        except asyncio.CancelledError:
+            cancelling = getattr(asyncio.current_task(), 'cancelling', None)
+            if future.cancelled() and cancelling is not None and cancelling() == 0:
+                raise RuntimeError(f"MCP工具 {name} 的调用已被取消")
+            self.connection.cancel([future])
+            raise
+        if self.spill_store is not None:
+            # 大结果的落盘在线程池中进行，不阻塞调用方的事件循环
+            result["content"] = await self.spill_store.limit_blocks_async(result.get("content") or [],
+                                                                          f"{self.name}/{name}")
+        return result
+    
+    def call_tool_sync(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                       read_timeout_seconds=None) -> Dict[str, Any]:
+        """同步调用MCP工具"""
+        timeout = self._timeout_seconds(read_timeout_seconds)
+        future = self.submit_call(tool_use_id, name, arguments, timeout)
+        try:
+            return self._limit(future.result(timeout=timeout + 1), name)
+        except concurrent.futures.TimeoutError:
+            self.connection.cancel([future])
+            raise TimeoutError(f"MCP工具 {name} 超过 {timeout}秒未返回")
+        except concurrent.futures.CancelledError:
+            raise RuntimeError(f"MCP工具 {name} 的调用已被取消")
+
+
+# 全局连接（按套接字路径），域重载后新的解释器重新创建并连接到同一个代理
+_connections: Dict[str, BrokerConnection] = {}
+_connections_lock = threading.Lock()
+
+
+def get_broker_connection(socket_path: Optional[str] = None, **options) -> BrokerConnection:
+    """
+    获取到代理的连接（不立即连接，第一次请求时连接或启动代理）
+    
+    参数:
+        socket_path: 套接字路径，默认default_socket_path()
+        **options: 第一次创建连接时传给BrokerConnection的参数
+    """
+    socket_path = socket_path or default_socket_path()
+    with _connections_lock:
+        connection = _connections.get(socket_path)
+        if connection is None:
+            connection = _connections[socket_path] = BrokerConnection(socket_path, **options)
+        return connection
+
+
+def get_broker_connections() -> List[BrokerConnection]:
+    """已创建的代理连接"""
+    with _connections_lock:
+        return list(_connections.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP代理进程")
+    parser.add_argument('--socket', default=None, help="Unix域套接字路径")
+    parser.add_argument('--server-idle-seconds', type=float, default=DEFAULT_SERVER_IDLE_SECONDS)
+    parser.add_argument('--broker-idle-seconds', type=float, default=DEFAULT_BROKER_IDLE_SECONDS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    
+    # 与内嵌进程使用同一套客户端创建逻辑
+    from mcp_manager import MCPManager
+    broker = MCPBroker(args.socket or default_socket_path(), MCPManager.create_direct_client,
+                       server_idle_seconds=args.server_idle_seconds,
+                       broker_idle_seconds=args.broker_idle_seconds)
+    asyncio.run(broker.serve())
+
+
+if __name__ == '__main__':
+    main()
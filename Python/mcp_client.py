@@ -1,46 +1,200 @@
 """
 MCP 客户端模块
-基于 strands 实现的 MCP 客户端，支持 stdio、http 和 sse 传输
+会话托管在共享的MCP事件循环（mcp_runtime）上，同步接口直接把请求提交到该循环，
+每个客户端不再单独占用线程、事件循环和线程池；支持 stdio、http 和 sse 传输
 """
 
 import asyncio
-import subprocess
-import threading
+import base64
+import concurrent.futures
+import contextvars
+import json
 import logging
+import os
+import time
 from datetime import timedelta
-from concurrent.futures import Future, ThreadPoolExecutor
-import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+from mcp_runtime import FifoLimiter, MCPRuntime, get_mcp_runtime
+from mcp_spill import get_spill_store
+from mcp_stats import MCPServerStats, content_bytes, error_outcome
+from stream_cancel import current_scope
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
 try:
-    from mcp import StdioServerParameters, stdio_client
-    from strands.tools.mcp import MCPClient as StrandsMCPClient
+    import anyio
+    from mcp import ClientSession
     MCP_AVAILABLE = True
 except ImportError as e:
     logger.warning(f"MCP模块导入失败: {e}")
     MCP_AVAILABLE = False
 
+# list_tools_sync返回Strands的MCPAgentTool，便于直接注册到Agent或由MCPProxyTool包装
+try:
+    from strands.tools.mcp import MCPAgentTool
+except ImportError:
+    MCPAgentTool = None
+
+# 默认的工具调用超时（秒）
+DEFAULT_CALL_TIMEOUT_SECONDS = 30
+# 关闭会话时等待传输层清理的最长时间（秒）
+CLOSE_TIMEOUT_SECONDS = 5
+# ping的默认超时（秒）
+DEFAULT_PING_TIMEOUT_SECONDS = 10
+
+# 会话主协程中stdio传输启动的服务器进程记录到这个列表（关闭时可以直接向进程组发送信号）
+_process_sink: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('mcp_process_sink', default=None)
+
+
+def _install_process_tracking():
+    """包装MCP SDK创建stdio服务器进程的函数，把进程记录到当前会话（SDK不公开进程对象）"""
+    try:
+        import mcp.client.stdio as stdio_module
+    except ImportError:
+        return
+    create = getattr(stdio_module, '_create_platform_compatible_process', None)
+    if create is None:
+        logger.warning("当前MCP SDK中没有_create_platform_compatible_process，无法记录stdio服务器进程，"
+                       "关闭时只能等待传输层自行结束服务器")
+        return
+    if getattr(create, 'tracks_processes', False):
+        return
+    
+    async def create_tracked(*args, **kwargs):
+        process = await create(*args, **kwargs)
+        sink = _process_sink.get()
+        if sink is not None:
+            sink.append(process)
+        return process
+    
+    create_tracked.tracks_processes = True
+    stdio_module._create_platform_compatible_process = create_tracked
+
+
+if MCP_AVAILABLE:
+    _install_process_tracking()
+
 
 class MCPClientInitializationError(Exception):
     """MCP客户端初始化错误"""
     pass
 
 
+def _image_format(mime_type: Optional[str]) -> Optional[str]:
+    fmt = (mime_type or '').split('/')[-1].lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    return fmt if fmt in ('png', 'jpeg', 'gif', 'webp') else None
+
+
+def map_mcp_content(content: Any) -> Optional[Dict[str, Any]]:
+    """
+    将MCP结果内容项转换为工具结果内容块
+    
+    参数:
+        content: MCP的TextContent/ImageContent/EmbeddedResource等
+    
+    返回:
+        {"text": ...}、{"image": ...} 或 {"json": ...}，无法表示时返回None
+    """
+    content_type = getattr(content, 'type', None)
+    if content_type == 'text':
+        return {"text": content.text}
+    if content_type == 'image':
+        fmt = _image_format(content.mimeType)
+        if fmt is None:
+            return {"text": f"[不支持的图片类型: {content.mimeType}]"}
+        return {"image": {"format": fmt, "source": {"bytes": base64.b64decode(content.data)}}}
+    if content_type == 'resource':
+        resource = content.resource
+        text = getattr(resource, 'text', None)
+        if text is not None:
+            return {"text": text}
+        return {"text": f"[二进制资源: {resource.uri}]"}
+    if content_type == 'resource_link':
+        return {"text": f"[资源链接: {content.uri}]"}
+    if hasattr(content, 'model_dump'):
+        return {"json": content.model_dump(mode='json')}
+    return None
+
+
+class _WatchedReadStream:
+    """
+    包装传输层的读取流：流结束（stdio服务器进程退出、SSE连接关闭等）时通知客户端，
+    否则会话会一直保持“存活”，之后的调用全部失败
+    """
+    
+    def __init__(self, stream, on_closed: Callable[[], None]):
+        self._stream = stream
+        self._on_closed = on_closed
+    
+    async def receive(self):
+        try:
+            return await self._stream.receive()
+        except (anyio.EndOfStream, anyio.ClosedResourceError, anyio.BrokenResourceError):
+            self._on_closed()
+            raise
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except anyio.EndOfStream:
+            raise StopAsyncIteration
+    
+    async def aclose(self):
+        await self._stream.aclose()
+    
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self._stream.__aexit__(exc_type, exc_val, exc_tb)
+    
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
 class MCPClient:
-    """基于strands实现的MCP客户端，支持stdio、http和sse传输"""
+    """托管在共享MCP事件循环上的MCP客户端，支持stdio、http和sse传输"""
     
-    def __init__(self, client_factory, timeout_seconds=30):
+    def __init__(self, client_factory: Callable[[], Any], timeout_seconds: float = 30,
+                 name: str = 'mcp', runtime: Optional[MCPRuntime] = None,
+                 max_concurrent_calls: int = 0, call_timeout_seconds: float = DEFAULT_CALL_TIMEOUT_SECONDS,
+                 stats: Optional[MCPServerStats] = None):
+        """
+        参数:
+            client_factory: 返回传输层异步上下文管理器的函数（如stdio_client(...)），产出(read, write, ...)
+            timeout_seconds: 连接和握手的最长时间（秒）
+            name: 服务器名称（用于日志）
+            runtime: 承载会话的MCP运行时，默认使用全局实例
+            max_concurrent_calls: 同一会话上同时进行的工具调用上限，超出的调用按到达顺序排队；0表示不限制
+            call_timeout_seconds: 每次工具调用的期限（秒），包括排队时间
+            stats: 记录调用次数、延迟和负载大小的统计对象，默认新建（由管理器传入时服务器重启后继续累计）
+        """
         self.client_factory = client_factory
         self.timeout_seconds = timeout_seconds
-        self.client = None
-        self.background_thread = None
-        self.loop = None
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.call_timeout_seconds = call_timeout_seconds
+        self.limiter = FifoLimiter(max_concurrent_calls)
+        self.name = name
+        self.runtime = runtime or get_mcp_runtime()
+        # 超过阈值的结果落盘，返回给Agent的只有开头部分和句柄
+        self.spill_store = get_spill_store()
+        self.stats = stats or MCPServerStats(name)
+        self.session: Optional[Any] = None
+        self.server_info = None
+        # 传输层意外断开的原因，None表示未断开
+        self.disconnect_reason: Optional[str] = None
+        # stdio传输启动的服务器进程
+        self.processes: List[Any] = []
+        self._session_future: Optional[concurrent.futures.Future] = None
+        self._stop_event: Optional[asyncio.Event] = None
         self._started = False
-        self._subprocess = None  # 存储subprocess引用用于清理
-        self._client_context = None  # 存储异步上下文管理器
     
     def __enter__(self):
         self.start()
@@ -50,239 +204,287 @@ class MCPClient:
         self.stop()
         return False  # 允许异常传播
     
+    def is_alive(self) -> bool:
+        """会话是否可用（传输层断开后会话主协程结束）"""
+        future = self._session_future
+        return self._started and self.session is not None and future is not None and not future.done()
+    
     def start(self):
         """启动MCP客户端连接"""
         if self._started:
             return
         
+        ready = concurrent.futures.Future()
+        self._session_future = self.runtime.spawn(self._session_main, ready)
         try:
-            # 在后台线程中启动异步客户端
-            future = Future()
-            
-            def background_worker():
-                try:
-                    self.loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(self.loop)
-                    
-                    async def init_client():
-                        # 对于异步上下文管理器，使用 async with
-                        client_context = self.client_factory()
-                        self.client = await client_context.__aenter__()
-                        # 保存上下文管理器以便后续清理
-                        self._client_context = client_context
-                        # 如果客户端有subprocess引用，保存它
-                        if hasattr(self.client, '_subprocess'):
-                            self._subprocess = self.client._subprocess
-                        elif hasattr(self.client, 'process'):
-                            self._subprocess = self.client.process
-                        return self.client
-                    
-                    client = self.loop.run_until_complete(init_client())
-                    future.set_result(client)
-                    
-                    # 保持事件循环运行
-                    self.loop.run_forever()
-                except Exception as e:
-                    future.set_exception(e)
-                finally:
-                    # 确保事件循环正确关闭
-                    try:
-                        if self.loop and not self.loop.is_closed():
-                            # 取消所有挂起的任务
-                            pending = asyncio.all_tasks(self.loop)
-                            for task in pending:
-                                task.cancel()
-                            if pending:
-                                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-                            self.loop.close()
-                    except Exception as e:
-                        logger.warning(f"关闭事件循环时出错: {e}")
-            
-            self.background_thread = threading.Thread(target=background_worker, daemon=True)
-            self.background_thread.start()
-            
-            # 等待初始化完成
-            self.client = future.result(timeout=self.timeout_seconds)
-            self._started = True
-            
+            ready.result(timeout=self.timeout_seconds)
+        except concurrent.futures.TimeoutError:
+            self._session_future.cancel()
+            raise MCPClientInitializationError(f"MCP客户端初始化超过 {self.timeout_seconds}秒")
         except Exception as e:
+            self._session_future.cancel()
             raise MCPClientInitializationError(f"MCP客户端初始化失败: {e}")
+        self._started = True
+    
+    async def _session_main(self, ready: concurrent.futures.Future):
+        """
+        会话主协程：传输层和ClientSession的进入和退出都在这个任务中完成，
+        调用方的请求作为同一事件循环上的其他任务并发执行
+        """
+        self._stop_event = asyncio.Event()
+        self.processes = []
+        _process_sink.set(self.processes)
+        try:
+            async with self.client_factory() as streams:
+                read_stream = _WatchedReadStream(streams[0], self._on_transport_closed)
+                write_stream = streams[1]
+                async with ClientSession(read_stream, write_stream) as session:
+                    result = await session.initialize()
+                    self.server_info = getattr(result, 'serverInfo', None)
+                    self.session = session
+                    if not ready.done():
+                        ready.set_result(session)
+                    await self._stop_event.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else MCPClientInitializationError("连接已取消"))
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.warning(f"MCP会话 '{self.name}' 已断开: {e}")
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self.session = None
+    
+    def _on_transport_closed(self):
+        """读取流结束：不是stop()引起的就视为断开，结束会话主协程使is_alive()返回False"""
+        stop_event = self._stop_event
+        if stop_event is None or stop_event.is_set():
+            return
+        self.disconnect_reason = "服务器进程已退出或连接已关闭"
+        logger.warning(f"MCP会话 '{self.name}' 已断开: {self.disconnect_reason}")
+        stop_event.set()
+    
+    def begin_stop(self) -> Optional[concurrent.futures.Future]:
+        """
+        通知会话主协程退出，不等待（传输层随之关闭，stdio服务器的stdin被关闭）
+        
+        返回:
+            会话主协程的Future，未启动时为None
+        """
+        future = self._session_future
+        if future is None:
+            return None
+        self._started = False
+        self._session_future = None
+        
+        stop_event = self._stop_event
+        if stop_event is not None and self.runtime.running:
+            self.runtime.loop.call_soon_threadsafe(stop_event.set)
+        return future
+    
+    def signal_processes(self, sig: int) -> int:
+        """
+        向仍在运行的stdio服务器进程发送信号（进程是独立进程组的组长时整组发送，否则只发给进程本身）
+        
+        参数:
+            sig: 信号，如signal.SIGTERM
+        
+        返回:
+            发送成功的进程数量
+        """
+        count = 0
+        for process in list(self.processes):
+            pid = getattr(process, 'pid', None) or getattr(getattr(process, 'popen', None), 'pid', None)
+            if not pid or getattr(process, 'returncode', None) is not None:
+                continue
+            try:
+                if hasattr(os, 'killpg') and os.getpgid(pid) == pid:
+                    os.killpg(pid, sig)
+                else:
+                    os.kill(pid, sig)
+                count += 1
+            except OSError:
+                pass
+        return count
     
     def stop(self):
         """停止MCP客户端连接"""
-        if not self._started:
+        future = self.begin_stop()
+        if future is None:
             return
-        
         try:
-            # 1. 关闭异步上下文管理器
-            if hasattr(self, '_client_context') and self._client_context:
-                try:
-                    if self.loop and not self.loop.is_closed():
-                        async def cleanup_context():
-                            await self._client_context.__aexit__(None, None, None)
-                        asyncio.run_coroutine_threadsafe(cleanup_context(), self.loop).result(timeout=3)
-                except Exception as e:
-                    logger.warning(f"关闭MCP上下文管理器时出错: {e}")
-            
-            # 2. 关闭MCP客户端连接
-            if self.client:
-                try:
-                    if hasattr(self.client, 'close'):
-                        if asyncio.iscoroutinefunction(self.client.close):
-                            if self.loop and not self.loop.is_closed():
-                                asyncio.run_coroutine_threadsafe(self.client.close(), self.loop)
-                        else:
-                            self.client.close()
-                except Exception as e:
-                    logger.warning(f"关闭MCP客户端时出错: {e}")
-            
-            # 3. 关闭subprocess（如果存在）
-            if self._subprocess:
-                try:
-                    if self._subprocess.poll() is None:  # 进程仍在运行
-                        self._subprocess.terminate()  # 温和终止
-                        try:
-                            self._subprocess.wait(timeout=3)  # 等待3秒
-                        except subprocess.TimeoutExpired:
-                            self._subprocess.kill()  # 强制终止
-                            self._subprocess.wait()
-                    
-                    # 确保所有文件描述符都关闭
-                    if hasattr(self._subprocess, 'stdin') and self._subprocess.stdin:
-                        self._subprocess.stdin.close()
-                    if hasattr(self._subprocess, 'stdout') and self._subprocess.stdout:
-                        self._subprocess.stdout.close()
-                    if hasattr(self._subprocess, 'stderr') and self._subprocess.stderr:
-                        self._subprocess.stderr.close()
-                        
-                except Exception as e:
-                    logger.warning(f"关闭subprocess时出错: {e}")
-                finally:
-                    self._subprocess = None
-            
-            # 4. 停止事件循环
-            if self.loop and not self.loop.is_closed():
-                self.loop.call_soon_threadsafe(self.loop.stop)
-            
-            # 5. 等待后台线程结束
-            if self.background_thread and self.background_thread.is_alive():
-                self.background_thread.join(timeout=5)
-                if self.background_thread.is_alive():
-                    logger.warning("后台线程未能在5秒内结束")
-            
-            # 6. 关闭线程池
-            if self.executor:
-                self.executor.shutdown(wait=True, timeout=3)
-                
-            self._started = False
-            
-        except Exception as e:
-            logger.warning(f"MCP客户端停止时出错: {e}")
+            future.result(timeout=CLOSE_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            logger.warning(f"MCP会话 '{self.name}' 未能在{CLOSE_TIMEOUT_SECONDS}秒内关闭，取消会话任务")
+            future.cancel()
+        except (concurrent.futures.CancelledError, Exception) as e:
+            logger.debug(f"MCP会话 '{self.name}' 关闭: {e}")
+    
+    def _require_session(self):
+        session = self.session
+        if not self._started or session is None:
+            raise RuntimeError(f"MCP客户端 '{self.name}' 未启动")
+        return session
+    
+    async def _measure(self, op: str, awaitable):
+        """等待一次操作并记录往返时间和结果"""
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            return await awaitable
+        except BaseException as e:
+            outcome = error_outcome(e)
+            raise
+        finally:
+            self.stats.record(op, outcome, round_trip_ms=(time.monotonic() - started) * 1000)
+    
+    async def _list_tools(self) -> List[Any]:
+        session = self._require_session()
+        tools = []
+        cursor = None
+        while True:
+            result = await self._measure('list_tools', session.list_tools(cursor=cursor) if cursor else session.list_tools())
+            tools.extend(result.tools)
+            cursor = getattr(result, 'nextCursor', None)
+            if not cursor:
+                return tools
     
-    def list_tools_sync(self, timeout_seconds=30):
-        """同步获取工具列表"""
-        if not self._started or not self.client:
-            logger.warning("客户端未启动或不存在")
-            return []
+    async def _ping(self):
+        await self._measure('ping', self._require_session().send_ping())
+    
+    def ping_sync(self, timeout_seconds: float = DEFAULT_PING_TIMEOUT_SECONDS):
+        """
+        向服务器发送ping，失败或超时时抛出异常
+        
+        参数:
+            timeout_seconds: 最长等待时间（秒）
+        """
+        self.runtime.run('ping', self._ping, timeout=timeout_seconds)
+    
+    def list_tools_sync(self, timeout_seconds: float = 30) -> List[Any]:
+        """
+        同步获取工具列表
         
+        参数:
+            timeout_seconds: 最长等待时间（秒）
+        
+        返回:
+            MCPAgentTool列表（Strands不可用时为MCP原始Tool列表）
+        """
+        tools = self.runtime.run('list_tools', self._list_tools, timeout=timeout_seconds)
+        logger.info(f"MCP服务器 '{self.name}' 返回 {len(tools)} 个工具")
+        if MCPAgentTool is None:
+            return tools
+        return [MCPAgentTool(tool, self) for tool in tools]
+    
+    async def _call_tool(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                         deadline: float, timeout: float) -> Dict[str, Any]:
+        submitted = deadline - timeout
+        bytes_in = len(json.dumps(arguments or {}, ensure_ascii=False, default=str).encode('utf-8'))
+        sent = None
         try:
-            logger.info(f"开始获取MCP工具列表，超时{timeout_seconds}秒")
-            future = Future()
-            
-            def run_async():
+            session = self._require_session()
+            # 请求在同一会话上流水线发送，只在达到并发上限时排队
+            if not self.limiter.try_acquire():
                 try:
-                    async def get_tools():
-                        logger.info("调用client.list_tools()")
-                        
-                        # 调试：检查客户端对象类型和方法
-                        logger.info(f"客户端对象类型: {type(self.client)}")
-                        logger.info(f"客户端对象: {self.client}")
-                        
-                        # 列出所有可用方法
-                        methods = [method for method in dir(self.client) if not method.startswith('_')]
-                        logger.info(f"客户端可用方法: {methods}")
-                        
-                        if hasattr(self.client, 'list_tools'):
-                            result = await self.client.list_tools()
-                            logger.info(f"获取到结果类型: {type(result)}")
-                            logger.info(f"结果内容: {result}")
-                            
-                            if hasattr(result, 'tools'):
-                                tools = result.tools
-                                logger.info(f"找到 {len(tools)} 个工具")
-                                for i, tool in enumerate(tools):
-                                    logger.info(f"工具 {i+1}: {tool}")
-                                return tools
-                            else:
-                                logger.warning("结果对象没有tools属性")
-                                return []
-                        else:
-                            logger.warning("客户端没有list_tools方法")
-                            # 检查是否有其他可能的方法
-                            possible_methods = [m for m in methods if 'tool' in m.lower()]
-                            logger.info(f"包含'tool'的方法: {possible_methods}")
-                            return []
-                    
-                    if self.loop and not self.loop.is_closed():
-                        tools = asyncio.run_coroutine_threadsafe(get_tools(), self.loop).result(timeout=timeout_seconds)
-                        future.set_result(tools)
-                    else:
-                        logger.warning("事件循环不可用")
-                        future.set_result([])
-                        
-                except Exception as e:
-                    logger.error(f"获取工具异步操作失败: {e}")
-                    future.set_exception(e)
-            
-            self.executor.submit(run_async)
-            result = future.result(timeout=timeout_seconds)
-            logger.info(f"最终返回 {len(result)} 个工具")
-            return result
-            
-        except Exception as e:
-            logger.error(f"获取MCP工具失败: {e}")
-            import traceback
-            logger.error(f"堆栈跽踪: {traceback.format_exc()}")
-            return []
+                    await asyncio.wait_for(self.limiter.acquire(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    raise TimeoutError(
+                        f"MCP工具 {name} 排队超过 {timeout}秒（服务器 '{self.name}' 并发上限 {self.limiter.limit}）"
+                    )
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"MCP工具 {name} 超过 {timeout}秒未开始执行")
+                sent = time.monotonic()
+                result = await session.call_tool(name, arguments or {}, read_timeout_seconds=timedelta(seconds=remaining))
+            finally:
+                self.limiter.release()
+        except BaseException as e:
+            self._record_call(name, error_outcome(e), submitted, sent, bytes_in, None)
+            raise
+        content = [block for block in (map_mcp_content(item) for item in result.content) if block is not None]
+        structured = getattr(result, 'structuredContent', None)
+        if structured is not None and not content:
+            content.append({"json": structured})
+        is_error = result.isError
+        bytes_out = content_bytes(content)
+        self._record_call(name, "tool_error" if is_error else "ok", submitted, sent, bytes_in, bytes_out)
+        # 先释放原始结果，落盘后只保留截断的内容块
+        del result, structured
+        if self.spill_store is not None:
+            # 大结果的落盘在线程池中进行，不阻塞其他服务器共用的MCP事件循环
+            content = await self.spill_store.limit_blocks_async(content, f"{self.name}/{name}", bytes_out)
+        return {
+            "toolUseId": tool_use_id,
+            "status": "error" if is_error else "success",
+            "content": content
+        }
     
-    def call_tool_sync(self, tool_use_id, name, arguments, read_timeout_seconds=None):
-        """同步调用MCP工具"""
-        if not self._started or not self.client:
-            return {"status": "error", "error": "MCP客户端未启动"}
-        
-        timeout = read_timeout_seconds or timedelta(seconds=30)
+    def _record_call(self, name: str, outcome: str, submitted: float, sent: Optional[float],
+                     bytes_in: int, bytes_out: Optional[int]):
+        """记录一次工具调用：提交到发送之间算排队（事件循环调度和并发上限），发送到完成算往返"""
+        finished = time.monotonic()
+        self.stats.record(
+            'call_tool', outcome,
+            queue_ms=((sent or finished) - submitted) * 1000,
+            round_trip_ms=(finished - sent) * 1000 if sent is not None else None,
+            bytes_in=bytes_in, bytes_out=bytes_out, tool=name
+        )
+    
+    def _timeout_seconds(self, read_timeout_seconds) -> float:
+        timeout = read_timeout_seconds or self.call_timeout_seconds
         if isinstance(timeout, timedelta):
             timeout = timeout.total_seconds()
+        return float(timeout)
+    
+    def submit_call(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                    read_timeout_seconds=None) -> concurrent.futures.Future:
+        """
+        把一次工具调用提交到MCP事件循环，不等待结果
+        
+        参数:
+            tool_use_id: 工具调用ID
+            name: 服务器上的工具名称
+            arguments: 工具参数
+            read_timeout_seconds: 本次调用的期限（秒或timedelta），从提交时开始计算，默认call_timeout_seconds
         
+        返回:
+            结果为工具结果字典的Future
+        """
+        timeout = self._timeout_seconds(read_timeout_seconds)
+        deadline = time.monotonic() + timeout
+        future = self.runtime.submit('call_tool', self._call_tool, tool_use_id, name, arguments, deadline, timeout)
+        # 登记到发起调用的流，取消该流时只中止它自己的调用
+        scope = current_scope()
+        if scope is not None:
+            scope.add_call(future)
+        return future
+    
+    async def call_tool_async(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                              read_timeout_seconds=None) -> Dict[str, Any]:
+        """在其他事件循环（如流式运行时）中等待工具调用，不占用额外线程"""
+        future = self.submit_call(tool_use_id, name, arguments, read_timeout_seconds)
         try:
-            future = Future()
-            
-            def run_async():
-                try:
-                    async def call_tool():
-                        if hasattr(self.client, 'call_tool'):
-                            result = await self.client.call_tool(
-                                name=name,
-                                arguments=arguments
-                            )
-                            return {
-                                "status": "success",
-                                "result": result.content if hasattr(result, 'content') else result
-                            }
-                        return {"status": "error", "error": "工具调用方法不可用"}
-                    
-                    if self.loop and not self.loop.is_closed():
-                        result = asyncio.run_coroutine_threadsafe(call_tool(), self.loop).result(timeout=timeout)
-                        future.set_result(result)
-                    else:
-                        future.set_result({"status": "error", "error": "事件循环不可用"})
-                        
-                except Exception as e:
-                    future.set_exception(e)
-            
-            self.executor.submit(run_async)
-            return future.result(timeout=timeout)
-            
-        except Exception as e:
-            logger.warning(f"调用MCP工具失败: {e}")
-            return {"status": "error", "error": str(e)}
\ No newline at end of file
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelling = getattr(asyncio.current_task(), 'cancelling', None)
+            if future.cancelled() and cancelling is not None and cancelling() == 0:
+                # 调用被所在流的取消范围中止，调用方本身没有被取消
+                raise RuntimeError(f"MCP工具 {name} 的调用已被取消")
+            future.cancel()
+            raise
+    
+    def call_tool_sync(self, tool_use_id: str, name: str, arguments: Optional[Dict[str, Any]],
+                       read_timeout_seconds=None) -> Dict[str, Any]:
+        """同步调用MCP工具"""
+        timeout = self._timeout_seconds(read_timeout_seconds)
+        future = self.submit_call(tool_use_id, name, arguments, timeout)
+        try:
+            # 比MCP读超时稍长，让会话自己先报告超时
+            return future.result(timeout=timeout + 1)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"MCP工具 {name} 超过 {timeout}秒未返回")
+        except concurrent.futures.CancelledError:
+            raise RuntimeError(f"MCP工具 {name} 的调用已被取消")
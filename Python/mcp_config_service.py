@@ -0,0 +1,460 @@
+"""
+MCP配置服务
+配置文件路径只解析一次，解析并规范化（Anthropic格式转换）后的配置按(路径, 修改时间, 大小)缓存，
+文件未变化时不再读取和解析；可选地监视配置文件（Linux上使用inotify，其他平台轮询），
+文件变化时向监听器发布带结构化差异的变更事件
+"""
+
+import copy
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 配置文件相对Unity项目根目录的路径
+CONFIG_RELATIVE_PATH = "Assets/UnityAIAgent/mcp_config.json"
+# 没有PROJECT_ROOT_PATH时按顺序查找的相对路径
+FALLBACK_CONFIG_PATHS = [
+    "Assets/UnityAIAgent/mcp_config.json",
+    "../Assets/UnityAIAgent/mcp_config.json",
+    "../../Assets/UnityAIAgent/mcp_config.json",
+    "mcp_config.json"
+]
+# 找不到配置文件时，两次重新查找之间的最短间隔（秒）
+PATH_PROBE_INTERVAL_SECONDS = 5.0
+# 轮询监视的间隔（秒）；使用inotify时也按这个间隔检查停止标志
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+
+# 找不到配置文件时使用的默认配置
+DEFAULT_CONFIG = {
+    "enable_mcp": False,
+    "max_concurrent_connections": 3,
+    "default_timeout_seconds": 30,
+    "servers": []
+}
+
+# inotify事件：文件写入完成、移入/移出目录、创建、删除（编辑器通常先写临时文件再重命名）
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def convert_anthropic_config(anthropic_config: Dict[str, Any]) -> Dict[str, Any]:
+    """将Anthropic MCP格式（mcpServers）转换为内部格式"""
+    try:
+        mcp_servers = anthropic_config.get('mcpServers', {})
+        converted_servers = []
+        
+        for server_name, server_config in mcp_servers.items():
+            logger.info(f"转换服务器: {server_name}")
+            logger.debug(f"服务器配置: {server_config}")
+            
+            converted_server = {
+                'name': server_name,
+                'enabled': True,  # Anthropic格式中启用的服务器默认为enabled
+                'description': f'MCP服务器: {server_name}',
+            }
+            
+            # 处理不同的传输类型
+            if 'command' in server_config:
+                # Stdio传输
+                converted_server.update({
+                    'transport_type': 'stdio',
+                    'command': server_config.get('command', ''),
+                    'args': server_config.get('args', []),
+                    'working_directory': server_config.get('working_directory', ''),
+                    'env_vars': server_config.get('env', {})
+                })
+            elif 'transport' in server_config and 'url' in server_config:
+                # 远程传输
+                transport = server_config.get('transport', 'streamable_http')
+                
+                # 映射传输类型
+                transport_mapping = {
+                    'sse': 'sse',
+                    'streamable_http': 'streamable_http',
+                    'http': 'streamable_http',  # 默认使用streamable_http
+                    'https': 'streamable_http'
+                }
+                
+                converted_server.update({
+                    'transport_type': transport_mapping.get(transport, 'streamable_http'),
+                    'url': server_config.get('url', ''),
+                    'timeout': 30,  # 默认超时
+                    'headers': server_config.get('headers', {})
+                })
+            elif 'url' in server_config:
+                # 只有URL的情况，默认使用streamable_http
+                converted_server.update({
+                    'transport_type': 'streamable_http',
+                    'url': server_config.get('url', ''),
+                    'timeout': 30,
+                    'headers': server_config.get('headers', {})
+                })
+            
+            converted_servers.append(converted_server)
+        
+        converted_config = {
+            'enable_mcp': len(converted_servers) > 0,
+            'max_concurrent_connections': 5,
+            'default_timeout_seconds': 30,
+            'servers': converted_servers
+        }
+        # mcpServers之外的顶层设置（如watch_config、startup_deadline_seconds）原样保留
+        for key, value in anthropic_config.items():
+            if key != 'mcpServers':
+                converted_config[key] = value
+        
+        logger.info(f"Anthropic格式转换完成，共 {len(converted_servers)} 个服务器")
+        return converted_config
+    
+    except Exception as e:
+        logger.error(f"转换Anthropic MCP配置失败: {e}")
+        return copy.deepcopy(DEFAULT_CONFIG)
+
+
+def diff_configs(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    比较两份规范化后的配置
+    
+    参数:
+        old: 旧配置
+        new: 新配置
+    
+    返回:
+        {"settings": {键: {"old": ..., "new": ...}},
+         "servers": {"added": [名称], "removed": [名称], "modified": {名称: [变化的键]}}}
+    """
+    old = old or {}
+    new = new or {}
+    settings = {
+        key: {"old": old.get(key), "new": new.get(key)}
+        for key in sorted((set(old) | set(new)) - {'servers'})
+        if old.get(key) != new.get(key)
+    }
+    old_servers = {server.get('name', 'unknown'): server for server in old.get('servers', [])}
+    new_servers = {server.get('name', 'unknown'): server for server in new.get('servers', [])}
+    modified = {}
+    for name in new_servers:
+        if name in old_servers and old_servers[name] != new_servers[name]:
+            before, after = old_servers[name], new_servers[name]
+            modified[name] = sorted(key for key in set(before) | set(after) if before.get(key) != after.get(key))
+    return {
+        "settings": settings,
+        "servers": {
+            "added": [name for name in new_servers if name not in old_servers],
+            "removed": [name for name in old_servers if name not in new_servers],
+            "modified": modified
+        }
+    }
+
+
+def is_empty_diff(diff: Dict[str, Any]) -> bool:
+    """diff_configs的结果是否没有任何变化"""
+    servers = diff.get("servers", {})
+    return not diff.get("settings") and not any(servers.get(key) for key in ("added", "removed", "modified"))
+
+
+class _InotifyWatch:
+    """用inotify监视一个目录（只在Linux上可用）"""
+    
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1失败")
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch失败: {directory}")
+    
+    def wait(self, timeout: float) -> List[str]:
+        """等待目录中的文件事件，返回发生变化的文件名（超时返回空列表）"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+    
+    def close(self):
+        os.close(self._fd)
+
+
+class MCPConfigService:
+    """MCP配置的缓存加载和文件监视"""
+    
+    def __init__(self, search_paths: Optional[List[str]] = None):
+        """
+        参数:
+            search_paths: 候选配置文件路径，默认根据PROJECT_ROOT_PATH或相对路径确定
+        """
+        self._search_paths = search_paths
+        self._lock = threading.RLock()
+        self._path: Optional[str] = None
+        self._last_probe: Optional[float] = None
+        self._key: Optional[Tuple[Any, ...]] = None
+        self._config: Optional[Dict[str, Any]] = None
+        self._loaded = False
+        # 解析失败的文件版本，文件再次变化前不重复读取
+        self._failed_key: Optional[Tuple[Any, ...]] = None
+        self.reads = 0
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._watch_thread: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        self.poll_interval = DEFAULT_POLL_INTERVAL_SECONDS
+        self.watch_mode: Optional[str] = None
+    
+    @property
+    def watching(self) -> bool:
+        """是否正在监视配置文件"""
+        return self._watch_thread is not None and self._watch_thread.is_alive() and not self._watch_stop.is_set()
+    
+    @property
+    def path(self) -> Optional[str]:
+        """解析到的配置文件路径，找不到时为None"""
+        with self._lock:
+            return self._resolve_path()
+    
+    def _candidate_paths(self) -> List[str]:
+        if self._search_paths is not None:
+            return list(self._search_paths)
+        project_root = os.environ.get('PROJECT_ROOT_PATH')
+        if project_root:
+            return [os.path.join(project_root, CONFIG_RELATIVE_PATH)]
+        return list(FALLBACK_CONFIG_PATHS)
+    
+    def _resolve_path(self) -> Optional[str]:
+        """查找配置文件并记住绝对路径；找不到时限制重新查找的频率"""
+        if self._path is not None:
+            return self._path
+        now = time.monotonic()
+        if self._last_probe is not None and now - self._last_probe < PATH_PROBE_INTERVAL_SECONDS:
+            return None
+        self._last_probe = now
+        for config_path in self._candidate_paths():
+            if os.path.isfile(config_path):
+                self._path = os.path.abspath(config_path)
+                logger.info(f"MCP配置文件: {self._path}")
+                return self._path
+        logger.info(f"未找到MCP配置文件（查找了 {', '.join(self._candidate_paths())}），使用默认配置")
+        return None
+    
+    @staticmethod
+    def _file_key(path: Optional[str]) -> Optional[Tuple[Any, ...]]:
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (path, stat.st_mtime_ns, stat.st_size)
+    
+    def _read(self, path: Optional[str]) -> Optional[Dict[str, Any]]:
+        """读取并规范化配置，失败时返回None"""
+        if path is None:
+            return copy.deepcopy(DEFAULT_CONFIG)
+        self.reads += 1
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                raw_config = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取MCP配置失败: {e}")
+            return None
+        if 'mcpServers' in raw_config:
+            logger.info(f"检测到Anthropic MCP配置格式，mcpServers数量: {len(raw_config.get('mcpServers', {}))}")
+            return convert_anthropic_config(raw_config)
+        logger.info("检测到Legacy MCP配置格式")
+        return raw_config
+    
+    def _refresh(self) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        文件有变化时重新读取（调用方持有self._lock）
+        
+        返回:
+            (当前配置, 变更事件)，文件未变化或首次加载时变更事件为None
+        """
+        path = self._resolve_path()
+        key = self._file_key(path)
+        if key is None and path is not None:
+            # 配置文件被删除或移走，重新查找
+            self._path = None
+            self._last_probe = None
+            path = self._resolve_path()
+            key = self._file_key(path)
+        if self._loaded and key == self._key:
+            return self._config, None
+        if key is not None and key == self._failed_key:
+            return (self._config if self._loaded else None), None
+        
+        config = self._read(path)
+        if config is None:
+            # 解析失败（可能正在写入），保留旧配置，文件再次变化时重新读取
+            self._failed_key = key
+            return (self._config if self._loaded else None), None
+        self._failed_key = None
+        previous, was_loaded = self._config, self._loaded
+        self._config, self._key, self._loaded = config, key, True
+        if not was_loaded:
+            return config, None
+        diff = diff_configs(previous, config)
+        if is_empty_diff(diff):
+            return config, None
+        return config, {"path": path, "config": config, "previous": previous, "diff": diff}
+    
+    def get_config(self) -> Optional[Dict[str, Any]]:
+        """
+        获取规范化后的MCP配置；监视中直接返回缓存，否则只检查一次文件的修改时间和大小
+        
+        返回:
+            配置字典（调用方不应修改），首次读取失败时为None
+        """
+        with self._lock:
+            if self.watching and self._loaded:
+                return self._config
+            return self._refresh()[0]
+    
+    def invalidate(self):
+        """丢弃缓存，下次获取时重新查找并读取配置文件"""
+        with self._lock:
+            self._path = None
+            self._last_probe = None
+            self._key = None
+            self._failed_key = None
+            self._loaded = False
+    
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """
+        订阅配置文件变更事件（只在监视中发布，在监视线程中调用）
+        
+        参数:
+            listener: 接收 {"path", "config", "previous", "diff"} 的回调
+        """
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+    
+    def remove_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """取消订阅"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+    
+    def start_watching(self, poll_interval: float = DEFAULT_POLL_INTERVAL_SECONDS):
+        """
+        开始监视配置文件（已在监视时只更新轮询间隔）
+        
+        参数:
+            poll_interval: 轮询间隔（秒）
+        """
+        with self._lock:
+            self.poll_interval = poll_interval
+            if self.watching:
+                return
+            # 以当前文件内容为基准，之后的变化才发布事件
+            self._refresh()
+            self._watch_stop = threading.Event()
+            self._watch_thread = threading.Thread(
+                target=self._watch, args=(self._watch_stop,), name="MCPConfigWatcher", daemon=True
+            )
+            self._watch_thread.start()
+    
+    def stop_watching(self):
+        """停止监视"""
+        self._watch_stop.set()
+    
+    def _open_inotify(self) -> Optional[_InotifyWatch]:
+        if not sys.platform.startswith('linux'):
+            return None
+        with self._lock:
+            path = self._resolve_path()
+        if path is None:
+            return None
+        try:
+            return _InotifyWatch(os.path.dirname(path))
+        except Exception as e:
+            logger.info(f"inotify不可用，改为轮询监视MCP配置: {e}")
+            return None
+    
+    def _watch(self, stop_event: threading.Event):
+        watch = self._open_inotify()
+        watched_name = os.path.basename(self._path or '')
+        self.watch_mode = "inotify" if watch is not None else "poll"
+        logger.info(f"开始监视MCP配置文件（{self.watch_mode}）")
+        try:
+            while not stop_event.is_set():
+                if watch is not None:
+                    names = watch.wait(self.poll_interval)
+                    if watched_name not in names:
+                        continue
+                elif stop_event.wait(self.poll_interval):
+                    break
+                else:
+                    with self._lock:
+                        had_path = self._path is not None
+                    if not had_path and sys.platform.startswith('linux'):
+                        # 配置文件出现后改用inotify
+                        watch = self._open_inotify()
+                        if watch is not None:
+                            watched_name = os.path.basename(self._path or '')
+                            self.watch_mode = "inotify"
+                if stop_event.is_set():
+                    break
+                self._check()
+        finally:
+            if watch is not None:
+                watch.close()
+            logger.info("停止监视MCP配置文件")
+    
+    def _check(self):
+        """检查文件是否变化，有变化时通知监听器"""
+        with self._lock:
+            _, change = self._refresh()
+            listeners = list(self._listeners)
+        if change is None:
+            return
+        diff = change["diff"]
+        logger.info(f"MCP配置文件已变化: 设置 {list(diff['settings'])}，服务器 {diff['servers']}")
+        for listener in listeners:
+            try:
+                listener(change)
+            except Exception as e:
+                logger.warning(f"MCP配置变更监听器出错: {e}")
+
+
+# 全局配置服务实例
+_config_service: Optional[MCPConfigService] = None
+_config_service_lock = threading.Lock()
+
+def get_mcp_config_service() -> MCPConfigService:
+    """获取全局MCP配置服务"""
+    global _config_service
+    with _config_service_lock:
+        if _config_service is None:
+            _config_service = MCPConfigService()
+        return _config_service
@@ -0,0 +1,315 @@
+"""
+MCP HTTP传输
+为sse和streamable_http服务器提供传输层：同一主机（scheme+host+port）的所有会话共用一个
+keep-alive连接池，每个服务器仍使用自己的请求头和超时；请求可以并发进行。
+连接池和所有会话一样运行在共享的MCP事件循环（mcp_runtime）上
+"""
+
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+    from mcp.client.sse import sse_client
+    HTTP_TRANSPORT_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"MCP HTTP传输不可用: {e}")
+    HTTP_TRANSPORT_AVAILABLE = False
+
+# 新版mcp直接接受httpx客户端，旧版只接受客户端工厂
+try:
+    from mcp.client.streamable_http import streamable_http_client
+except ImportError:
+    streamable_http_client = None
+try:
+    from mcp.client.streamable_http import streamablehttp_client
+except ImportError:
+    streamablehttp_client = None
+
+# 每个主机的连接池大小
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+DEFAULT_KEEPALIVE_EXPIRY_SECONDS = 30.0
+# 请求超时（秒）：服务器配置未指定timeout时使用
+DEFAULT_HTTP_TIMEOUT_SECONDS = 30.0
+# 服务器推送流（SSE）的读超时（秒），流上长时间没有数据是正常的
+DEFAULT_SSE_READ_TIMEOUT_SECONDS = 300.0
+# 响应体未读完就关闭时，最多再读多久、多少字节把它读完（读完的连接才能回到连接池复用）
+DRAIN_TIMEOUT_SECONDS = 0.05
+DRAIN_MAX_BYTES = 64 * 1024
+
+HTTP_TRANSPORTS = ('sse', 'streamable_http')
+
+
+def _origin(url: str) -> Tuple[str, str, int]:
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower() or 'http'
+    port = parts.port or (443 if scheme == 'https' else 80)
+    return scheme, (parts.hostname or '').lower(), port
+
+
+class _HostPool:
+    """单个主机的共享连接池"""
+    
+    def __init__(self, origin: Tuple[str, str, int], transport):
+        self.origin = origin
+        self.transport = transport
+        self.clients = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # 见过的TCP连接（连接池中的连接对象），用来统计实际建立的连接数
+        self._seen = weakref.WeakSet()
+        self.opened_connections = 0
+        self.peak_connections = 0
+        self.drained = 0
+    
+    def connections(self) -> Optional[list]:
+        """连接池中当前的连接（httpx没有公开接口，取不到时为None）"""
+        return getattr(getattr(self.transport, '_pool', None), 'connections', None)
+    
+    def track_connections(self):
+        """记录新建立的连接和同时打开的连接数峰值（在请求拿到连接之后调用）"""
+        connections = self.connections()
+        if connections is None:
+            return
+        self.peak_connections = max(self.peak_connections, len(connections))
+        for connection in connections:
+            if connection not in self._seen:
+                self._seen.add(connection)
+                self.opened_connections += 1
+
+
+if HTTP_TRANSPORT_AVAILABLE:
+    class _ResponseStream(httpx.AsyncByteStream):
+        """
+        共享连接池中的响应体：关闭时才算请求结束；响应体没有读完就关闭时，
+        先在很短的时间内读完剩余部分，使连接可以回到连接池复用
+        （mcp的streamable_http客户端收到结果后直接关闭SSE响应，否则每个请求都要新建一个连接）
+        """
+        
+        def __init__(self, stream, host: _HostPool):
+            self._stream = stream
+            self._host = host
+            self._exhausted = False
+            self._closed = False
+        
+        async def __aiter__(self):
+            async for chunk in self._stream:
+                yield chunk
+            self._exhausted = True
+        
+        async def _drain(self):
+            remaining = DRAIN_MAX_BYTES
+            async for chunk in self._stream:
+                remaining -= len(chunk)
+                if remaining < 0:
+                    return
+            self._exhausted = True
+        
+        async def aclose(self):
+            if self._closed:
+                return
+            self._closed = True
+            self._host.in_flight -= 1
+            try:
+                if not self._exhausted:
+                    await asyncio.wait_for(self._drain(), DRAIN_TIMEOUT_SECONDS)
+                    if self._exhausted:
+                        self._host.drained += 1
+            except Exception:
+                # 读不完（例如长时间的推送流）时直接关闭，连接不再复用
+                pass
+            finally:
+                await self._stream.aclose()
+    
+    class _PooledTransport(httpx.AsyncBaseTransport):
+        """
+        单个httpx客户端使用的传输：请求转发给主机的共享连接池，
+        客户端关闭时只释放引用，最后一个客户端关闭时才关闭连接池
+        """
+        
+        def __init__(self, pool: 'HTTPConnectionPool', host: _HostPool):
+            self._pool = pool
+            self._host = host
+            self._closed = False
+        
+        async def handle_async_request(self, request):
+            host = self._host
+            host.requests += 1
+            host.in_flight += 1
+            host.peak_in_flight = max(host.peak_in_flight, host.in_flight)
+            try:
+                response = await host.transport.handle_async_request(request)
+            except BaseException:
+                host.in_flight -= 1
+                raise
+            host.track_connections()
+            # 请求在响应体关闭时才结束，in_flight是实际占用连接的请求数
+            response.stream = _ResponseStream(response.stream, host)
+            return response
+        
+        async def aclose(self):
+            if not self._closed:
+                self._closed = True
+                await self._pool.release(self._host)
+
+
+class HTTPConnectionPool:
+    """按主机共享的keep-alive连接池"""
+    
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_SECONDS):
+        """
+        参数:
+            max_connections: 每个主机的最大连接数
+            max_keepalive: 每个主机保持的空闲连接数
+            keepalive_expiry: 空闲连接保留时间（秒）
+        """
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self._hosts: Dict[Tuple[str, str, int], _HostPool] = {}
+        self._lock = threading.Lock()
+    
+    def client(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout=None, auth=None):
+        """
+        创建使用共享连接池的httpx客户端（需要在MCP事件循环中使用，关闭客户端时释放连接池引用）
+        
+        参数:
+            url: 服务器地址，用于确定主机
+            headers: 该服务器的请求头
+            timeout: httpx.Timeout
+            auth: httpx认证
+        
+        返回:
+            httpx.AsyncClient
+        """
+        origin = _origin(url)
+        with self._lock:
+            host = self._hosts.get(origin)
+            if host is None:
+                transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry
+                ))
+                host = self._hosts[origin] = _HostPool(origin, transport)
+                logger.info(f"创建MCP HTTP连接池: {origin[0]}://{origin[1]}:{origin[2]}")
+            host.clients += 1
+        kwargs: Dict[str, Any] = {"transport": _PooledTransport(self, host), "timeout": timeout}
+        if headers:
+            kwargs["headers"] = headers
+        if auth is not None:
+            kwargs["auth"] = auth
+        return httpx.AsyncClient(**kwargs)
+    
+    async def release(self, host: _HostPool):
+        """释放一个客户端对连接池的引用"""
+        with self._lock:
+            host.clients -= 1
+            if host.clients > 0 or self._hosts.get(host.origin) is not host:
+                return
+            del self._hosts[host.origin]
+        await host.transport.aclose()
+        logger.info(f"关闭MCP HTTP连接池: {host.origin[0]}://{host.origin[1]}:{host.origin[2]}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        各主机连接池的统计
+        
+        返回:
+            {主机: {"clients", "connections"（当前打开的TCP连接）, "opened_connections"（累计建立的TCP连接）,
+            "peak_connections", "requests", "drained"（提前关闭后读完、连接得以复用的响应数）,
+            "in_flight"（响应体尚未关闭的请求）, "peak_in_flight"}}
+        """
+        with self._lock:
+            hosts = list(self._hosts.values())
+        stats = {}
+        for host in hosts:
+            connections = host.connections()
+            stats[f"{host.origin[0]}://{host.origin[1]}:{host.origin[2]}"] = {
+                "clients": host.clients,
+                "connections": len(connections) if connections is not None else None,
+                "opened_connections": host.opened_connections,
+                "peak_connections": host.peak_connections,
+                "requests": host.requests,
+                "drained": host.drained,
+                "in_flight": host.in_flight,
+                "peak_in_flight": host.peak_in_flight
+            }
+        return stats
+
+
+# 全局连接池实例
+_http_pool: Optional[HTTPConnectionPool] = None
+_http_pool_lock = threading.Lock()
+
+def get_http_pool() -> HTTPConnectionPool:
+    """获取全局MCP HTTP连接池"""
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = HTTPConnectionPool()
+        return _http_pool
+
+
+def http_transport_factory(transport_type: str, url: str, headers: Optional[Dict[str, Any]] = None,
+                           timeout: float = DEFAULT_HTTP_TIMEOUT_SECONDS,
+                           sse_read_timeout: float = DEFAULT_SSE_READ_TIMEOUT_SECONDS,
+                           pool: Optional[HTTPConnectionPool] = None) -> Callable[[], Any]:
+    """
+    创建MCPClient使用的HTTP传输工厂
+    
+    参数:
+        transport_type: sse 或 streamable_http
+        url: 服务器地址
+        headers: 请求头
+        timeout: 普通请求超时（秒）
+        sse_read_timeout: 服务器推送流的读超时（秒）
+        pool: 连接池，默认使用全局实例
+    
+    返回:
+        无参函数，返回产出(read, write, ...)的异步上下文管理器
+    """
+    if not HTTP_TRANSPORT_AVAILABLE:
+        raise RuntimeError("MCP HTTP传输不可用（缺少httpx或mcp）")
+    if transport_type not in HTTP_TRANSPORTS:
+        raise ValueError(f"不支持的HTTP传输类型: {transport_type}")
+    if transport_type == 'streamable_http' and streamable_http_client is None and streamablehttp_client is None:
+        raise RuntimeError("当前mcp版本不支持streamable_http传输")
+    headers = {str(k): str(v) for k, v in (headers or {}).items()}
+    pool = pool or get_http_pool()
+    
+    def client_factory(headers=None, timeout=None, auth=None):
+        return pool.client(url, headers, timeout, auth)
+    
+    if transport_type == 'sse':
+        def sse_factory():
+            return sse_client(url, headers=headers, timeout=timeout, sse_read_timeout=sse_read_timeout,
+                              httpx_client_factory=client_factory)
+        return sse_factory
+    
+    @asynccontextmanager
+    async def streamable_http_factory():
+        if streamable_http_client is None:
+            async with streamablehttp_client(url, headers=headers, timeout=timeout,
+                                             sse_read_timeout=sse_read_timeout,
+                                             httpx_client_factory=client_factory) as streams:
+                yield streams
+            return
+        http_timeout = httpx.Timeout(timeout, read=max(timeout, sse_read_timeout))
+        async with pool.client(url, headers, http_timeout) as client:
+            async with streamable_http_client(url, http_client=client) as streams:
+                yield streams
+    
+    return streamable_http_factory
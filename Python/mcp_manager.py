@@ -3,10 +3,15 @@ MCP（Model Context Protocol）管理器
 负责处理MCP服务器连接、工具加载和资源管理
 """
 
+import concurrent.futures
 import json
 import logging
-import os
-from typing import List, Dict, Any, Optional
+import signal
+import threading
+import time
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+from mcp_config_service import get_mcp_config_service, convert_anthropic_config, DEFAULT_POLL_INTERVAL_SECONDS
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -14,52 +19,207 @@ logger = logging.getLogger(__name__)
 # MCP支持检查
 MCP_AVAILABLE = False
 try:
-    from mcp_client import MCPClient, MCPClientInitializationError
+    from mcp_client import MCPClient, DEFAULT_CALL_TIMEOUT_SECONDS
     from mcp import StdioServerParameters, stdio_client
-    from strands.tools.mcp import MCPClient as StrandsMCPClient
+    from mcp_runtime import get_mcp_runtime
+    from mcp_session import MCPSession, MCPProxyTool, DEFAULT_IDLE_TIMEOUT_SECONDS
+    from mcp_schema_cache import MCPSchemaCache, server_cache_key
+    from mcp_http import http_transport_factory, get_http_pool, HTTP_TRANSPORTS, DEFAULT_HTTP_TIMEOUT_SECONDS
+    from mcp_spill import get_spill_store
+    from mcp_stats import MCPServerStats
+    from mcp_broker import (BrokerClient, broker_supported, get_broker_connection, get_broker_connections,
+                            DEFAULT_SERVER_IDLE_SECONDS as DEFAULT_BROKER_SERVER_IDLE_SECONDS,
+                            DEFAULT_BROKER_IDLE_SECONDS)
+    from mcp_supervisor import (MCPSupervisor, DEFAULT_PING_INTERVAL_SECONDS, DEFAULT_PING_TIMEOUT_SECONDS,
+                                DEFAULT_RESTART_BACKOFF_SECONDS, DEFAULT_MAX_RESTART_BACKOFF_SECONDS)
     MCP_AVAILABLE = True
     logger.info("MCP支持模块导入成功")
 except ImportError as e:
     logger.warning(f"MCP模块导入失败: {e}")
     logger.warning("将使用无MCP模式")
 
+# 启动阶段等待所有服务器的总时长（秒），之后就绪的服务器在后台附加到Agent
+DEFAULT_STARTUP_DEADLINE_SECONDS = 10
+# 单个服务器启动（连接+握手+获取工具列表）的默认期限（秒）
+DEFAULT_SERVER_STARTUP_SECONDS = 30
+# 关闭所有MCP客户端的总期限（秒），其中最后一部分留给强制结束
+DEFAULT_SHUTDOWN_SECONDS = 3.0
+SHUTDOWN_KILL_FRACTION = 0.25
+
+
+def _describe_tools(tools: List[Any]) -> List[Dict[str, Any]]:
+    """代理工具的可缓存描述（经过一次JSON往返，便于和缓存内容比较）"""
+    return json.loads(json.dumps([tool.describe() for tool in tools], ensure_ascii=False, default=str))
+
+
 class MCPManager:
     """MCP管理器，负责管理MCP服务器连接和工具"""
     
     def __init__(self):
         """初始化MCP管理器"""
-        self._mcp_clients = []
+        self._sessions: Dict[str, Any] = {}
         self._mcp_tools = []
         self._config = None
+        # 会话空闲回收
+        self._idle_timeout = 0
+        self._reaper_thread = None
+        self._reaper_stop = threading.Event()
+        # 并发启动状态：每次加载/清理递增generation，旧的启动线程结果会被丢弃
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._startup_phase = False
+        self._startup_status: Dict[str, Dict[str, Any]] = {}
+        # 启动期限之后才就绪的工具，交给监听器附加到Agent
+        self._tool_listener: Optional[Callable[[List[Any]], None]] = None
+        self._late_tools: List[Any] = []
+        # 工具规格磁盘缓存（配置tool_schema_cache为false时不使用）
+        self._schema_cache = None
+        # 上次加载的各服务器生效配置，增量重载时据此判断哪些服务器需要重启
+        self._server_configs: Dict[str, Dict[str, Any]] = {}
+        # 服务器监督（断开检测、ping、退避重启和熔断），配置supervise_servers为false时不启用
+        self._supervisor = None
+        # 配置文件变更监听器，以及串行化增量重载（手动重载和自动重载可能同时发生）
+        self._config_listener: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._reload_lock = threading.Lock()
+        # 按服务器名称保存的调用统计，会话重建和配置重载后继续累计
+        self._server_stats: Dict[str, Any] = {}
+        # 最近一次关闭的报告
+        self.last_shutdown: Optional[Dict[str, Any]] = None
+    
+    @property
+    def _mcp_clients(self) -> List[Any]:
+        """当前存活会话的MCP客户端"""
+        return [session.client for session in list(self._sessions.values()) if session.client is not None]
+    
+    def get_session(self, server_name: str):
+        """获取服务器对应的会话"""
+        return self._sessions.get(server_name)
+    
+    def set_tool_listener(self, listener: Optional[Callable[[List[Any]], None]]):
+        """
+        设置晚就绪工具的监听器，已经在等待的工具会立即交给监听器
         
+        参数:
+            listener: 接收MCP工具列表的回调（在启动线程中调用）；配置重载停止服务器时，
+                在关闭会话的同一临界区内以(空列表, 要移除的工具)调用
+        """
+        with self._lock:
+            self._tool_listener = listener
+            late_tools, self._late_tools = self._late_tools, []
+        if listener is not None and late_tools:
+            listener(late_tools)
+    
+    def get_startup_status(self) -> Dict[str, Dict[str, Any]]:
+        """各服务器的启动状态（cached/starting/ready/late/timeout/failed）和耗时"""
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for name, status in self._startup_status.items():
+                status = dict(status)
+                started = status.pop("started", None)
+                if status["state"] == "starting" and started is not None:
+                    status["elapsed_seconds"] = round(now - started, 2)
+                    # 超过期限仍未完成的服务器（例如卡在握手），完成后结果也会被丢弃
+                    if now - started > status["deadline_seconds"]:
+                        status["state"] = "timeout"
+                result[name] = status
+        return result
+    
     def cleanup(self):
-        """清理所有MCP资源"""
+        """清理所有MCP资源（重载配置或关闭时调用）"""
         try:
-            # 清理MCP客户端
-            if hasattr(self, '_mcp_clients'):
-                for client in self._mcp_clients:
-                    try:
-                        # 正确退出上下文管理器
-                        client.__exit__(None, None, None)
-                    except Exception as e:
-                        logger.warning(f"清理MCP客户端时出错: {e}")
-                self._mcp_clients.clear()
-            
-            # 清理MCP工具
-            if hasattr(self, '_mcp_tools'):
-                for tool in self._mcp_tools:
-                    try:
-                        if hasattr(tool, '_cleanup'):
-                            tool._cleanup()
-                    except Exception as e:
-                        logger.warning(f"清理MCP工具时出错: {e}")
-                self._mcp_tools.clear()
-                
-            logger.info("MCP资源清理完成")
-            
+            self.shutdown()
         except Exception as e:
             logger.warning(f"清理MCP资源时出错: {e}")
     
+    def shutdown(self, deadline: float = DEFAULT_SHUTDOWN_SECONDS) -> Dict[str, Any]:
+        """
+        在一个总期限内并行关闭所有MCP客户端：同时通知所有会话退出并向stdio服务器发送SIGTERM，
+        统一等待；期限的最后一部分仍未退出的服务器发送SIGKILL，到期仍未结束的会话任务被取消
+        
+        参数:
+            deadline: 总期限（秒）
+        
+        返回:
+            关闭报告：服务器数量、正常退出/收到SIGKILL/超时的服务器、耗时
+        """
+        started = time.monotonic()
+        # 丢弃仍在启动中的服务器
+        with self._lock:
+            self._generation += 1
+            self._startup_phase = False
+            self._late_tools = []
+            self._server_configs = {}
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        
+        # 停止空闲回收线程和服务器监督
+        self._reaper_stop.set()
+        if self._supervisor is not None:
+            self._supervisor.stop()
+        
+        # 同时通知所有会话退出，不逐个等待
+        clients = []
+        stopping: Dict[concurrent.futures.Future, str] = {}
+        for session in sessions:
+            client = session.detach(timeout=min(0.5, deadline / 4))
+            if client is None:
+                continue
+            clients.append(client)
+            begin_stop = getattr(client, 'begin_stop', None)
+            if begin_stop is None:
+                # 经代理的客户端只通知代理释放，不会阻塞
+                try:
+                    client.__exit__(None, None, None)
+                except Exception as e:
+                    logger.warning(f"关闭MCP会话 '{session.name}' 时出错: {e}")
+                continue
+            future = begin_stop()
+            if future is not None:
+                stopping[future] = session.name
+        terminated = sum(client.signal_processes(signal.SIGTERM) for client in clients
+                         if hasattr(client, 'signal_processes'))
+        
+        # 统一等待，最后一部分时间留给强制结束
+        kill_at = started + deadline * (1 - SHUTDOWN_KILL_FRACTION)
+        done, pending = concurrent.futures.wait(stopping, timeout=max(0.0, kill_at - time.monotonic()))
+        graceful = sorted(stopping[future] for future in done)
+        killed = 0
+        if pending:
+            kill_signal = getattr(signal, 'SIGKILL', signal.SIGTERM)
+            killed = sum(client.signal_processes(kill_signal) for client in clients
+                         if hasattr(client, 'signal_processes'))
+            _, pending = concurrent.futures.wait(pending, timeout=max(0.0, started + deadline - time.monotonic()))
+            for future in pending:
+                future.cancel()
+        timed_out = sorted(stopping[future] for future in pending)
+        
+        # 清理MCP工具
+        for tool in self._mcp_tools:
+            try:
+                if hasattr(tool, '_cleanup'):
+                    tool._cleanup()
+            except Exception as e:
+                logger.warning(f"清理MCP工具时出错: {e}")
+        self._mcp_tools.clear()
+        
+        report = {
+            "servers": len(sessions),
+            "closed": len(clients),
+            "deadline_seconds": deadline,
+            "graceful": graceful,
+            "sigterm_sent": terminated,
+            "sigkill_sent": killed,
+            "timed_out": timed_out,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+        }
+        self.last_shutdown = report
+        if timed_out:
+            logger.warning(f"MCP会话未能在{deadline}秒内关闭，已取消: {', '.join(timed_out)}")
+        logger.info(f"MCP资源清理完成: {len(clients)} 个客户端，耗时 {report['elapsed_ms']}ms，"
+                    f"SIGKILL {killed} 个")
+        return report
+    
     def load_mcp_tools(self):
         """加载MCP工具"""
         if not MCP_AVAILABLE:
@@ -75,6 +235,8 @@ class MCPManager:
             if not mcp_config:
                 logger.warning("MCP配置加载失败")
                 return []
+            self._config = mcp_config
+            self._apply_config_watch(mcp_config)
             
             logger.info(f"MCP配置内容: enable_mcp={mcp_config.get('enable_mcp')}, servers数量={len(mcp_config.get('servers', []))}")
             
@@ -90,209 +252,607 @@ class MCPManager:
             
             logger.info(f"发现 {len(enabled_servers)} 个启用的MCP服务器")
             
-            for server_config in enabled_servers:
-                try:
-                    server_name = server_config.get('name', 'unknown')
-                    logger.info(f"连接到MCP服务器 '{server_name}'...")
-                    
-                    # 创建Strands MCPClient
-                    mcp_client = self._create_strands_mcp_client(server_config)
-                    
-                    if mcp_client:
-                        # 手动进入上下文管理器并保持连接
-                        mcp_client.__enter__()
-                        
-                        # 保存客户端引用以便后续使用和清理
-                        self._mcp_clients.append(mcp_client)
-                        
-                        try:
-                            logger.info(f"获取MCP服务器 '{server_name}' 的工具列表...")
-                            # 使用Strands MCPClient的正确方法
-                            raw_tools = mcp_client.list_tools_sync()
-                            
-                            logger.info(f"MCP客户端类型: {type(mcp_client)}")
-                            logger.info(f"返回的工具类型: {type(raw_tools)}")
-                            logger.info(f"工具内容: {raw_tools}")
-                            
-                            if raw_tools:
-                                logger.info(f"找到 {len(raw_tools)} 个工具:")
-                                for i, tool in enumerate(raw_tools):
-                                    tool_name = getattr(tool, 'name', f'tool_{i}')
-                                    tool_desc = getattr(tool, 'description', 'No description')
-                                    logger.info(f"  - {tool_name}: {tool_desc}")
-                                
-                                # 添加工具到列表 - Strands MCPClient返回的工具可以直接使用
-                                mcp_tools.extend(raw_tools)
-                                logger.info(f"从 '{server_name}' 加载了 {len(raw_tools)} 个工具")
-                            else:
-                                logger.warning(f"MCP服务器 '{server_name}' 没有可用工具")
-                        except Exception as tool_error:
-                            logger.error(f"获取工具列表失败: {tool_error}")
-                            # 如果获取工具失败，从客户端列表中移除并关闭
-                            if mcp_client in self._mcp_clients:
-                                self._mcp_clients.remove(mcp_client)
-                            try:
-                                mcp_client.__exit__(None, None, None)
-                            except:
-                                pass
-                            raise
-                except Exception as e:
-                    logger.error(f"加载MCP服务器 '{server_config.get('name', 'unknown')}' 失败: {e}")
-                    logger.error(f"错误类型: {type(e).__name__}")
-                    import traceback
-                    logger.error(f"堆栈跟踪:\n{traceback.format_exc()}")
-                    continue
+            server_configs, startup_deadline, idle_timeout = self._resolve_server_configs(mcp_config)
+            
+            with self._lock:
+                self._generation += 1
+                generation = self._generation
+                self._mcp_tools = []
+                self._startup_status = {}
+                self._server_configs = dict(server_configs)
+                self._idle_timeout = idle_timeout or 0
+                self._schema_cache = MCPSchemaCache() if mcp_config.get('tool_schema_cache', True) else None
             
-            logger.info(f"总共加载了 {len(mcp_tools)} 个MCP工具")
-            self._mcp_tools = mcp_tools
+            started = time.monotonic()
+            pending = self._launch_servers(list(server_configs.values()), generation, started + startup_deadline)
+            
+            with self._lock:
+                mcp_tools = list(self._mcp_tools)
+            
+            logger.info(f"总共加载了 {len(mcp_tools)} 个MCP工具，耗时 {time.monotonic() - started:.2f}秒")
+            if pending:
+                logger.info(f"MCP服务器仍在启动，就绪后附加到Agent: {', '.join(pending)}")
+            
+            # 启动空闲会话回收和服务器监督
+            self._start_idle_reaper(idle_timeout)
+            self._start_supervisor(mcp_config)
+            self._configure_result_spill(mcp_config)
             
         except Exception as e:
             logger.error(f"MCP工具加载过程中出现错误: {e}")
         
         return mcp_tools
     
-    def _load_unity_mcp_config(self):
-        """从Unity加载MCP配置"""
+    @staticmethod
+    def _resolve_server_configs(mcp_config: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], float, float]:
+        """
+        计算每个启用服务器的生效配置（合并全局默认的启动期限、并发上限和调用期限）
+        
+        参数:
+            mcp_config: MCP配置
+        
+        返回:
+            ({服务器名称: 生效配置}, 启动阶段总期限, 会话空闲超时)
+        """
+        startup_deadline = float(mcp_config.get('startup_deadline_seconds', DEFAULT_STARTUP_DEADLINE_SECONDS))
+        default_server_deadline = float(mcp_config.get('default_timeout_seconds', DEFAULT_SERVER_STARTUP_SECONDS))
+        # 每个服务器同时进行的工具调用上限和每次调用的期限，服务器配置可单独覆盖
+        default_max_calls = int(mcp_config.get('max_concurrent_connections') or 0)
+        default_call_timeout = float(mcp_config.get('default_timeout_seconds') or DEFAULT_CALL_TIMEOUT_SECONDS)
+        idle_timeout = mcp_config.get('session_idle_timeout_seconds', DEFAULT_IDLE_TIMEOUT_SECONDS)
+        
+        server_configs = {}
+        for server_config in mcp_config.get('servers', []):
+            if not server_config.get('enabled', False):
+                continue
+            server_configs[server_config.get('name', 'unknown')] = dict(
+                server_config,
+                startup_timeout_seconds=float(server_config.get('startup_timeout_seconds', default_server_deadline)),
+                max_concurrent_calls=int(server_config.get('max_concurrent_calls', default_max_calls) or 0),
+                call_timeout_seconds=float(server_config.get('call_timeout_seconds', default_call_timeout))
+            )
+        return server_configs, startup_deadline, idle_timeout
+    
+    def _launch_servers(self, server_configs: List[Dict[str, Any]], generation: int, deadline: float) -> List[str]:
+        """
+        工具规格缓存命中的服务器直接注册，其余服务器并发启动，每个服务器有自己的期限；
+        只等待到全局期限，之后就绪的服务器在后台附加
+        
+        参数:
+            server_configs: 生效的服务器配置
+            generation: 当前加载代数
+            deadline: 启动阶段结束的时间点（time.monotonic）
+        
+        返回:
+            期限到达时仍在启动的服务器名称
+        """
+        with self._lock:
+            self._startup_phase = True
+        
+        threads = []
+        for server_config in server_configs:
+            server_name = server_config.get('name', 'unknown')
+            server_deadline = server_config['startup_timeout_seconds']
+            cache_key = server_cache_key(server_config) if self._schema_cache is not None else None
+            cached_tools = self._schema_cache.get(server_name, cache_key) if cache_key else None
+            if cached_tools is not None:
+                self._register_cached_server(server_config, cache_key, cached_tools)
+                continue
+            
+            with self._lock:
+                self._startup_status[server_name] = {
+                    "state": "starting", "deadline_seconds": server_deadline, "started": time.monotonic()
+                }
+            thread = threading.Thread(
+                target=self._start_server,
+                args=(server_config, server_deadline, generation, cache_key),
+                name=f"MCPStartup-{server_name}",
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        
+        with self._lock:
+            self._startup_phase = False
+            return [name for name, status in self._startup_status.items() if status["state"] == "starting"]
+    
+    def reload_incremental(self) -> Tuple[Dict[str, Any], List[Any], List[Any]]:
+        """
+        重新读取配置并与正在使用的服务器配置逐个对比：启动新增的服务器，停止删除的服务器，
+        只重启配置变化（或上次未能启动）的服务器，其余会话保持不动
+        
+        返回:
+            (结果字典, 新增的MCP工具, 需要从Agent移除的MCP工具)
+        """
+        with self._reload_lock:
+            return self._reload_incremental()
+    
+    def _reload_incremental(self) -> Tuple[Dict[str, Any], List[Any], List[Any]]:
+        if not MCP_AVAILABLE:
+            return {"success": False, "message": "MCP支持不可用", "mcp_enabled": False, "server_count": 0}, [], []
+        
         try:
-            # 调试：打印当前工作目录
-            current_dir = os.getcwd()
-            logger.info(f"当前Python工作目录: {current_dir}")
+            logger.info("=== 开始增量重新加载MCP配置 ===")
+            mcp_config = self._load_unity_mcp_config()
+            if not mcp_config:
+                return {"success": False, "message": "MCP配置加载失败", "mcp_enabled": False, "server_count": 0}, [], []
+            self._config = mcp_config
+            self._apply_config_watch(mcp_config)
             
-            # 优先使用项目根目录环境变量构建MCP配置路径
-            project_root = os.environ.get('PROJECT_ROOT_PATH')
-            if project_root:
-                # 使用项目根目录 + 相对路径
-                mcp_config_path = os.path.join(project_root, "Assets/UnityAIAgent/mcp_config.json")
-                config_paths = [mcp_config_path]
-                logger.info(f"使用项目根目录构建MCP配置路径: {mcp_config_path}")
+            if mcp_config.get('enable_mcp', False):
+                new_configs, startup_deadline, idle_timeout = self._resolve_server_configs(mcp_config)
             else:
-                # 回退到原有的相对路径搜索逻辑
-                logger.info("未找到PROJECT_ROOT_PATH环境变量，使用相对路径搜索")
-                config_paths = [
-                    "Assets/UnityAIAgent/mcp_config.json",
-                    "../Assets/UnityAIAgent/mcp_config.json",
-                    "../../Assets/UnityAIAgent/mcp_config.json",
-                    "mcp_config.json"
-                ]
+                new_configs, startup_deadline, idle_timeout = {}, 0.0, 0
             
-            for config_path in config_paths:
-                abs_path = os.path.abspath(config_path)
-                logger.debug(f"检查配置路径: {config_path} -> {abs_path} (存在: {os.path.exists(config_path)})")
-                if os.path.exists(config_path):
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        logger.info(f"从 {config_path} 加载MCP配置")
-                        logger.debug(f"JSON内容预览: {content[:200]}...")
-                        
-                        raw_config = json.loads(content)
-                        
-                        # 检测配置格式并转换
-                        if 'mcpServers' in raw_config:
-                            # Anthropic格式，需要转换为内部格式
-                            logger.info("检测到Anthropic MCP配置格式")
-                            logger.info(f"mcpServers数量: {len(raw_config.get('mcpServers', {}))}")
-                            return self._convert_anthropic_config(raw_config)
-                        else:
-                            # Legacy格式，直接使用
-                            logger.info("检测到Legacy MCP配置格式")
-                            return raw_config
+            with self._lock:
+                old_configs = self._server_configs
+                added = [name for name in new_configs if name not in old_configs]
+                removed = [name for name in old_configs if name not in new_configs]
+                # 没有会话的服务器（启动失败、超时或仍在启动）也重新启动
+                modified = [name for name in new_configs if name in old_configs
+                            and (new_configs[name] != old_configs[name] or name not in self._sessions)]
+                unchanged = [name for name in new_configs if name in old_configs and name not in modified]
+                
+                # 仍在进行的旧启动线程的结果会被丢弃，未变化的会话不受影响
+                self._generation += 1
+                generation = self._generation
+                self._server_configs = dict(new_configs)
+                self._idle_timeout = idle_timeout or 0
+                if not mcp_config.get('tool_schema_cache', True):
+                    self._schema_cache = None
+                elif self._schema_cache is None:
+                    self._schema_cache = MCPSchemaCache()
+                
+                stopped = [self._sessions.pop(name) for name in removed + modified if name in self._sessions]
+                removed_tools = [tool for tool in self._mcp_tools if getattr(tool, 'session', None) in stopped]
+                self._mcp_tools = [tool for tool in self._mcp_tools if getattr(tool, 'session', None) not in stopped]
+                self._late_tools = [tool for tool in self._late_tools if getattr(tool, 'session', None) not in stopped]
+                for name in removed + modified:
+                    self._startup_status.pop(name, None)
+                
+                # 先关闭会话再移除工具：之后对旧工具的调用直接失败，不会在已移出会话池的会话上重启服务器
+                clients = [session.detach() for session in stopped]
+                listener = self._tool_listener
             
-            # 如果找不到配置文件，返回默认配置
-            logger.info("未找到MCP配置文件，使用默认配置")
-            return {
-                "enable_mcp": False,
-                "max_concurrent_connections": 3,
-                "default_timeout_seconds": 30,
-                "servers": []
-            }
+            # 在锁外通知监听器，监听器可能回调管理器（与启动期限之后附加工具时一致）
+            if listener is not None and removed_tools:
+                listener([], removed_tools)
+            for session, client in zip(stopped, clients):
+                if client is None:
+                    continue
+                try:
+                    client.__exit__(None, None, None)
+                except Exception as e:
+                    logger.warning(f"关闭MCP会话 '{session.name}' 时出错: {e}")
+            if stopped:
+                logger.info(f"已停止MCP服务器: {', '.join(session.name for session in stopped)}")
+            
+            started = time.monotonic()
+            launched = added + modified
+            pending = self._launch_servers([new_configs[name] for name in launched], generation,
+                                           started + startup_deadline)
+            with self._lock:
+                added_tools = [tool for tool in self._mcp_tools
+                               if getattr(getattr(tool, 'session', None), 'name', None) in launched]
             
+            if launched:
+                self._start_idle_reaper(idle_timeout)
+            self._start_supervisor(mcp_config)
+            self._configure_result_spill(mcp_config)
+            
+            result = {
+                "success": True,
+                "message": "MCP配置重新加载成功",
+                **self._config_summary(mcp_config),
+                "added": added,
+                "removed": removed,
+                "modified": modified,
+                "unchanged": unchanged,
+                "pending": pending,
+                "tools_added": [tool.tool_name for tool in added_tools],
+                "tools_removed": [tool.tool_name for tool in removed_tools]
+            }
+            logger.info(f"MCP配置增量重新加载完成: 新增 {len(added)}，删除 {len(removed)}，"
+                        f"重启 {len(modified)}，未变化 {len(unchanged)}，耗时 {time.monotonic() - started:.2f}秒")
+            return result, added_tools, removed_tools
+        
         except Exception as e:
-            logger.warning(f"加载Unity MCP配置失败: {e}")
+            logger.error(f"增量重新加载MCP配置失败: {e}")
+            return {
+                "success": False,
+                "message": f"重新加载MCP配置失败: {str(e)}",
+                "error": str(e)
+            }, [], []
+    
+    @staticmethod
+    def _config_summary(mcp_config: Dict[str, Any]) -> Dict[str, Any]:
+        """配置的启用状态和服务器列表摘要"""
+        servers = mcp_config.get('servers', [])
+        return {
+            "mcp_enabled": mcp_config.get('enable_mcp', False),
+            "server_count": len(servers),
+            "enabled_server_count": len([s for s in servers if s.get('enabled', False)]),
+            "servers": [{
+                "name": s.get('name'),
+                "transport_type": s.get('transport_type'),
+                "enabled": s.get('enabled')
+            } for s in servers]
+        }
+    
+    def _register_cached_server(self, server_config: Dict[str, Any], cache_key: str,
+                                cached_tools: List[Dict[str, Any]]):
+        """
+        用缓存的工具规格注册服务器，不启动服务器进程；第一次调用工具时才建立会话，
+        之后在后台核对实时工具列表
+        
+        参数:
+            server_config: 服务器配置
+            cache_key: 缓存键
+            cached_tools: 缓存的工具描述
+        """
+        server_name = server_config.get('name', 'unknown')
+        session = MCPSession(server_config, self._create_mcp_client,
+                             on_started=self._schema_refresher(cache_key))
+        tools = [MCPProxyTool(session, entry['mcp_name'], entry['spec']) for entry in cached_tools]
+        with self._lock:
+            self._sessions[server_name] = session
+            self._mcp_tools.extend(tools)
+            self._startup_status[server_name] = {"state": "cached", "tools": len(tools), "elapsed_seconds": 0.0}
+        logger.info(f"从缓存注册MCP服务器 '{server_name}' 的 {len(tools)} 个工具，首次调用时再启动服务器")
+    
+    def _schema_refresher(self, cache_key: Optional[str]) -> Optional[Callable[[Any], None]]:
+        """会话建立后在后台线程中核对工具列表的回调"""
+        if self._schema_cache is None or not cache_key:
             return None
+        
+        def on_started(session):
+            threading.Thread(
+                target=self._refresh_schema,
+                args=(session, cache_key),
+                name=f"MCPSchemaRefresh-{session.name}",
+                daemon=True
+            ).start()
+        
+        return on_started
     
-    def _convert_anthropic_config(self, anthropic_config):
-        """将Anthropic MCP格式转换为内部格式"""
+    def _refresh_schema(self, session, cache_key: str):
+        """
+        对比实时工具列表和缓存，不一致时更新缓存并附加新增的工具
+        
+        参数:
+            session: 刚建立连接的会话
+            cache_key: 缓存键
+        """
+        schema_cache = self._schema_cache
         try:
-            mcp_servers = anthropic_config.get('mcpServers', {})
-            converted_servers = []
-            
-            for server_name, server_config in mcp_servers.items():
-                logger.info(f"转换服务器: {server_name}")
-                logger.debug(f"服务器配置: {server_config}")
-                
-                converted_server = {
-                    'name': server_name,
-                    'enabled': True,  # Anthropic格式中启用的服务器默认为enabled
-                    'description': f'MCP服务器: {server_name}',
-                }
-                
-                # 处理不同的传输类型
-                if 'command' in server_config:
-                    # Stdio传输
-                    converted_server.update({
-                        'transport_type': 'stdio',
-                        'command': server_config.get('command', ''),
-                        'args': server_config.get('args', []),
-                        'working_directory': server_config.get('working_directory', ''),
-                        'env_vars': server_config.get('env', {})
-                    })
-                elif 'transport' in server_config and 'url' in server_config:
-                    # 远程传输
-                    transport = server_config.get('transport', 'streamable_http')
-                    
-                    # 映射传输类型
-                    transport_mapping = {
-                        'sse': 'sse',
-                        'streamable_http': 'streamable_http',
-                        'http': 'streamable_http',  # 默认使用streamable_http
-                        'https': 'streamable_http'
-                    }
-                    
-                    mapped_transport = transport_mapping.get(transport, 'streamable_http')
-                    
-                    converted_server.update({
-                        'transport_type': mapped_transport,
-                        'url': server_config.get('url', ''),
-                        'timeout': 30,  # 默认超时
-                        'headers': server_config.get('headers', {})
-                    })
-                    
-                elif 'url' in server_config:
-                    # 只有URL的情况，默认使用streamable_http
-                    converted_server.update({
-                        'transport_type': 'streamable_http',
-                        'url': server_config.get('url', ''),
-                        'timeout': 30,
-                        'headers': server_config.get('headers', {})
-                    })
-                
-                converted_servers.append(converted_server)
-            
-            # 返回转换后的配置
-            converted_config = {
-                'enable_mcp': len(converted_servers) > 0,
-                'max_concurrent_connections': 5,
-                'default_timeout_seconds': 30,
-                'servers': converted_servers
-            }
+            live_tools = [MCPProxyTool.from_agent_tool(session, tool) for tool in session.list_tools() or []]
+        except Exception as e:
+            logger.warning(f"核对MCP服务器 '{session.name}' 的工具列表失败: {e}")
+            return
+        entries = _describe_tools(live_tools)
+        if schema_cache is None or schema_cache.matches(session.name, cache_key, entries):
+            return
+        schema_cache.put(session.name, cache_key, entries)
+        
+        with self._lock:
+            # 会话已被清理或重载替换
+            if self._sessions.get(session.name) is not session:
+                return
+            known = {tool.tool_name for tool in self._mcp_tools if getattr(tool, 'session', None) is session}
+            added = [tool for tool in live_tools if tool.tool_name not in known]
+            self._mcp_tools.extend(added)
+            listener = self._tool_listener
+            if listener is None:
+                self._late_tools.extend(added)
+        
+        removed = known - {tool.tool_name for tool in live_tools}
+        logger.info(f"MCP服务器 '{session.name}' 的工具列表已变化，缓存已更新（新增 {len(added)} 个，移除 {len(removed)} 个）")
+        if removed:
+            logger.warning(f"以下MCP工具在服务器上已不存在，调用将返回错误: {', '.join(sorted(removed))}")
+        if listener is not None and added:
+            listener(added)
+    
+    def _start_server(self, server_config: Dict[str, Any], server_deadline: float, generation: int,
+                      cache_key: Optional[str] = None):
+        """
+        在启动线程中连接单个服务器并获取工具列表
+        
+        参数:
+            server_config: 服务器配置
+            server_deadline: 该服务器的启动期限（秒）
+            generation: 启动时的加载代数，与当前不一致时丢弃结果
+            cache_key: 工具规格缓存键，None表示不写缓存
+        """
+        server_name = server_config.get('name', 'unknown')
+        started = time.monotonic()
+        session = None
+        try:
+            logger.info(f"连接到MCP服务器 '{server_name}'...")
+            # 创建会话，跨消息复用，失效时按需重建
+            session = MCPSession(server_config, self._create_mcp_client)
+            raw_tools = session.list_tools() or []
             
-            logger.info(f"Anthropic格式转换完成，共 {len(converted_servers)} 个服务器")
-            return converted_config
+            if raw_tools:
+                logger.info(f"找到 {len(raw_tools)} 个工具:")
+                for i, tool in enumerate(raw_tools):
+                    tool_name = getattr(tool, 'tool_name', f'tool_{i}')
+                    tool_spec = getattr(tool, 'tool_spec', {}) or {}
+                    logger.info(f"  - {tool_name}: {tool_spec.get('description', 'No description')}")
+            else:
+                logger.warning(f"MCP服务器 '{server_name}' 没有可用工具")
             
+            # 注册代理工具：每次调用时从会话取得当前客户端
+            tools = [MCPProxyTool.from_agent_tool(session, tool) for tool in raw_tools]
         except Exception as e:
-            logger.error(f"转换Anthropic MCP配置失败: {e}")
-            return {
-                "enable_mcp": False,
-                "max_concurrent_connections": 3,
-                "default_timeout_seconds": 30,
-                "servers": []
+            logger.error(f"加载MCP服务器 '{server_name}' 失败: {e}")
+            logger.error(f"错误类型: {type(e).__name__}")
+            if session is not None:
+                session.close()
+            with self._lock:
+                if generation == self._generation:
+                    self._startup_status[server_name] = {
+                        "state": "failed", "error": str(e), "elapsed_seconds": round(time.monotonic() - started, 2)
+                    }
+            return
+        
+        elapsed = time.monotonic() - started
+        listener = None
+        with self._lock:
+            if generation != self._generation:
+                # 启动期间配置已重载或已清理
+                state = "discarded"
+            elif elapsed > server_deadline:
+                state = "timeout"
+            else:
+                state = "ready" if self._startup_phase else "late"
+                self._sessions[server_name] = session
+                self._mcp_tools.extend(tools)
+                if state == "late":
+                    listener = self._tool_listener
+                    if listener is None:
+                        self._late_tools.extend(tools)
+            if state != "discarded":
+                self._startup_status[server_name] = {
+                    "state": state, "tools": len(tools), "elapsed_seconds": round(elapsed, 2)
+                }
+        
+        if state in ("discarded", "timeout"):
+            logger.warning(f"MCP服务器 '{server_name}' 启动结果被丢弃（{state}，耗时 {elapsed:.2f}秒）")
+            session.close()
+            return
+        
+        logger.info(f"从 '{server_name}' 加载了 {len(tools)} 个工具，耗时 {elapsed:.2f}秒")
+        schema_cache = self._schema_cache
+        if schema_cache is not None and cache_key:
+            schema_cache.put(server_name, cache_key, _describe_tools(tools))
+            # 之后会话重建时在后台核对工具列表
+            session.on_started = self._schema_refresher(cache_key)
+        if state == "late":
+            self._start_idle_reaper(self._idle_timeout)
+            if listener is not None and tools:
+                listener(tools)
+    
+    def _start_idle_reaper(self, idle_timeout: float):
+        """
+        启动后台线程，关闭空闲超时的会话（下次调用时会重新建立）
+        
+        参数:
+            idle_timeout: 空闲超时（秒），小于等于0时不回收
+        """
+        def reap(stop_event: threading.Event, interval: float):
+            while not stop_event.wait(interval):
+                for session in list(self._sessions.values()):
+                    if session.close_if_idle(self._idle_timeout):
+                        logger.info(f"MCP会话 '{session.name}' 空闲超过 {self._idle_timeout}秒，已关闭")
+        
+        # 晚就绪的服务器可能在多个启动线程中同时调用
+        with self._lock:
+            self._idle_timeout = idle_timeout or 0
+            if self._idle_timeout <= 0 or not self._sessions:
+                return
+            if self._reaper_thread is not None and self._reaper_thread.is_alive():
+                return
+            
+            self._reaper_stop = threading.Event()
+            interval = min(30.0, max(1.0, self._idle_timeout / 4))
+            self._reaper_thread = threading.Thread(
+                target=reap, args=(self._reaper_stop, interval), name="MCPSessionReaper", daemon=True
+            )
+            self._reaper_thread.start()
+        logger.info(f"MCP会话空闲超时: {self._idle_timeout}秒")
+    
+    def _start_supervisor(self, mcp_config: Dict[str, Any]):
+        """
+        按配置启动（或更新）服务器监督
+        
+        参数:
+            mcp_config: MCP配置，可设置supervise_servers、health_check_interval_seconds、
+                        restart_backoff_seconds和max_restart_backoff_seconds
+        """
+        if not mcp_config.get('enable_mcp', False) or not mcp_config.get('supervise_servers', True):
+            if self._supervisor is not None:
+                self._supervisor.stop()
+            return
+        
+        options = {
+            "ping_interval": float(mcp_config.get('health_check_interval_seconds', DEFAULT_PING_INTERVAL_SECONDS)),
+            "ping_timeout": float(mcp_config.get('health_check_timeout_seconds', DEFAULT_PING_TIMEOUT_SECONDS)),
+            "restart_backoff": float(mcp_config.get('restart_backoff_seconds', DEFAULT_RESTART_BACKOFF_SECONDS)),
+            "max_restart_backoff": float(mcp_config.get('max_restart_backoff_seconds',
+                                                        DEFAULT_MAX_RESTART_BACKOFF_SECONDS))
+        }
+        if self._supervisor is None:
+            self._supervisor = MCPSupervisor(lambda: dict(self._sessions), **options)
+        else:
+            for key, value in options.items():
+                setattr(self._supervisor, key, value)
+        self._supervisor.start()
+    
+    @staticmethod
+    def _configure_result_spill(mcp_config: Dict[str, Any]):
+        """按配置设置大型结果的落盘阈值（result_spill_threshold_bytes为0时不落盘）、保留的开头大小和目录上限"""
+        get_spill_store().configure(
+            threshold_bytes=mcp_config.get('result_spill_threshold_bytes'),
+            head_bytes=mcp_config.get('result_head_bytes'),
+            max_total_bytes=mcp_config.get('result_spill_max_total_bytes')
+        )
+    
+    def get_mcp_stats(self, reset: bool = False, detailed: bool = True, top: int = 10) -> Dict[str, Any]:
+        """
+        各服务器按操作和按工具的调用次数、错误、超时、排队和往返时间直方图及负载字节数，
+        以及会话状态和共用资源（MCP事件循环、HTTP连接池、结果落盘、代理连接）的状态
+        
+        参数:
+            reset: 读取后是否清空调用统计
+            detailed: 是否包含排队时间、字节数、直方图的桶、各工具明细和共用资源的状态
+            top: slowest_tools中列出的工具数量（按累计往返时间排序，用来找出占用Agent回合时间最多的工具）
+        
+        返回:
+            {"servers": {服务器名称: 统计}, "slowest_tools": [...], "runtime": {...}}，
+            detailed时另有http_pools、result_spill和broker
+        """
+        with self._lock:
+            server_stats = dict(self._server_stats)
+        servers = {}
+        ranking = []
+        for name, stats in server_stats.items():
+            data = stats.get_stats(reset=reset, detailed=detailed)
+            session = self._sessions.get(name)
+            data["alive"] = session.is_alive() if session is not None else False
+            if session is not None:
+                data["in_flight"] = session.in_flight
+                data["starts"] = session.start_count
+                if detailed and hasattr(session.client, 'limiter'):
+                    data["limiter"] = session.client.limiter.get_stats()
+            for tool, tool_stats in data["tools"].items():
+                round_trip = tool_stats["round_trip_ms"]
+                ranking.append({
+                    "server": name,
+                    "tool": tool,
+                    "calls": tool_stats["calls"],
+                    "total_ms": round_trip["total"],
+                    "p95_ms": round_trip["p95"],
+                    "errors": tool_stats["errors"] + tool_stats["tool_errors"] + tool_stats["timeouts"]
+                })
+            if not detailed:
+                data.pop("tools")
+            servers[name] = data
+        ranking.sort(key=lambda item: item["total_ms"], reverse=True)
+        result = {"servers": servers, "slowest_tools": ranking[:top]}
+        if not MCP_AVAILABLE:
+            return result
+        result["runtime"] = get_mcp_runtime().get_stats()
+        if detailed:
+            result["http_pools"] = get_http_pool().get_stats()
+            result["result_spill"] = get_spill_store().get_stats()
+            result["broker"] = {connection.socket_path: connection.get_stats()
+                                for connection in get_broker_connections()}
+        return result
+    
+    def get_server_health(self) -> Dict[str, Dict[str, Any]]:
+        """
+        各服务器的健康状态
+        
+        返回:
+            {服务器名称: {"state": up/restarting/open/idle, "restart_count", "last_error", ...}}
+        """
+        supervised = self._supervisor.get_status() if self._supervisor is not None else {}
+        result = {}
+        for name, session in list(self._sessions.items()):
+            result[name] = supervised.get(name) or {
+                "state": "up" if session.is_alive() else "idle",
+                "restart_count": 0,
+                "last_error": None
             }
+        return result
+    
+    def _load_unity_mcp_config(self):
+        """从Unity加载MCP配置（配置服务缓存解析结果，文件未变化时不读取文件）"""
+        return get_mcp_config_service().get_config()
+    
+    def _convert_anthropic_config(self, anthropic_config):
+        """将Anthropic MCP格式转换为内部格式"""
+        return convert_anthropic_config(anthropic_config)
+    
+    def set_config_listener(self, listener: Optional[Callable[[Dict[str, Any]], None]]):
+        """
+        设置配置文件变更的监听器（配置watch_config为true时监视配置文件）
+        
+        参数:
+            listener: 接收变更事件 {"path", "config", "previous", "diff"} 的回调，None表示取消
+        """
+        service = get_mcp_config_service()
+        with self._lock:
+            previous, self._config_listener = self._config_listener, listener
+        if previous is not None:
+            service.remove_listener(previous)
+        if listener is not None:
+            service.add_listener(listener)
+    
+    def _apply_config_watch(self, mcp_config: Dict[str, Any]):
+        """按配置的watch_config开始或停止监视配置文件"""
+        service = get_mcp_config_service()
+        if mcp_config.get('watch_config', False):
+            service.start_watching(float(mcp_config.get('config_poll_interval_seconds', DEFAULT_POLL_INTERVAL_SECONDS)))
+        elif service.watching:
+            service.stop_watching()
+    
+    @staticmethod
+    def _client_options(server_config: Dict[str, Any]) -> Dict[str, Any]:
+        """服务器配置中的启动期限、并发上限和调用期限"""
+        return {
+            "timeout_seconds": server_config.get('startup_timeout_seconds') or DEFAULT_SERVER_STARTUP_SECONDS,
+            "max_concurrent_calls": int(server_config.get('max_concurrent_calls') or 0),
+            "call_timeout_seconds": float(server_config.get('call_timeout_seconds') or DEFAULT_CALL_TIMEOUT_SECONDS)
+        }
+    
+    def _use_broker(self, server_config: Dict[str, Any]) -> bool:
+        """配置use_broker为true时，stdio服务器由代理进程持有，域重载和重新加载配置后直接复用"""
+        if not (self._config or {}).get('use_broker', False):
+            return False
+        if server_config.get('transport_type', 'stdio') != 'stdio':
+            return False
+        if not broker_supported():
+            logger.warning("当前平台不支持Unix域套接字，不使用MCP代理")
+            return False
+        return True
+    
+    def _create_mcp_client(self, server_config):
+        """创建MCP客户端：启用代理时经代理访问stdio服务器，否则直接连接"""
+        if self._use_broker(server_config):
+            config = self._config
+            connection = get_broker_connection(
+                config.get('broker_socket') or None,
+                python=config.get('broker_python') or None,
+                server_idle_seconds=float(config.get('broker_server_idle_seconds', DEFAULT_BROKER_SERVER_IDLE_SECONDS)),
+                broker_idle_seconds=float(config.get('broker_idle_seconds', DEFAULT_BROKER_IDLE_SECONDS))
+            )
+            options = self._client_options(server_config)
+            return BrokerClient(connection, server_config, timeout_seconds=options["timeout_seconds"],
+                                call_timeout_seconds=options["call_timeout_seconds"],
+                                stats=self._stats_for(server_config))
+        return self.create_direct_client(server_config, self._stats_for(server_config))
     
-    def _create_strands_mcp_client(self, server_config):
-        """使用Strands MCPClient创建MCP客户端"""
+    def _stats_for(self, server_config: Dict[str, Any]):
+        """服务器的调用统计对象（第一次使用时创建）"""
+        name = server_config.get('name', 'unknown')
+        with self._lock:
+            stats = self._server_stats.get(name)
+            if stats is None:
+                stats = self._server_stats[name] = MCPServerStats(name)
+            return stats
+    
+    @staticmethod
+    def create_direct_client(server_config, stats=None):
+        """创建托管在共享MCP事件循环上的MCP客户端（代理进程也用它启动服务器）"""
         try:
             server_name = server_config.get('name', 'unknown')
             transport_type = server_config.get('transport_type', 'stdio')
+            if transport_type in ('http', 'https', 'streamable-http'):
+                transport_type = 'streamable_http'
             
             if transport_type == 'stdio':
                 # 创建stdio MCP客户端 - 按照示例方式
@@ -320,61 +880,33 @@ class MCPManager:
                         )
                     )
                 
-                # 使用Strands MCPClient
-                client = StrandsMCPClient(stdio_factory)
-                logger.info(f"创建Strands MCP客户端: {command} {' '.join(args)}")
+                # 连接和握手受服务器启动期限限制
+                client = MCPClient(stdio_factory, name=server_name, stats=stats,
+                                   **MCPManager._client_options(server_config))
+                logger.info(f"创建MCP客户端: {command} {' '.join(args)}")
+                return client
+            elif transport_type in HTTP_TRANSPORTS:
+                url = server_config.get('url')
+                if not url:
+                    logger.warning(f"MCP服务器 '{server_name}' 缺少url配置")
+                    return None
+                
+                # 同一主机的服务器共用keep-alive连接池，请求头和超时按服务器配置
+                factory = http_transport_factory(
+                    transport_type,
+                    url,
+                    headers=server_config.get('headers') or {},
+                    timeout=float(server_config.get('timeout') or DEFAULT_HTTP_TIMEOUT_SECONDS)
+                )
+                client = MCPClient(factory, name=server_name, stats=stats, **MCPManager._client_options(server_config))
+                logger.info(f"创建MCP客户端: {transport_type} {url}")
                 return client
             else:
                 logger.warning(f"暂不支持的传输类型: {transport_type}")
                 return None
                 
         except Exception as e:
-            logger.error(f"创建Strands MCP客户端失败: {e}")
+            logger.error(f"创建MCP客户端失败: {e}")
             import traceback
             logger.error(f"详细错误: {traceback.format_exc()}")
             return None
-    
-    def reload_config(self) -> Dict[str, Any]:
-        """重新加载MCP配置"""
-        try:
-            logger.info("=== 开始重新加载MCP配置 ===")
-            
-            # 清理现有资源
-            self.cleanup()
-            
-            # 重新加载配置
-            mcp_config = self._load_unity_mcp_config()
-            self._config = mcp_config
-            
-            if mcp_config:
-                enabled_servers = [s for s in mcp_config.get('servers', []) if s.get('enabled', False)]
-                result = {
-                    "success": True,
-                    "message": "MCP配置重新加载成功",
-                    "mcp_enabled": mcp_config.get('enable_mcp', False),
-                    "server_count": len(mcp_config.get('servers', [])),
-                    "enabled_server_count": len(enabled_servers),
-                    "servers": [{
-                        "name": s.get('name'),
-                        "transport_type": s.get('transport_type'),
-                        "enabled": s.get('enabled')
-                    } for s in mcp_config.get('servers', [])]
-                }
-            else:
-                result = {
-                    "success": False,
-                    "message": "MCP配置加载失败",
-                    "mcp_enabled": False,
-                    "server_count": 0
-                }
-            
-            logger.info(f"MCP配置重新加载结果: {result}")
-            return result
-            
-        except Exception as e:
-            logger.error(f"重新加载MCP配置失败: {e}")
-            return {
-                "success": False,
-                "message": f"重新加载MCP配置失败: {str(e)}",
-                "error": str(e)
-            }
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+MCP I/O运行时
+所有MCP会话共用一个常驻的后台事件循环线程：同步调用方直接把协程提交到这个循环并等待结果，
+不再为每个客户端单独创建线程、事件循环和线程池。
+调用的次数、排队和往返时间由各客户端记录在所属服务器的MCPServerStats中
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from stream_metrics import percentile
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 并发上限排队时间保留最近多少次用于计算分位数
+SAMPLE_WINDOW = 200
+
+
+class FifoLimiter:
+    """
+    按到达顺序放行的并发限制（只在MCP事件循环中使用）
+    名额释放时直接交给队首的等待者，后到的调用不会插队
+    """
+    
+    def __init__(self, limit: int = 0):
+        """
+        参数:
+            limit: 同时进行的最大数量，小于等于0表示不限制
+        """
+        self.limit = limit
+        self.active = 0
+        self._waiters: deque = deque()
+        self.queued = 0
+        self.peak_waiting = 0
+        self.wait_ms = deque(maxlen=SAMPLE_WINDOW)
+    
+    @property
+    def waiting(self) -> int:
+        """正在排队的数量"""
+        return len(self._waiters)
+    
+    def try_acquire(self) -> bool:
+        """有空闲名额且没有人排队时立即获取"""
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            return True
+        return False
+    
+    async def acquire(self):
+        """获取一个名额，名额已满时排队等待"""
+        if self.try_acquire():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.peak_waiting = max(self.peak_waiting, len(self._waiters))
+        started = time.perf_counter()
+        try:
+            await waiter
+            self.wait_ms.append(round((time.perf_counter() - started) * 1000, 3))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经交给了自己，转交给下一个等待者
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+    
+    def release(self):
+        """释放名额：有等待者时直接交给队首，否则减少占用数"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active = max(0, self.active - 1)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        wait_ms = list(self.wait_ms)
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "queued": self.queued,
+            "peak_waiting": self.peak_waiting,
+            "wait_ms": {"p50": percentile(wait_ms, 50), "p95": percentile(wait_ms, 95),
+                        "max": max(wait_ms) if wait_ms else None}
+        }
+
+
+class MCPRuntime:
+    """承载所有MCP会话和调用的事件循环线程"""
+    
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 正在执行的调用（只在事件循环线程中访问）
+        self._tasks: Dict[asyncio.Task, str] = {}
+    
+    @property
+    def running(self) -> bool:
+        """事件循环线程是否在运行"""
+        loop = self._loop
+        return loop is not None and not loop.is_closed() and self._thread is not None and self._thread.is_alive()
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """获取（必要时启动）后台事件循环"""
+        with self._lock:
+            if not self.running:
+                ready = threading.Event()
+                
+                def run_loop():
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    self._loop = loop
+                    ready.set()
+                    try:
+                        loop.run_forever()
+                    finally:
+                        self._close_loop(loop)
+                
+                self._thread = threading.Thread(target=run_loop, name="MCPRuntimeLoop", daemon=True)
+                self._thread.start()
+                ready.wait()
+                logger.info("MCP事件循环已启动")
+            return self._loop
+    
+    def in_loop(self) -> bool:
+        """当前线程是否为MCP事件循环线程"""
+        return threading.current_thread() is self._thread
+    
+    def spawn(self, func: Callable[..., Awaitable[Any]], *args) -> concurrent.futures.Future:
+        """
+        在事件循环上启动一个长期任务（如会话主协程），不计入进行中的调用
+        
+        参数:
+            func: 异步函数，协程在事件循环线程中创建
+            *args: 传给func的参数
+        
+        返回:
+            可在任意线程等待的Future，取消它会取消对应的任务
+        """
+        async def run():
+            return await func(*args)
+        
+        return asyncio.run_coroutine_threadsafe(run(), self.loop)
+    
+    def submit(self, label: str, func: Callable[..., Awaitable[Any]], *args) -> concurrent.futures.Future:
+        """
+        提交一次调用
+        
+        参数:
+            label: 调用类别，用于超时提示
+            func: 异步函数，协程在事件循环线程中创建（取消时不会留下未等待的协程）
+            *args: 传给func的参数
+        
+        返回:
+            可在任意线程等待的Future
+        """
+        return asyncio.run_coroutine_threadsafe(self._tracked(label, func, args), self.loop)
+    
+    def run(self, label: str, func: Callable[..., Awaitable[Any]], *args, timeout: Optional[float] = None) -> Any:
+        """
+        同步执行一次调用，超时后取消事件循环中的任务
+        
+        参数:
+            label: 调用类别
+            func: 异步函数
+            *args: 传给func的参数
+            timeout: 最长等待时间（秒），None表示不限
+        
+        返回:
+            协程的返回值
+        """
+        if self.in_loop():
+            raise RuntimeError("不能在MCP事件循环线程中同步等待MCP调用")
+        future = self.submit(label, func, *args)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"MCP调用 {label} 超过 {timeout}秒未完成")
+    
+    async def _tracked(self, label: str, func, args) -> Any:
+        task = asyncio.current_task()
+        self._tasks[task] = label
+        try:
+            return await func(*args)
+        finally:
+            self._tasks.pop(task, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """事件循环是否在运行和进行中的调用数量"""
+        return {
+            "running": self.running,
+            "in_flight": len(self._tasks)
+        }
+    
+    def shutdown(self, timeout: float = 5.0):
+        """停止事件循环线程，剩余任务会被取消"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or loop.is_closed():
+                return
+            loop.call_soon_threadsafe(loop.stop)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f"MCP事件循环线程未能在{timeout}秒内结束")
+    
+    @staticmethod
+    def _close_loop(loop: asyncio.AbstractEventLoop):
+        """取消剩余任务并关闭事件循环"""
+        try:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        except Exception as e:
+            logger.warning(f"关闭MCP事件循环时出错: {e}")
+        finally:
+            loop.close()
+            logger.info("MCP事件循环已停止")
+
+
+# 全局MCP运行时实例
+_mcp_runtime: Optional[MCPRuntime] = None
+_mcp_runtime_lock = threading.Lock()
+
+def get_mcp_runtime() -> MCPRuntime:
+    """获取全局MCP运行时实例"""
+    global _mcp_runtime
+    with _mcp_runtime_lock:
+        if _mcp_runtime is None:
+            _mcp_runtime = MCPRuntime()
+        return _mcp_runtime
@@ -0,0 +1,164 @@
+"""
+MCP工具规格缓存
+把每个服务器的工具列表持久化到磁盘，按服务器配置（命令、参数、环境变量、URL）和
+服务器程序文件的修改时间/大小计算键；键未变化时直接用缓存注册工具，
+服务器进程推迟到第一次调用工具时才启动
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 缓存文件格式版本，格式变化时旧缓存整体失效
+CACHE_VERSION = 1
+# 通过环境变量指定缓存文件
+SCHEMA_CACHE_ENV = 'UNITY_AGENT_MCP_SCHEMA_CACHE'
+
+
+def default_cache_path() -> str:
+    """默认缓存文件：Unity项目的Library目录下，没有项目路径时放在用户目录"""
+    path = os.environ.get(SCHEMA_CACHE_ENV)
+    if path:
+        return path
+    project_root = os.environ.get('PROJECT_ROOT_PATH')
+    if project_root:
+        return os.path.join(project_root, "Library", "UnityAIAgent", "mcp_tool_cache.json")
+    return os.path.join(os.path.expanduser("~"), ".unity_ai_agent", "mcp_tool_cache.json")
+
+
+def _file_fingerprint(path: Optional[str]) -> Optional[List[int]]:
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def server_cache_key(server_config: Dict[str, Any]) -> str:
+    """
+    计算服务器的缓存键：配置或服务器程序（可执行文件和作为参数传入的脚本）变化时键随之变化
+    
+    参数:
+        server_config: 服务器配置
+    
+    返回:
+        十六进制摘要
+    """
+    command = server_config.get('command') or ''
+    args = server_config.get('args') or []
+    binary = shutil.which(command) if command else None
+    identity = {
+        "transport_type": server_config.get('transport_type', 'stdio'),
+        "command": command,
+        "args": args,
+        "env": server_config.get('env') or server_config.get('env_vars') or {},
+        "working_directory": server_config.get('working_directory') or '',
+        "url": server_config.get('url') or '',
+        "headers": server_config.get('headers') or {},
+        "binary": [binary, _file_fingerprint(binary)],
+        "scripts": {arg: _file_fingerprint(arg) for arg in args if isinstance(arg, str) and os.path.isfile(arg)}
+    }
+    text = json.dumps(identity, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class MCPSchemaCache:
+    """服务器工具列表的磁盘缓存"""
+    
+    def __init__(self, path: Optional[str] = None):
+        """
+        参数:
+            path: 缓存文件路径，默认见default_cache_path
+        """
+        self.path = path or default_cache_path()
+        self._lock = threading.Lock()
+        self._servers: Optional[Dict[str, Any]] = None
+        self.hits = 0
+        self.misses = 0
+    
+    def _load(self) -> Dict[str, Any]:
+        if self._servers is not None:
+            return self._servers
+        self._servers = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self._servers = data.get('servers') or {}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"读取MCP工具缓存失败，将重新获取: {e}")
+        return self._servers
+    
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": CACHE_VERSION, "servers": self._servers}, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+    
+    def get(self, server_name: str, key: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        读取服务器的缓存工具列表
+        
+        参数:
+            server_name: 服务器名称
+            key: server_cache_key计算的缓存键
+        
+        返回:
+            [{"mcp_name": 服务器上的工具名, "spec": 工具规格}]，未命中时返回None
+        """
+        with self._lock:
+            entry = self._load().get(server_name)
+            if entry is None or entry.get('key') != key:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(entry.get('tools') or [])
+    
+    def matches(self, server_name: str, key: str, tools: List[Dict[str, Any]]) -> bool:
+        """缓存内容是否与给定的工具列表相同"""
+        with self._lock:
+            entry = self._load().get(server_name)
+            return entry is not None and entry.get('key') == key and entry.get('tools') == tools
+    
+    def put(self, server_name: str, key: str, tools: List[Dict[str, Any]]):
+        """
+        保存服务器的工具列表
+        
+        参数:
+            server_name: 服务器名称
+            key: 缓存键
+            tools: [{"mcp_name": ..., "spec": ...}]
+        """
+        with self._lock:
+            self._load()[server_name] = {"key": key, "tools": tools, "updated": round(time.time(), 3)}
+            try:
+                self._save()
+            except Exception as e:
+                logger.warning(f"写入MCP工具缓存失败: {e}")
+    
+    def invalidate(self, server_name: Optional[str] = None):
+        """删除某个服务器（或全部）的缓存"""
+        with self._lock:
+            servers = self._load()
+            if server_name is None:
+                servers.clear()
+            else:
+                servers.pop(server_name, None)
+            try:
+                self._save()
+            except Exception as e:
+                logger.warning(f"写入MCP工具缓存失败: {e}")
@@ -0,0 +1,295 @@
+"""
+MCP会话池
+每个MCP服务器对应一个长期存活的会话，跨消息复用；会话失效时按需重新建立，
+空闲超时或显式重载/关闭时才真正关闭
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# AgentTool接口（不同SDK版本路径相同）
+try:
+    from strands.types.tools import AgentTool
+    AGENT_TOOL_AVAILABLE = True
+except ImportError:
+    AgentTool = object
+    AGENT_TOOL_AVAILABLE = False
+
+# 默认会话空闲超时（秒），0表示不因空闲关闭
+DEFAULT_IDLE_TIMEOUT_SECONDS = 600
+
+
+class MCPSession:
+    """单个MCP服务器的长期会话"""
+    
+    def __init__(self, server_config: Dict[str, Any], client_factory: Callable[[Dict[str, Any]], Any],
+                 on_started: Optional[Callable[['MCPSession'], None]] = None):
+        """
+        初始化会话（不会立即连接）
+        
+        参数:
+            server_config: 服务器配置
+            client_factory: 根据服务器配置创建MCP客户端的函数
+            on_started: 每次连接建立后调用（在建立连接的线程中）
+        """
+        self.server_config = server_config
+        self.name = server_config.get('name', 'unknown')
+        self._client_factory = client_factory
+        self.on_started = on_started
+        self._client = None
+        self._lock = threading.RLock()
+        self._in_flight = 0
+        self.last_used = time.monotonic()
+        self.start_count = 0
+        # 监督器维护的健康状态（熔断器），未受监督时为None
+        self.health = None
+        # 管理器关闭后会话不再建立连接
+        self._shut_down = False
+    
+    @property
+    def client(self):
+        """当前的MCP客户端（可能为None或已失效）"""
+        return self._client
+    
+    @property
+    def in_flight(self) -> int:
+        """正在进行的调用数量"""
+        return self._in_flight
+    
+    def is_alive(self) -> bool:
+        """会话是否可用"""
+        client = self._client
+        if client is None:
+            return False
+        if hasattr(client, 'is_alive'):
+            return client.is_alive()
+        if hasattr(client, '_is_session_active'):
+            try:
+                return bool(client._is_session_active())
+            except Exception:
+                return False
+        thread = getattr(client, '_background_thread', None)
+        return thread is not None and thread.is_alive()
+    
+    def ensure_started(self):
+        """
+        确保会话可用，未连接或已失效时重新建立
+        
+        返回:
+            可用的MCP客户端
+        """
+        with self._lock:
+            if self._shut_down:
+                raise RuntimeError(f"MCP会话 '{self.name}' 已关闭")
+            if self.is_alive():
+                return self._client
+            
+            if self._client is not None:
+                logger.warning(f"MCP会话 '{self.name}' 已失效，重新建立连接")
+                self._close_client()
+            
+            client = self._client_factory(self.server_config)
+            if client is None:
+                raise RuntimeError(f"无法创建MCP服务器 '{self.name}' 的客户端")
+            started = time.monotonic()
+            client.__enter__()
+            self._client = client
+            if self._shut_down:
+                # 建立连接期间管理器已关闭
+                self._close_client()
+                raise RuntimeError(f"MCP会话 '{self.name}' 已关闭")
+            self.start_count += 1
+            self.last_used = time.monotonic()
+            logger.info(f"MCP会话 '{self.name}' 已建立（第{self.start_count}次），耗时 {self.last_used - started:.2f}秒")
+            if self.on_started is not None:
+                self.on_started(self)
+            return client
+    
+    def list_tools(self):
+        """获取服务器的工具列表"""
+        client = self.ensure_started()
+        self.last_used = time.monotonic()
+        return client.list_tools_sync()
+    
+    def ping(self, timeout_seconds: float):
+        """向已连接的服务器发送ping（不算作使用，不影响空闲回收），失败时抛出异常"""
+        client = self._client
+        if client is None or not self.is_alive():
+            raise RuntimeError(f"MCP会话 '{self.name}' 未连接")
+        client.ping_sync(timeout_seconds)
+    
+    def acquire(self):
+        """开始一次调用：返回可用的客户端，并在调用期间阻止空闲回收"""
+        # 服务器熔断期间立即失败，不在调用中重建会话
+        health = self.health
+        if health is not None:
+            health.check()
+        with self._lock:
+            client = self.ensure_started()
+            self._in_flight += 1
+            self.last_used = time.monotonic()
+            return client
+    
+    def release(self):
+        """结束一次调用"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self.last_used = time.monotonic()
+    
+    def is_idle(self, idle_timeout: float) -> bool:
+        """会话是否空闲超过指定时间"""
+        return (self._client is not None and self._in_flight == 0
+                and time.monotonic() - self.last_used >= idle_timeout)
+    
+    def close_if_idle(self, idle_timeout: float) -> bool:
+        """空闲超过指定时间时关闭会话"""
+        with self._lock:
+            if not self.is_idle(idle_timeout):
+                return False
+            self._close_client()
+            return True
+    
+    def close(self):
+        """关闭会话，下次调用时重新建立"""
+        with self._lock:
+            if self._client is not None:
+                self._close_client()
+                logger.info(f"MCP会话 '{self.name}' 已关闭")
+    
+    def detach(self, timeout: float = 0.5):
+        """
+        取下客户端交给调用方关闭，之后会话不再建立连接（正在建立的连接完成后立即关闭）
+        
+        参数:
+            timeout: 等待正在建立的连接的最长时间（秒）
+        
+        返回:
+            客户端；没有客户端或未能及时取下时为None
+        """
+        self._shut_down = True
+        if not self._lock.acquire(timeout=timeout):
+            return None
+        try:
+            client, self._client = self._client, None
+            return client
+        finally:
+            self._lock.release()
+    
+    def _close_client(self):
+        client, self._client = self._client, None
+        try:
+            client.__exit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"关闭MCP会话 '{self.name}' 时出错: {e}")
+
+
+class MCPProxyTool(AgentTool):
+    """
+    注册到Agent上的MCP工具代理
+    每次调用时从会话池取得当前客户端，会话重建后工具仍然可用
+    """
+    
+    def __init__(self, session: MCPSession, mcp_name: str, tool_spec: Dict[str, Any]):
+        """
+        参数:
+            session: 工具所属的MCP会话
+            mcp_name: 服务器上的工具名称
+            tool_spec: 注册到Agent的工具规格（来自服务器或工具规格缓存）
+        """
+        super().__init__()
+        self.session = session
+        self._mcp_name = mcp_name
+        self._tool_spec = tool_spec
+    
+    @classmethod
+    def from_agent_tool(cls, session: MCPSession, mcp_agent_tool) -> 'MCPProxyTool':
+        """根据list_tools_sync返回的MCPAgentTool创建代理"""
+        return cls(session, mcp_agent_tool.mcp_tool.name, mcp_agent_tool.tool_spec)
+    
+    @property
+    def mcp_name(self) -> str:
+        return self._mcp_name
+    
+    @property
+    def tool_name(self) -> str:
+        return self._tool_spec["name"]
+    
+    @property
+    def tool_spec(self):
+        return self._tool_spec
+    
+    @property
+    def tool_type(self) -> str:
+        return "python"
+    
+    def describe(self) -> Dict[str, Any]:
+        """可写入工具规格缓存的描述"""
+        return {"mcp_name": self._mcp_name, "spec": self._tool_spec}
+    
+    def _error_result(self, tool_use, error: Exception) -> Dict[str, Any]:
+        logger.error(f"MCP工具 '{self.tool_name}' 调用失败: {error}")
+        return {
+            "toolUseId": tool_use["toolUseId"],
+            "status": "error",
+            "content": [{"text": f"MCP工具调用失败: {error}"}]
+        }
+    
+    def _call_sync(self, tool_use) -> Dict[str, Any]:
+        """同步调用工具，会话在调用中途失效时重建并重试一次"""
+        for attempt in range(2):
+            try:
+                client = self.session.acquire()
+            except Exception as e:
+                return self._error_result(tool_use, e)
+            try:
+                return client.call_tool_sync(
+                    tool_use_id=tool_use["toolUseId"],
+                    name=self._mcp_name,
+                    arguments=tool_use.get("input")
+                )
+            except Exception as e:
+                if attempt == 0 and not self.session.is_alive():
+                    logger.warning(f"MCP工具 '{self.tool_name}' 调用时会话失效，重试: {e}")
+                    continue
+                return self._error_result(tool_use, e)
+            finally:
+                self.session.release()
+    
+    async def _call_async(self, tool_use) -> Dict[str, Any]:
+        """会话可用时直接等待MCP事件循环上的调用，不占用线程池线程"""
+        try:
+            client = self.session.acquire()
+        except Exception as e:
+            return self._error_result(tool_use, e)
+        try:
+            return await client.call_tool_async(
+                tool_use_id=tool_use["toolUseId"],
+                name=self._mcp_name,
+                arguments=tool_use.get("input")
+            )
+        except Exception as e:
+            if self.session.is_alive():
+                return self._error_result(tool_use, e)
+            logger.warning(f"MCP工具 '{self.tool_name}' 调用时会话失效，重试: {e}")
+        finally:
+            self.session.release()
+        # 重建会话会阻塞，放到线程池中执行（to_thread带上当前上下文，调用仍登记到所在流的取消范围）
+        return await asyncio.to_thread(self._call_sync, tool_use)
+    
+    async def stream(self, tool_use, invocation_state, **kwargs):
+        """新版SDK的工具调用入口，最后一个产出值为工具结果"""
+        if self.session.is_alive() and hasattr(self.session.client, 'call_tool_async'):
+            result = await self._call_async(tool_use)
+        else:
+            result = await asyncio.to_thread(self._call_sync, tool_use)
+        yield result
+    
+    def invoke(self, tool_use, *args, **kwargs):
+        """旧版SDK的工具调用入口"""
+        return self._call_sync(tool_use)
@@ -0,0 +1,356 @@
+"""
+MCP大型结果落盘
+超过阈值的MCP工具结果内容块写入按内容寻址的落盘目录，Agent、消息历史和界面只拿到开头部分和一个句柄，
+模型可以用read_mcp_result工具按字节范围分页读取完整内容。
+文本按固定大小分段编码写盘，不再额外生成一份完整的字节副本；每次调用的结果大小和保留大小计入统计
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp_stats import content_bytes
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+try:
+    from strands import tool
+    STRANDS_TOOL_AVAILABLE = True
+except ImportError:
+    STRANDS_TOOL_AVAILABLE = False
+
+# 单次调用结果超过这个大小（字节）时落盘，0表示不落盘
+DEFAULT_SPILL_THRESHOLD_BYTES = 64 * 1024
+# 落盘的内容块保留在结果中的开头部分（字节）
+DEFAULT_HEAD_BYTES = 4 * 1024
+# 落盘目录的总大小上限（字节），超出时删除最早的文件
+DEFAULT_MAX_TOTAL_BYTES = 512 * 1024 * 1024
+# read_mcp_result每页的默认和最大字节数
+DEFAULT_PAGE_BYTES = 16 * 1024
+MAX_PAGE_BYTES = 64 * 1024
+# 文本分段编码写盘的字符数
+ENCODE_CHUNK_CHARS = 256 * 1024
+# 通过环境变量指定落盘目录
+SPILL_DIR_ENV = 'UNITY_AGENT_MCP_SPILL_DIR'
+# 最近调用记录的数量
+RECENT_CALLS = 20
+
+_HANDLE_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+_EXTENSIONS = ('.txt', '.json', '.bin')
+
+
+def default_spill_dir() -> str:
+    """默认落盘目录：Unity项目的Library目录下，没有项目路径时放在用户目录"""
+    path = os.environ.get(SPILL_DIR_ENV)
+    if path:
+        return path
+    project_root = os.environ.get('PROJECT_ROOT_PATH')
+    if project_root:
+        return os.path.join(project_root, "Library", "UnityAIAgent", "mcp_results")
+    return os.path.join(os.path.expanduser("~"), ".unity_ai_agent", "mcp_results")
+
+
+def _utf8_size(text: str, limit: int) -> int:
+    """文本的UTF-8字节数；字符数已超过limit时不编码，返回字符数（字节数的下界，足以判断超限）"""
+    if len(text) > limit:
+        return len(text)
+    return len(text.encode('utf-8'))
+
+
+def _utf8_head(text: str, max_bytes: int) -> str:
+    """不超过max_bytes字节的开头部分（不截断多字节字符）"""
+    return text[:max_bytes].encode('utf-8')[:max_bytes].decode('utf-8', 'ignore')
+
+
+def _is_continuation(byte: int) -> bool:
+    return 0x80 <= byte < 0xC0
+
+
+class SpillStore:
+    """按内容寻址的落盘目录，以及结果截断和分页读取"""
+    
+    def __init__(self, directory: Optional[str] = None, threshold_bytes: int = DEFAULT_SPILL_THRESHOLD_BYTES,
+                 head_bytes: int = DEFAULT_HEAD_BYTES, max_total_bytes: int = DEFAULT_MAX_TOTAL_BYTES):
+        """
+        参数:
+            directory: 落盘目录，默认见default_spill_dir
+            threshold_bytes: 单次调用结果的落盘阈值（字节），0表示不落盘
+            head_bytes: 落盘内容块保留的开头部分（字节）
+            max_total_bytes: 落盘目录总大小上限（字节）
+        """
+        self.directory = directory or default_spill_dir()
+        self.threshold_bytes = threshold_bytes
+        self.head_bytes = head_bytes
+        self.max_total_bytes = max_total_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self.calls = 0
+        self.spilled_calls = 0
+        self.spilled_blocks = 0
+        self.spilled_bytes = 0
+        self.max_payload_bytes = 0
+        self.max_retained_bytes = 0
+        self._recent = deque(maxlen=RECENT_CALLS)
+    
+    def configure(self, threshold_bytes: Optional[int] = None, head_bytes: Optional[int] = None,
+                  max_total_bytes: Optional[int] = None):
+        """更新阈值和上限（None表示保持不变）"""
+        if threshold_bytes is not None:
+            self.threshold_bytes = max(0, int(threshold_bytes))
+        if head_bytes is not None:
+            self.head_bytes = max(0, int(head_bytes))
+        if max_total_bytes is not None:
+            self.max_total_bytes = max(0, int(max_total_bytes))
+    
+    def _write(self, chunks, extension: str) -> Tuple[str, int]:
+        """把分段数据写入临时文件，按内容摘要重命名；相同内容只保存一份"""
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self.directory, f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        handle = digest.hexdigest()[:32]
+        path = os.path.join(self.directory, handle + extension)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            os.utime(path)
+            return handle, size
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        self._prune(keep=path)
+        return handle, size
+    
+    def _text_chunks(self, text: str):
+        for start in range(0, len(text), ENCODE_CHUNK_CHARS):
+            yield text[start:start + ENCODE_CHUNK_CHARS].encode('utf-8')
+    
+    def _prune(self, keep: str):
+        """落盘目录超过上限时删除最早的文件"""
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self.max_total_bytes:
+                return
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(_EXTENSIONS):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_total_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total_bytes = total
+    
+    def _spill_block(self, block: Dict[str, Any], label: str) -> Tuple[Dict[str, Any], int]:
+        """把单个内容块写盘，返回(开头部分加句柄说明的文本块, 实际字节数)"""
+        if "text" in block:
+            text = block["text"]
+            handle, size = self._write(self._text_chunks(text), '.txt')
+            head = _utf8_head(text, self.head_bytes)
+        elif "json" in block:
+            text = json.dumps(block["json"], ensure_ascii=False)
+            handle, size = self._write(self._text_chunks(text), '.json')
+            head = _utf8_head(text, self.head_bytes)
+        else:
+            data = block["image"]["source"]["bytes"]
+            handle, size = self._write([data], '.bin')
+            head = f"[{block['image'].get('format', '')}图片]"
+        logger.info(f"MCP结果 {label} 的内容块（{size} 字节）已落盘: {handle}")
+        notice = (f"\n\n[结果过大已截断：完整内容共 {size} 字节，已显示前 {len(head.encode('utf-8'))} 字节。"
+                  f"使用 read_mcp_result(handle=\"{handle}\", offset=...) 分页读取]")
+        return {"text": head + notice}, size
+    
+    def _block_size(self, block: Dict[str, Any]) -> int:
+        limit = max(self.threshold_bytes, self.head_bytes)
+        if "text" in block:
+            return _utf8_size(block["text"], limit)
+        if "json" in block:
+            return len(json.dumps(block["json"], ensure_ascii=False).encode('utf-8'))
+        if "image" in block:
+            return len(block["image"]["source"]["bytes"])
+        return 0
+    
+    def limit_blocks(self, blocks: List[Dict[str, Any]], label: str = '') -> List[Dict[str, Any]]:
+        """
+        结果总大小超过阈值时，把大于开头部分的内容块写盘并替换为开头部分加句柄
+        
+        参数:
+            blocks: 工具结果内容块
+            label: 记录用的名称（服务器/工具）
+        
+        返回:
+            处理后的内容块列表（未超过阈值时原样返回）
+        """
+        sizes = [self._block_size(block) for block in blocks]
+        payload = sum(sizes)
+        spilled = 0
+        if self.threshold_bytes > 0 and payload > self.threshold_bytes:
+            limited = []
+            for index, block in enumerate(blocks):
+                if sizes[index] > self.head_bytes:
+                    try:
+                        block, sizes[index] = self._spill_block(block, label)
+                        spilled += 1
+                    except Exception as e:
+                        logger.warning(f"MCP结果 {label} 落盘失败，保留完整内容: {e}")
+                limited.append(block)
+            blocks = limited
+            payload = sum(sizes)
+        retained = sum(self._block_size(block) for block in blocks) if spilled else payload
+        
+        with self._lock:
+            self.calls += 1
+            self.max_payload_bytes = max(self.max_payload_bytes, payload)
+            self.max_retained_bytes = max(self.max_retained_bytes, retained)
+            if spilled:
+                self.spilled_calls += 1
+                self.spilled_blocks += spilled
+                self.spilled_bytes += payload - retained
+            self._recent.append({"label": label, "payload_bytes": payload, "retained_bytes": retained,
+                                 "spilled_blocks": spilled, "time": round(time.time(), 3)})
+        return blocks
+    
+    async def limit_blocks_async(self, blocks: List[Dict[str, Any]], label: str = '',
+                                 payload_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        在事件循环中使用的limit_blocks：结果可能需要落盘时，哈希、写盘和目录清理放到线程池中执行
+        
+        参数:
+            blocks: 工具结果内容块
+            label: 记录用的名称（服务器/工具）
+            payload_bytes: 调用方已经算出的结果大致字节数，未提供时在这里计算
+        
+        返回:
+            处理后的内容块列表
+        """
+        if payload_bytes is None:
+            payload_bytes = content_bytes(blocks)
+        if self.threshold_bytes > 0 and payload_bytes > self.head_bytes:
+            return await asyncio.get_running_loop().run_in_executor(None, self.limit_blocks, blocks, label)
+        return self.limit_blocks(blocks, label)
+    
+    def _find(self, handle: str) -> Optional[str]:
+        if not _HANDLE_PATTERN.match(handle or ''):
+            return None
+        for extension in _EXTENSIONS:
+            path = os.path.join(self.directory, handle + extension)
+            if os.path.exists(path):
+                return path
+        return None
+    
+    def read(self, handle: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES) -> Dict[str, Any]:
+        """
+        按字节范围读取落盘的内容（边界对齐到完整的UTF-8字符）
+        
+        参数:
+            handle: 句柄
+            offset: 起始字节偏移
+            length: 读取的字节数，最多MAX_PAGE_BYTES（不足一个字符时仍返回一个完整字符）
+        
+        返回:
+            {"handle", "offset", "end", "total_bytes", "text", "eof"}
+        """
+        path = self._find(handle)
+        if path is None:
+            raise FileNotFoundError(f"找不到MCP结果: {handle}")
+        total = os.path.getsize(path)
+        offset = min(max(0, int(offset)), total)
+        length = min(max(1, int(length)), MAX_PAGE_BYTES)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            # 多读几个字节用于对齐字符边界
+            data = f.read(length + 8)
+        if path.endswith('.bin'):
+            return {"handle": handle, "offset": offset, "end": total, "total_bytes": total,
+                    "text": f"[二进制内容，共 {total} 字节]", "eof": True}
+        # 起点落在多字节字符中间时跳到下一个字符，终点回退到完整字符
+        start = 0
+        while offset > 0 and start < len(data) and _is_continuation(data[start]):
+            start += 1
+        end = min(len(data), start + length)
+        if offset + end < total:
+            while end > start and end < len(data) and _is_continuation(data[end]):
+                end -= 1
+            if end == start and start < len(data):
+                # 长度不足一个字符时返回一个完整字符，保证分页总能前进
+                end = start + 1
+                while end < len(data) and _is_continuation(data[end]):
+                    end += 1
+        text = data[start:end].decode('utf-8', 'replace')
+        return {"handle": handle, "offset": offset + start, "end": offset + end, "total_bytes": total,
+                "text": text, "eof": offset + end >= total}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """落盘次数、字节数和每次调用的最大结果/保留大小"""
+        with self._lock:
+            return {
+                "threshold_bytes": self.threshold_bytes,
+                "head_bytes": self.head_bytes,
+                "calls": self.calls,
+                "spilled_calls": self.spilled_calls,
+                "spilled_blocks": self.spilled_blocks,
+                "spilled_bytes": self.spilled_bytes,
+                "max_payload_bytes": self.max_payload_bytes,
+                "max_retained_bytes": self.max_retained_bytes,
+                "directory": self.directory,
+                "recent": list(self._recent)
+            }
+
+
+# 全局落盘实例
+_spill_store: Optional[SpillStore] = None
+_spill_store_lock = threading.Lock()
+
+def get_spill_store() -> SpillStore:
+    """获取全局MCP结果落盘实例"""
+    global _spill_store
+    with _spill_store_lock:
+        if _spill_store is None:
+            _spill_store = SpillStore()
+        return _spill_store
+
+
+if STRANDS_TOOL_AVAILABLE:
+    @tool
+    def read_mcp_result(handle: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES) -> str:
+        """
+        分页读取因过大而被截断的MCP工具结果
+        
+        Args:
+            handle: 截断说明中给出的结果句柄
+            offset: 起始字节偏移，第一页为0，之后使用上一页给出的下一页偏移
+            length: 本页读取的字节数（最多65536）
+        """
+        try:
+            page = get_spill_store().read(handle, offset, length)
+        except Exception as e:
+            return f"读取MCP结果失败: {e}"
+        footer = "（已到末尾）" if page["eof"] else f"（下一页: offset={page['end']}）"
+        return (f"[{handle} 字节 {page['offset']}-{page['end']} / 共 {page['total_bytes']} 字节]\n"
+                f"{page['text']}\n{footer}")
+else:
+    read_mcp_result = None
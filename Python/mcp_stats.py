@@ -0,0 +1,207 @@
+"""
+MCP服务器调用统计
+每个服务器一份：按操作（call_tool、list_tools、ping）和按工具记录次数、错误、超时、
+排队等待和往返时间直方图，以及请求和结果的字节数。统计对象由MCPManager按服务器名称持有，
+服务器重启后新建的客户端继续写入同一份统计
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Dict, List, Optional
+
+# 时间直方图的桶上界（毫秒）
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+# 负载大小直方图的桶上界（字节）
+SIZE_BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def content_bytes(content: List[Dict[str, Any]]) -> int:
+    """工具结果内容块的大致字节数（ASCII文本不编码）"""
+    total = 0
+    for block in content:
+        if "text" in block:
+            text = block["text"]
+            total += len(text) if text.isascii() else len(text.encode('utf-8'))
+        elif "json" in block:
+            total += len(str(block["json"]))
+        elif "image" in block:
+            total += len(block["image"]["source"]["bytes"])
+    return total
+
+
+def error_outcome(error: BaseException) -> str:
+    """异常对应的结果类别：timeout（包括MCP读超时）、cancelled或error"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if getattr(getattr(error, 'error', None), 'code', None) == 408:
+        return "timeout"
+    if isinstance(error, (asyncio.CancelledError, concurrent.futures.CancelledError)):
+        return "cancelled"
+    return "error"
+
+
+class Histogram:
+    """固定桶的直方图，分位数取所在桶的上界（超过最后一个桶时取最大值）"""
+    
+    __slots__ = ('bounds', 'unit', 'counts', 'count', 'total', 'max')
+    
+    def __init__(self, bounds, unit: str):
+        self.bounds = bounds
+        self.unit = unit
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, value: float):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    def _label(self, index: int) -> str:
+        if index < len(self.bounds):
+            return f"<={self.bounds[index]}{self.unit}"
+        return f">{self.bounds[-1]}{self.unit}"
+    
+    def quantile(self, pct: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * pct // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(self.bounds[index], self.max) if index < len(self.bounds) else self.max, 3)
+        return round(self.max, 3)
+    
+    def to_dict(self, buckets: bool = True) -> Dict[str, Any]:
+        result = {
+            "count": self.count,
+            "total": round(self.total, 3),
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.quantile(50),
+            "p95": self.quantile(95),
+            "p99": self.quantile(99),
+            "max": round(self.max, 3) if self.count else None
+        }
+        if buckets:
+            result["buckets"] = {self._label(i): count for i, count in enumerate(self.counts) if count}
+        return result
+
+
+class _OpStats:
+    """一类操作（或一个工具）的累计统计"""
+    
+    __slots__ = ('calls', 'errors', 'tool_errors', 'timeouts', 'cancelled', 'queue_ms', 'round_trip_ms',
+                 'bytes_in', 'bytes_out')
+    
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.tool_errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.queue_ms = Histogram(LATENCY_BUCKETS_MS, 'ms')
+        self.round_trip_ms = Histogram(LATENCY_BUCKETS_MS, 'ms')
+        self.bytes_in = Histogram(SIZE_BUCKETS_BYTES, 'B')
+        self.bytes_out = Histogram(SIZE_BUCKETS_BYTES, 'B')
+    
+    def record(self, outcome: str, queue_ms: Optional[float], round_trip_ms: Optional[float],
+               bytes_in: Optional[int], bytes_out: Optional[int]):
+        self.calls += 1
+        if outcome == "error":
+            self.errors += 1
+        elif outcome == "tool_error":
+            self.tool_errors += 1
+        elif outcome == "timeout":
+            self.timeouts += 1
+        elif outcome == "cancelled":
+            self.cancelled += 1
+        if queue_ms is not None:
+            self.queue_ms.add(queue_ms)
+        if round_trip_ms is not None:
+            self.round_trip_ms.add(round_trip_ms)
+        if bytes_in is not None:
+            self.bytes_in.add(bytes_in)
+        if bytes_out is not None:
+            self.bytes_out.add(bytes_out)
+    
+    def to_dict(self, detailed: bool = True) -> Dict[str, Any]:
+        result = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "tool_errors": self.tool_errors,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "round_trip_ms": self.round_trip_ms.to_dict(detailed)
+        }
+        if detailed:
+            result["queue_ms"] = self.queue_ms.to_dict()
+            result["bytes_in"] = self.bytes_in.to_dict()
+            result["bytes_out"] = self.bytes_out.to_dict()
+        return result
+
+
+class MCPServerStats:
+    """单个MCP服务器的调用统计（可在MCP事件循环和其他线程中同时访问）"""
+    
+    def __init__(self, name: str = 'mcp'):
+        """
+        参数:
+            name: 服务器名称
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._ops: Dict[str, _OpStats] = {}
+        self._tools: Dict[str, _OpStats] = {}
+    
+    def record(self, op: str, outcome: str, queue_ms: Optional[float] = None,
+               round_trip_ms: Optional[float] = None, bytes_in: Optional[int] = None,
+               bytes_out: Optional[int] = None, tool: Optional[str] = None):
+        """
+        记录一次操作
+        
+        参数:
+            op: 操作类别（call_tool、list_tools、ping）
+            outcome: ok、error（异常）、tool_error（工具返回isError）、timeout或cancelled
+            queue_ms: 提交到开始发送之间的等待时间（毫秒，包括并发上限排队）
+            round_trip_ms: 发送到收到结果的时间（毫秒）
+            bytes_in: 请求参数的字节数
+            bytes_out: 结果内容的字节数
+            tool: 工具名称（call_tool时按工具另记一份）
+        """
+        with self._lock:
+            targets = [self._ops.setdefault(op, _OpStats())]
+            if tool is not None:
+                targets.append(self._tools.setdefault(tool, _OpStats()))
+            for stats in targets:
+                stats.record(outcome, queue_ms, round_trip_ms, bytes_in, bytes_out)
+    
+    def get_stats(self, reset: bool = False, detailed: bool = True) -> Dict[str, Any]:
+        """
+        按操作和按工具的统计
+        
+        参数:
+            reset: 读取后是否清空
+            detailed: 是否包含排队时间、字节数和直方图的桶（False时只有次数和往返时间分位数）
+        """
+        with self._lock:
+            result = {
+                "ops": {op: stats.to_dict(detailed) for op, stats in self._ops.items()},
+                "tools": {tool: stats.to_dict(detailed) for tool, stats in self._tools.items()}
+            }
+            if reset:
+                self._ops.clear()
+                self._tools.clear()
+        return result
+    
+    def reset(self):
+        with self._lock:
+            self._ops.clear()
+            self._tools.clear()
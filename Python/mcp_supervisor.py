@@ -0,0 +1,236 @@
+"""
+MCP服务器监督
+后台线程检查每个已连接服务器的会话：传输层断开（如stdio服务器进程退出）在下一次检查时发现，
+存活的会话定期发送ping；失效的服务器按指数退避重启，重启成功前熔断该服务器的工具调用，
+调用立即返回错误而不是在失效的会话上等待超时
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 检查会话是否断开的间隔（秒），只读本地状态，开销很小
+DEFAULT_CHECK_INTERVAL_SECONDS = 1.0
+# 向存活会话发送ping的间隔和超时（秒），间隔为0时不发送ping
+DEFAULT_PING_INTERVAL_SECONDS = 30.0
+DEFAULT_PING_TIMEOUT_SECONDS = 10.0
+# 重启退避：第n次连续失败后等待 base * 2^n 秒，不超过上限
+DEFAULT_RESTART_BACKOFF_SECONDS = 1.0
+DEFAULT_MAX_RESTART_BACKOFF_SECONDS = 60.0
+
+
+class MCPServerUnavailableError(RuntimeError):
+    """服务器熔断期间的调用错误"""
+    pass
+
+
+class ServerHealth:
+    """单个服务器的健康状态，同时作为该服务器工具调用的熔断器"""
+    
+    def __init__(self, session):
+        """
+        参数:
+            session: 被监督的MCPSession
+        """
+        self.session = session
+        # up: 正常；open: 已熔断，等待重启；restarting: 正在重启（仍熔断）
+        self.state = "up"
+        self.restart_count = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.down_since: Optional[float] = None
+        self.next_restart: Optional[float] = None
+        self.last_ping: Optional[float] = None
+    
+    @property
+    def is_open(self) -> bool:
+        """熔断器是否打开"""
+        return self.state != "up"
+    
+    def check(self):
+        """调用前检查熔断器，服务器不可用时立即抛出MCPServerUnavailableError"""
+        if not self.is_open:
+            return
+        if self.state == "restarting":
+            detail = "正在重启"
+        else:
+            detail = f"{max(0.0, (self.next_restart or 0) - time.monotonic()):.1f}秒后重启"
+        raise MCPServerUnavailableError(
+            f"MCP服务器 '{self.session.name}' 暂不可用（{detail}）: {self.last_error}"
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        state = self.state
+        if state == "up" and self.session.client is None:
+            # 空闲回收后尚未重新连接，调用时按需连接
+            state = "idle"
+        return {
+            "state": state,
+            "restart_count": self.restart_count,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "down_seconds": round(now - self.down_since, 2) if self.down_since is not None else None,
+            "next_restart_seconds": round(max(0.0, self.next_restart - now), 2)
+            if state == "open" and self.next_restart is not None else None,
+            "last_ping_seconds_ago": round(now - self.last_ping, 2) if self.last_ping is not None else None
+        }
+
+
+class MCPSupervisor:
+    """监督MCP服务器会话：发现断开和无响应的服务器，按指数退避重启并熔断调用"""
+    
+    def __init__(self, sessions: Callable[[], Dict[str, Any]],
+                 check_interval: float = DEFAULT_CHECK_INTERVAL_SECONDS,
+                 ping_interval: float = DEFAULT_PING_INTERVAL_SECONDS,
+                 ping_timeout: float = DEFAULT_PING_TIMEOUT_SECONDS,
+                 restart_backoff: float = DEFAULT_RESTART_BACKOFF_SECONDS,
+                 max_restart_backoff: float = DEFAULT_MAX_RESTART_BACKOFF_SECONDS):
+        """
+        参数:
+            sessions: 返回当前 {服务器名称: MCPSession} 的函数
+            check_interval: 检查间隔（秒）
+            ping_interval: ping间隔（秒），0表示不发送ping
+            ping_timeout: ping超时（秒）
+            restart_backoff: 第一次重启前的等待时间（秒）
+            max_restart_backoff: 重启等待时间上限（秒）
+        """
+        self._sessions = sessions
+        self.check_interval = check_interval
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self._health: Dict[str, ServerHealth] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def running(self) -> bool:
+        """监督线程是否在运行"""
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        """启动监督线程（已在运行时不重复启动）"""
+        if self.running and not self._stop.is_set():
+            return
+        # 刚停止的旧线程持有自己的停止事件，会在下一次等待时退出
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="MCPSupervisor", daemon=True)
+        self._thread.start()
+        logger.info(f"MCP服务器监督已启动（检查间隔 {self.check_interval}秒，ping间隔 {self.ping_interval}秒）")
+    
+    def stop(self):
+        """停止监督线程并关闭所有熔断器"""
+        self._stop.set()
+        with self._lock:
+            for health in self._health.values():
+                if health.session.health is health:
+                    health.session.health = None
+            self._health.clear()
+    
+    def _run(self, stop_event: threading.Event):
+        while not stop_event.wait(self.check_interval):
+            try:
+                self.check_once()
+            except Exception as e:
+                logger.warning(f"MCP服务器监督检查出错: {e}")
+    
+    def check_once(self):
+        """检查一遍所有会话：发现断开的服务器、发送到期的ping、执行到期的重启"""
+        sessions = self._sessions()
+        now = time.monotonic()
+        to_ping = []
+        with self._lock:
+            # 会话已被移除或被配置重载替换
+            for name in list(self._health):
+                health = self._health[name]
+                if sessions.get(name) is not health.session:
+                    if health.session.health is health:
+                        health.session.health = None
+                    del self._health[name]
+            
+            for name, session in sessions.items():
+                health = self._health.get(name)
+                if health is None:
+                    if session.client is None:
+                        # 尚未连接（缓存注册或空闲回收），调用时按需连接
+                        continue
+                    health = self._health[name] = ServerHealth(session)
+                    session.health = health
+                
+                if health.state == "open":
+                    if now >= health.next_restart:
+                        self._begin_restart(health)
+                    continue
+                if health.state == "restarting" or session.client is None:
+                    continue
+                if not session.is_alive():
+                    reason = getattr(session.client, 'disconnect_reason', None) or "会话已断开"
+                    self._mark_down(health, reason)
+                    continue
+                if self.ping_interval > 0 and (health.last_ping is None or now - health.last_ping >= self.ping_interval):
+                    to_ping.append(health)
+        
+        # ping在锁外进行，等待无响应的服务器时不阻塞状态查询
+        for health in to_ping:
+            try:
+                health.session.ping(self.ping_timeout)
+                health.last_ping = time.monotonic()
+            except Exception as e:
+                with self._lock:
+                    # 期间被空闲回收的会话不算失效
+                    if (self._health.get(health.session.name) is health and health.state == "up"
+                            and health.session.client is not None):
+                        self._mark_down(health, f"ping失败: {e or type(e).__name__}")
+    
+    def _mark_down(self, health: ServerHealth, error: str):
+        """打开熔断器并安排重启（调用方持有self._lock）"""
+        now = time.monotonic()
+        delay = min(self.max_restart_backoff, self.restart_backoff * (2 ** health.consecutive_failures))
+        health.state = "open"
+        health.last_error = error
+        if health.down_since is None:
+            health.down_since = now
+        health.next_restart = now + delay
+        logger.warning(f"MCP服务器 '{health.session.name}' 不可用: {error}，{delay:.1f}秒后重启")
+        # 关闭失效的客户端（stdio服务器的进程随之清理）
+        threading.Thread(target=health.session.close, name=f"MCPClose-{health.session.name}", daemon=True).start()
+    
+    def _begin_restart(self, health: ServerHealth):
+        """在单独的线程中重启服务器，慢启动不会阻塞其他服务器的检查（调用方持有self._lock）"""
+        health.state = "restarting"
+        threading.Thread(target=self._restart, args=(health,), name=f"MCPRestart-{health.session.name}",
+                         daemon=True).start()
+    
+    def _restart(self, health: ServerHealth):
+        session = health.session
+        logger.info(f"重启MCP服务器 '{session.name}'（第{health.consecutive_failures + 1}次尝试）")
+        try:
+            session.close()
+            session.ensure_started()
+        except Exception as e:
+            with self._lock:
+                health.consecutive_failures += 1
+                if self._health.get(session.name) is health:
+                    self._mark_down(health, f"重启失败: {e}")
+            return
+        
+        with self._lock:
+            health.restart_count += 1
+            health.consecutive_failures = 0
+            health.down_since = None
+            health.next_restart = None
+            health.last_ping = time.monotonic()
+            health.state = "up"
+        logger.info(f"MCP服务器 '{session.name}' 已重启，熔断器关闭")
+    
+    def get_status(self) -> Dict[str, Dict[str, Any]]:
+        """各受监督服务器的状态、重启次数和最近的错误"""
+        with self._lock:
+            return {name: health.to_dict() for name, health in self._health.items()}
@@ -0,0 +1,61 @@
+"""
+本地MCP测试服务器
+用于诊断和基准测试的替身服务器，同一组工具可以通过stdio、sse或streamable_http提供：
+
+    python mcp_test_server.py --transport stdio
+    python mcp_test_server.py --transport sse --port 8765
+    python mcp_test_server.py --transport streamable_http --port 8766
+"""
+
+import argparse
+import asyncio
+
+from mcp.server.fastmcp import FastMCP
+
+# 命令行传输名称与FastMCP传输名称的对应关系
+TRANSPORTS = {
+    'stdio': 'stdio',
+    'sse': 'sse',
+    'streamable_http': 'streamable-http'
+}
+# 各HTTP传输的服务路径
+HTTP_PATHS = {
+    'sse': '/sse',
+    'streamable_http': '/mcp'
+}
+
+
+def build_server(host: str = '127.0.0.1', port: int = 8765) -> FastMCP:
+    """创建提供测试工具的FastMCP服务器"""
+    server = FastMCP("unity-agent-test", host=host, port=port, log_level='WARNING')
+    
+    @server.tool()
+    def echo(text: str) -> str:
+        """返回输入的文本"""
+        return text
+    
+    @server.tool()
+    async def sleep(seconds: float) -> str:
+        """异步等待指定秒数，用于测试并发调用"""
+        await asyncio.sleep(seconds)
+        return f"slept {seconds}"
+    
+    @server.tool()
+    def payload(size: int) -> str:
+        """返回指定字节数的文本，用于测试大结果"""
+        return 'x' * max(0, size)
+    
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地MCP测试服务器")
+    parser.add_argument('--transport', choices=sorted(TRANSPORTS), default='stdio')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    build_server(args.host, args.port).run(TRANSPORTS[args.transport])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+流式取消辅助模块
+每个流有一个取消范围，记录本流中工具启动的子进程和进行中的MCP调用，取消时只处理这些资源；
+另外负责修复被中断的对话历史
+"""
+
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 取消时写入对话历史的提示
+CANCELLED_TOOL_RESULT = "工具调用已被用户取消"
+CANCELLED_NOTE = "（响应已被用户取消）"
+
+# 当前流的取消范围：流式运行时在每个流的任务中设置，工具线程（asyncio.to_thread）随上下文继承
+_current_scope: contextvars.ContextVar[Optional['CancelScope']] = contextvars.ContextVar(
+    'stream_cancel_scope', default=None)
+# 正在执行的shell命令启动的进程，命令结束后从取消范围中移除
+_command_pids: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('stream_command_pids', default=None)
+
+
+class CancelScope:
+    """单个流可取消的资源：本流中工具启动的子进程和进行中的MCP调用（不包括MCP服务器进程）"""
+    
+    def __init__(self, name: str = 'stream'):
+        """
+        参数:
+            name: 范围名称（流句柄ID），用于日志
+        """
+        self.name = name
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._pids: set = set()
+        self._calls: Dict[concurrent.futures.Future, Callable[[], Any]] = {}
+    
+    def add_process(self, pid: int):
+        """登记工具启动的子进程；范围已取消时直接终止"""
+        with self._lock:
+            if not self.cancelled:
+                self._pids.add(pid)
+                return
+        terminate_processes([pid])
+    
+    def discard_process(self, pid: int):
+        """子进程已结束（已被工具回收），不再登记，避免进程ID复用后误杀"""
+        with self._lock:
+            self._pids.discard(pid)
+    
+    def add_call(self, future: concurrent.futures.Future, cancel: Optional[Callable[[], Any]] = None):
+        """
+        登记进行中的MCP调用，调用完成后自动移除；范围已取消时直接取消
+        
+        参数:
+            future: 调用的Future
+            cancel: 取消调用的函数（默认future.cancel），返回值为真表示确实取消了
+        """
+        cancel = cancel or future.cancel
+        with self._lock:
+            registered = not self.cancelled
+            if registered:
+                self._calls[future] = cancel
+        if registered:
+            # 已完成的Future会立即回调，不能在持锁时添加
+            future.add_done_callback(self._discard_call)
+        else:
+            cancel()
+    
+    def _discard_call(self, future: concurrent.futures.Future):
+        with self._lock:
+            self._calls.pop(future, None)
+    
+    def cancel(self) -> Dict[str, Any]:
+        """
+        取消范围内的MCP调用并终止子进程，之后登记的资源也会立即取消
+        
+        返回:
+            {"killed_processes": [进程ID], "cancelled_mcp_calls": 数量}
+        """
+        with self._lock:
+            self.cancelled = True
+            pids, self._pids = list(self._pids), set()
+            calls, self._calls = list(self._calls.values()), {}
+        cancelled_calls = 0
+        for cancel in calls:
+            try:
+                if cancel():
+                    cancelled_calls += 1
+            except Exception as e:
+                logger.debug(f"取消MCP调用失败: {e}")
+        killed = terminate_processes(pids) if pids else []
+        return {"killed_processes": killed, "cancelled_mcp_calls": cancelled_calls}
+
+
+def current_scope() -> Optional[CancelScope]:
+    """当前流的取消范围（不在流中时为None）"""
+    return _current_scope.get()
+
+
+def enter_scope(scope: CancelScope):
+    """把取消范围设为当前上下文（流任务）的范围"""
+    _current_scope.set(scope)
+
+
+def _track_process(pid: int):
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.add_process(pid)
+        started = _command_pids.get()
+        if started is not None:
+            started.append(pid)
+
+
+class _TrackedPty:
+    """shell工具使用的pty模块：fork出的命令进程登记到当前流的取消范围"""
+    
+    def __init__(self, module):
+        self._module = module
+    
+    def fork(self):
+        pid, fd = self._module.fork()
+        if pid > 0:
+            _track_process(pid)
+        return pid, fd
+    
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+class _ContextThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """在提交时的上下文中运行任务的线程池（shell工具并行执行命令时保留取消范围）"""
+    
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def track_tool_processes(shell_module=None, python_repl_module=None):
+    """
+    让shell和python_repl工具把自己启动的子进程登记到当前流的取消范围
+    
+    shell命令经pty.fork启动（独立会话，整个进程组可以一起终止），python_repl交互模式经PtyManager启动，
+    只包装这两个工具模块内部的引用，不修改全局的pty和os。
+    
+    参数:
+        shell_module: strands_tools.shell模块
+        python_repl_module: strands_tools.python_repl模块
+    """
+    if shell_module is not None and not getattr(shell_module, 'tracks_processes', False):
+        execute = shell_module.execute_single_command
+        
+        @functools.wraps(execute)
+        def execute_tracked(*args, **kwargs):
+            started = []
+            token = _command_pids.set(started)
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                _command_pids.reset(token)
+                scope = _current_scope.get()
+                if scope is not None:
+                    for pid in started:
+                        scope.discard_process(pid)
+        
+        shell_module.pty = _TrackedPty(shell_module.pty)
+        shell_module.ThreadPoolExecutor = _ContextThreadPoolExecutor
+        shell_module.execute_single_command = execute_tracked
+        shell_module.tracks_processes = True
+    
+    manager_class = getattr(python_repl_module, 'PtyManager', None)
+    if manager_class is not None and not getattr(manager_class, 'tracks_processes', False):
+        
+        class TrackedPtyManager(manager_class):
+            tracks_processes = True
+            
+            def start(self, code: str) -> None:
+                super().start(code)
+                if self.pid > 0:
+                    self._scope = _current_scope.get()
+                    _track_process(self.pid)
+            
+            def stop(self) -> None:
+                pid, scope = self.pid, getattr(self, '_scope', None)
+                super().stop()
+                if scope is not None:
+                    scope.discard_process(pid)
+        
+        python_repl_module.PtyManager = TrackedPtyManager
+
+
+def _signal_process(pid: int, sig: int):
+    """进程是进程组组长时（shell命令）整组发送，否则只发给进程本身（与Unity同组的进程不能整组发送）"""
+    if hasattr(os, 'killpg') and os.getpgid(pid) == pid:
+        os.killpg(pid, sig)
+    else:
+        os.kill(pid, sig)
+
+
+def terminate_processes(pids: Iterable[int], grace_seconds: float = 0.5) -> List[int]:
+    """
+    终止进程：先发送SIGTERM，超过宽限时间仍存活的再强制结束
+    
+    参数:
+        pids: 要终止的进程ID
+        grace_seconds: SIGTERM后的等待时间
+    
+    返回:
+        实际发送了信号的进程ID列表
+    """
+    pids = list(pids)
+    signalled = []
+    for pid in pids:
+        try:
+            _signal_process(pid, signal.SIGTERM)
+            signalled.append(pid)
+        except (OSError, ProcessLookupError):
+            continue
+    
+    deadline = time.monotonic() + grace_seconds
+    alive = list(signalled)
+    while alive and time.monotonic() < deadline:
+        time.sleep(0.05)
+        alive = [pid for pid in alive if _is_alive(pid)]
+    
+    kill_signal = getattr(signal, 'SIGKILL', signal.SIGTERM)
+    for pid in alive:
+        try:
+            _signal_process(pid, kill_signal)
+            logger.warning(f"进程 {pid} 未响应SIGTERM，已强制结束")
+        except (OSError, ProcessLookupError):
+            pass
+    return signalled
+
+def _is_alive(pid: int) -> bool:
+    try:
+        # 回收已退出的子进程，避免僵尸进程被当作存活
+        if os.name == 'posix':
+            finished, _ = os.waitpid(pid, os.WNOHANG)
+            if finished == pid:
+                return False
+    except ChildProcessError:
+        pass
+    except OSError:
+        return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def repair_history(messages: List[Dict[str, Any]], partial_text: str = "") -> int:
+    """
+    修复取消后的对话历史，保证下一轮请求仍然是合法的对话
+    
+    - 末尾assistant消息中没有结果的toolUse，补一条错误状态的toolResult
+    - 末尾是user消息时，补一条assistant消息，包含已输出的部分正文
+    
+    参数:
+        messages: Agent的消息列表（原地修改）
+        partial_text: 被中断的assistant消息已经输出的正文
+    
+    返回:
+        追加的消息数量
+    """
+    if not messages:
+        return 0
+    
+    added = 0
+    last = messages[-1]
+    if last.get('role') == 'assistant':
+        tool_use_ids = [
+            block['toolUse'].get('toolUseId', '')
+            for block in last.get('content', [])
+            if isinstance(block, dict) and 'toolUse' in block
+        ]
+        if not tool_use_ids:
+            return 0
+        messages.append({
+            'role': 'user',
+            'content': [{
+                'toolResult': {
+                    'toolUseId': tool_use_id,
+                    'status': 'error',
+                    'content': [{'text': CANCELLED_TOOL_RESULT}]
+                }
+            } for tool_use_id in tool_use_ids]
+        })
+        added += 1
+    
+    # 此时末尾一定是user消息（用户输入或工具结果）
+    text = partial_text.rstrip()
+    text = f"{text}\n\n{CANCELLED_NOTE}" if text else CANCELLED_NOTE
+    messages.append({'role': 'assistant', 'content': [{'text': text}]})
+    added += 1
+    return added
@@ -0,0 +1,199 @@
+"""
+流式文本合并模块
+将连续的正文增量合并为一帧，按时间窗口、字节阈值或遇到非文本帧时刷新，减少Unity端的帧数
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import AsyncGenerator, AsyncIterator, Dict, Any, Optional
+
+from stream_frames import StreamFrame, FRAME_TEXT
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认合并参数，可通过环境变量按编辑器机器调整
+DEFAULT_WINDOW_MS = int(os.environ.get('UNITY_AGENT_COALESCE_WINDOW_MS', '30'))
+DEFAULT_MAX_BYTES = int(os.environ.get('UNITY_AGENT_COALESCE_MAX_BYTES', '2048'))
+
+
+class CoalescingStats:
+    """合并阶段的统计数据"""
+    
+    def __init__(self):
+        self.streams = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.text_frames_in = 0
+        self.text_frames_out = 0
+        self.bytes_out = 0
+        self.active_seconds = 0.0
+        self.last_stream: Optional[Dict[str, Any]] = None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计快照"""
+        return {
+            "streams": self.streams,
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "text_frames_in": self.text_frames_in,
+            "text_frames_out": self.text_frames_out,
+            "bytes_out": self.bytes_out,
+            "frames_per_second": round(self.frames_out / self.active_seconds, 2) if self.active_seconds else 0.0,
+            "avg_frame_bytes": round(self.bytes_out / self.frames_out, 1) if self.frames_out else 0.0,
+            "last_stream": self.last_stream
+        }
+
+
+class FrameCoalescer:
+    """正文增量合并器"""
+    
+    def __init__(self, window_ms: int = DEFAULT_WINDOW_MS, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        初始化合并器
+        
+        参数:
+            window_ms: 合并时间窗口（毫秒），小于等于0时不合并
+            max_bytes: 缓冲的正文达到该字节数时立即刷新
+        """
+        self.window_ms = window_ms
+        self.max_bytes = max_bytes
+        self._stats = CoalescingStats()
+        self._stats_lock = threading.Lock()
+    
+    def configure(self, window_ms: Optional[int] = None, max_bytes: Optional[int] = None):
+        """调整合并参数，对之后开始的流生效"""
+        if window_ms is not None:
+            self.window_ms = max(0, int(window_ms))
+        if max_bytes is not None:
+            self.max_bytes = max(1, int(max_bytes))
+        logger.info(f"文本合并参数: window={self.window_ms}ms, max_bytes={self.max_bytes}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并配置和统计"""
+        with self._stats_lock:
+            stats = self._stats.snapshot()
+        stats["window_ms"] = self.window_ms
+        stats["max_bytes"] = self.max_bytes
+        return stats
+    
+    def reset_stats(self):
+        """清空统计"""
+        with self._stats_lock:
+            self._stats = CoalescingStats()
+    
+    async def coalesce(self, frames: AsyncIterator[StreamFrame]) -> AsyncGenerator[StreamFrame, None]:
+        """
+        合并帧流中连续的正文帧，工具/状态帧保持原有顺序
+        
+        参数:
+            frames: 上游帧的异步迭代器
+        
+        生成:
+            合并后的帧
+        """
+        window = self.window_ms / 1000.0
+        max_bytes = self.max_bytes
+        loop = asyncio.get_event_loop()
+        
+        iterator = frames.__aiter__()
+        pending = None
+        buffer = []
+        buffered_bytes = 0
+        flush_deadline = 0.0
+        
+        frames_in = text_in = frames_out = text_out = bytes_out = 0
+        started = time.monotonic()
+        
+        def flush() -> StreamFrame:
+            nonlocal buffer, buffered_bytes
+            frame = StreamFrame(FRAME_TEXT, buffer[0] if len(buffer) == 1 else ''.join(buffer))
+            buffer = []
+            buffered_bytes = 0
+            return frame
+        
+        def count(frame: StreamFrame) -> StreamFrame:
+            nonlocal frames_out, text_out, bytes_out
+            frames_out += 1
+            if frame.kind == FRAME_TEXT:
+                text_out += 1
+            if frame.content:
+                bytes_out += len(frame.content.encode('utf-8'))
+            return frame
+        
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                
+                if buffer:
+                    # 有缓冲时只等待到时间窗口结束
+                    timeout = flush_deadline - loop.time()
+                    if timeout <= 0:
+                        yield count(flush())
+                        continue
+                    done, _ = await asyncio.wait({pending}, timeout=timeout)
+                    if not done:
+                        continue
+                else:
+                    await asyncio.wait({pending})
+                
+                task, pending = pending, None
+                try:
+                    frame = task.result()
+                except StopAsyncIteration:
+                    break
+                
+                frames_in += 1
+                if frame.kind == FRAME_TEXT:
+                    text_in += 1
+                    if window <= 0:
+                        yield count(frame)
+                        continue
+                    if not buffer:
+                        flush_deadline = loop.time() + window
+                    buffer.append(frame.content)
+                    buffered_bytes += len(frame.content.encode('utf-8'))
+                    if buffered_bytes >= max_bytes:
+                        yield count(flush())
+                    continue
+                
+                # 非文本帧：先刷新已缓冲的正文，保证顺序
+                if buffer:
+                    yield count(flush())
+                yield count(frame)
+            
+            if buffer:
+                yield count(flush())
+        finally:
+            if pending is not None and not pending.done():
+                # 上游仍在运行时取消，并等待上游生成器完成清理（如修复对话历史）
+                pending.cancel()
+                await asyncio.wait({pending})
+                if not pending.cancelled():
+                    pending.exception()
+            elif hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+            
+            elapsed = time.monotonic() - started
+            last_stream = {
+                "frames_in": frames_in,
+                "frames_out": frames_out,
+                "duration_seconds": round(elapsed, 3),
+                "frames_per_second": round(frames_out / elapsed, 2) if elapsed > 0 else 0.0,
+                "avg_frame_bytes": round(bytes_out / frames_out, 1) if frames_out else 0.0
+            }
+            with self._stats_lock:
+                stats = self._stats
+                stats.streams += 1
+                stats.frames_in += frames_in
+                stats.frames_out += frames_out
+                stats.text_frames_in += text_in
+                stats.text_frames_out += text_out
+                stats.bytes_out += bytes_out
+                stats.active_seconds += elapsed
+                stats.last_stream = last_stream
+            logger.info(f"文本合并统计: 输入{frames_in}帧 -> 输出{frames_out}帧, {last_stream['frames_per_second']}帧/秒")
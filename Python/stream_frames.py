@@ -0,0 +1,79 @@
+"""
+流式输出帧定义
+统一描述发送给Unity的每一帧，便于后续阶段按类别处理（合并、缓冲等）
+"""
+
+import json
+from typing import Optional
+
+# 帧类别
+FRAME_TEXT = "text"          # 模型输出的正文文本
+FRAME_TOOL = "tool"          # 工具调用相关提示
+FRAME_STATUS = "status"      # 状态提示（警告、错误详情等，不可丢弃）
+FRAME_PROGRESS = "progress"  # 工具执行进度（心跳），同一工具的新进度可以替换旧进度
+FRAME_COMPLETE = "complete"  # 完成信号
+FRAME_ERROR = "error"        # 错误信号
+FRAME_CANCELLED = "cancelled"  # 取消信号
+
+
+class StreamFrame:
+    """发送给Unity的单个流式帧"""
+    
+    __slots__ = ('kind', 'content', 'error', 'key')
+    
+    def __init__(self, kind: str, content: str = "", error: Optional[str] = None, key: Optional[str] = None):
+        self.kind = kind
+        self.content = content
+        self.error = error
+        # 进度帧所属的工具调用ID
+        self.key = key
+    
+    @property
+    def done(self) -> bool:
+        """是否为终止帧"""
+        return self.kind == FRAME_COMPLETE or self.kind == FRAME_ERROR or self.kind == FRAME_CANCELLED
+    
+    def to_dict(self) -> dict:
+        """转换为Unity端StreamChunk的字典格式"""
+        if self.kind == FRAME_ERROR:
+            return {"type": "error", "error": self.error or "", "done": True}
+        if self.kind == FRAME_COMPLETE:
+            return {"type": "complete", "content": "", "done": True}
+        if self.kind == FRAME_CANCELLED:
+            return {"type": "cancelled", "content": self.content, "done": True}
+        return {"type": "chunk", "content": self.content, "done": False}
+    
+    def to_json(self) -> str:
+        """序列化为JSON字符串"""
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+    
+    def __repr__(self):
+        return f"StreamFrame({self.kind!r}, {self.content[:30]!r})"
+
+
+def text_frame(content: str) -> StreamFrame:
+    return StreamFrame(FRAME_TEXT, content)
+
+
+def tool_frame(content: str) -> StreamFrame:
+    return StreamFrame(FRAME_TOOL, content)
+
+
+def status_frame(content: str) -> StreamFrame:
+    return StreamFrame(FRAME_STATUS, content)
+
+
+def progress_frame(content: str, key: str) -> StreamFrame:
+    return StreamFrame(FRAME_PROGRESS, content, key=key)
+
+
+def complete_frame() -> StreamFrame:
+    return StreamFrame(FRAME_COMPLETE)
+
+
+def error_frame(error: str) -> StreamFrame:
+    return StreamFrame(FRAME_ERROR, error=error)
+
+
+def cancelled_frame(reason: str = "") -> StreamFrame:
+    return StreamFrame(FRAME_CANCELLED, reason)
@@ -0,0 +1,248 @@
+"""
+流式延迟统计模块
+记录每个流的首字节时间、首个正文帧时间、chunk间隔分布、工具耗时，
+以及自身处理代码与等待模型的时间占比，并对最近N个流计算分位数
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 保留最近多少个流的记录
+DEFAULT_WINDOW = int(os.environ.get('UNITY_AGENT_METRICS_WINDOW', '50'))
+
+# chunk间隔直方图的桶上界（毫秒）
+GAP_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _bucket_label(index: int) -> str:
+    if index < len(GAP_BUCKETS_MS):
+        return f"<={GAP_BUCKETS_MS[index]}ms"
+    return f">{GAP_BUCKETS_MS[-1]}ms"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法计算分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class StreamTimer:
+    """单个流的计时记录"""
+    
+    __slots__ = ('started', 'ready_at', 'first_byte_at', 'first_text_at', 'last_chunk_at',
+                 'resumed_at', 'gap_counts', 'max_gap', 'chunks', 'processing', 'waiting',
+                 'tools', 'status', 'finished_at')
+    
+    def __init__(self):
+        now = time.perf_counter()
+        self.started = now
+        self.ready_at = None
+        self.first_byte_at = None
+        self.first_text_at = None
+        self.last_chunk_at = None
+        self.resumed_at = now
+        self.gap_counts = [0] * (len(GAP_BUCKETS_MS) + 1)
+        self.max_gap = 0.0
+        self.chunks = 0
+        self.processing = 0.0
+        self.waiting = 0.0
+        self.tools: Dict[str, Dict[str, Any]] = {}
+        self.status = 'running'
+        self.finished_at = None
+    
+    def on_ready(self):
+        """就绪检查完成，开始向模型发送请求"""
+        self.ready_at = time.perf_counter()
+        self.resumed_at = self.ready_at
+    
+    def on_chunk(self, model_event: bool) -> float:
+        """
+        收到一个chunk
+        
+        参数:
+            model_event: 是否为模型流事件（用于首字节时间）
+        
+        返回:
+            收到chunk的时间点，传给on_processed
+        """
+        now = time.perf_counter()
+        self.chunks += 1
+        self.waiting += now - self.resumed_at
+        if self.last_chunk_at is not None:
+            gap = now - self.last_chunk_at
+            if gap > self.max_gap:
+                self.max_gap = gap
+            gap_ms = gap * 1000
+            index = 0
+            while index < len(GAP_BUCKETS_MS) and gap_ms > GAP_BUCKETS_MS[index]:
+                index += 1
+            self.gap_counts[index] += 1
+        self.last_chunk_at = now
+        if model_event and self.first_byte_at is None:
+            self.first_byte_at = now
+        return now
+    
+    def on_processed(self, received_at: float):
+        """chunk处理完成（不含下游消费帧的时间）"""
+        self.processing += time.perf_counter() - received_at
+    
+    def on_text(self):
+        """产出正文帧"""
+        if self.first_text_at is None:
+            self.first_text_at = time.perf_counter()
+    
+    def resume(self):
+        """帧已交给下游，重新开始等待模型"""
+        self.resumed_at = time.perf_counter()
+    
+    def tool_requested(self, tool_use_id: str, name: str):
+        """模型开始输出工具调用块"""
+        if tool_use_id and tool_use_id not in self.tools:
+            now = time.perf_counter()
+            self.tools[tool_use_id] = {"name": name, "requested": now, "start": now, "end": None}
+    
+    def tool_started(self, tool_use_id: str, name: str):
+        """工具调用块输出完整（包含在完整消息中），工具开始执行"""
+        if not tool_use_id:
+            return
+        span = self.tools.get(tool_use_id)
+        now = time.perf_counter()
+        if span is None:
+            self.tools[tool_use_id] = {"name": name, "requested": now, "start": now, "end": None}
+        elif span["end"] is None:
+            span["start"] = now
+    
+    def tool_finished(self, tool_use_id: str):
+        span = self.tools.get(tool_use_id)
+        if span is not None and span["end"] is None:
+            span["end"] = time.perf_counter()
+    
+    def finish(self, status: str) -> Dict[str, Any]:
+        """结束计时并生成记录"""
+        self.finished_at = time.perf_counter()
+        self.status = status
+        return self.to_record()
+    
+    def _since_start(self, at: Optional[float]) -> Optional[float]:
+        return round((at - self.started) * 1000, 1) if at is not None else None
+    
+    def to_record(self) -> Dict[str, Any]:
+        """转换为可序列化的记录（时间单位：毫秒）"""
+        end = self.finished_at or time.perf_counter()
+        tools = {}
+        tool_total = 0.0
+        for tool_use_id, span in self.tools.items():
+            span_end = span["end"] or end
+            duration = span_end - span["start"]
+            tool_total += duration
+            tools[tool_use_id] = {
+                "name": span["name"],
+                "input_ms": round((span["start"] - span["requested"]) * 1000, 1),
+                "start_ms": self._since_start(span["start"]),
+                "end_ms": self._since_start(span["end"]),
+                "duration_ms": round(duration * 1000, 1),
+                "finished": span["end"] is not None
+            }
+        return {
+            "status": self.status,
+            "total_ms": self._since_start(end),
+            "ready_wait_ms": self._since_start(self.ready_at),
+            "ttfb_ms": self._since_start(self.first_byte_at),
+            "ttft_ms": self._since_start(self.first_text_at),
+            "chunks": self.chunks,
+            "processing_ms": round(self.processing * 1000, 1),
+            "waiting_ms": round(self.waiting * 1000, 1),
+            "max_gap_ms": round(self.max_gap * 1000, 1),
+            "gap_histogram": {_bucket_label(i): count for i, count in enumerate(self.gap_counts) if count},
+            "tool_ms": round(tool_total * 1000, 1),
+            "tools": tools
+        }
+
+
+class StreamMetrics:
+    """最近N个流的延迟统计"""
+    
+    # 计算分位数的字段
+    SUMMARY_FIELDS = ('total_ms', 'ready_wait_ms', 'ttfb_ms', 'ttft_ms', 'processing_ms',
+                      'waiting_ms', 'max_gap_ms', 'tool_ms')
+    
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._records = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+        self.total_streams = 0
+    
+    def record(self, record: Dict[str, Any]):
+        """保存一个流的记录"""
+        with self._lock:
+            self._records.append(record)
+            self.total_streams += 1
+        logger.info(
+            f"流式延迟: 总计{record['total_ms']}ms, 首字节{record['ttfb_ms']}ms, 首文本{record['ttft_ms']}ms, "
+            f"处理{record['processing_ms']}ms, 等待{record['waiting_ms']}ms, 工具{record['tool_ms']}ms"
+        )
+    
+    def reset(self):
+        """清空记录"""
+        with self._lock:
+            self._records.clear()
+            self.total_streams = 0
+    
+    def summary(self) -> Dict[str, Any]:
+        """
+        获取最近N个流的分位数统计
+        
+        返回:
+            包含各字段p50/p95/p99、合并的间隔直方图、工具耗时和最近一条记录的字典
+        """
+        with self._lock:
+            records = list(self._records)
+            total_streams = self.total_streams
+        
+        summary = {}
+        for field in self.SUMMARY_FIELDS:
+            values = [r[field] for r in records if r.get(field) is not None]
+            summary[field] = {
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "count": len(values)
+            }
+        
+        gap_histogram: Dict[str, int] = {}
+        tool_durations: Dict[str, List[float]] = {}
+        statuses: Dict[str, int] = {}
+        for r in records:
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+            for label, count in r["gap_histogram"].items():
+                gap_histogram[label] = gap_histogram.get(label, 0) + count
+            for span in r["tools"].values():
+                tool_durations.setdefault(span["name"], []).append(span["duration_ms"])
+        
+        return {
+            "window": self._records.maxlen,
+            "streams": len(records),
+            "total_streams": total_streams,
+            "statuses": statuses,
+            "latency": summary,
+            "gap_histogram": {
+                _bucket_label(i): gap_histogram[_bucket_label(i)]
+                for i in range(len(GAP_BUCKETS_MS) + 1) if _bucket_label(i) in gap_histogram
+            },
+            "tools": {
+                name: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                       "p99": percentile(values, 99)}
+                for name, values in tool_durations.items()
+            },
+            "last_stream": records[-1] if records else None
+        }
@@ -0,0 +1,252 @@
+"""
+流式运行时模块
+在一个常驻的后台事件循环上运行所有流式生成器，帧写入每个流的有界缓冲，宿主（Unity）通过句柄批量拉取
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from frame_buffer import FrameBuffer, BufferStats, DEFAULT_CAPACITY
+from stream_cancel import CancelScope, enter_scope
+from stream_frames import StreamFrame, cancelled_frame
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class StreamHandle:
+    """单个流的状态：生产者在事件循环中写入帧，消费者在宿主线程中拉取"""
+    
+    def __init__(self, handle_id: str, capacity: int):
+        self.handle_id = handle_id
+        self.buffer = FrameBuffer(capacity)
+        self.future = None
+        self.task: Optional[asyncio.Task] = None
+        self.finished = False
+        self.cancelled = False
+        # 本流中工具启动的子进程和进行中的MCP调用，取消时只处理这些
+        self.scope = CancelScope(handle_id)
+        self.created_at = time.monotonic()
+        # 生成器真正结束（包括取消后的清理）时置位
+        self.stopped = threading.Event()
+    
+    def end(self, final_frame: Optional[StreamFrame] = None):
+        """写入最后一帧并结束缓冲，只生效一次"""
+        self.buffer.finish(final_frame)
+
+
+class StreamRuntime:
+    """常驻事件循环，承载所有并发的流"""
+    
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._streams: Dict[str, StreamHandle] = {}
+        self._ids = itertools.count(1)
+        # 帧缓冲容量和已结束流的累计缓冲统计
+        self.buffer_capacity = DEFAULT_CAPACITY
+        self._buffer_stats = BufferStats()
+        self._finished_streams = 0
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """获取（必要时启动）后台事件循环"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed() or not self._thread.is_alive():
+                ready = threading.Event()
+                
+                def run_loop():
+                    self._loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(self._loop)
+                    ready.set()
+                    self._loop.run_forever()
+                
+                self._thread = threading.Thread(target=run_loop, name="UnityAgentStreamLoop", daemon=True)
+                self._thread.start()
+                ready.wait()
+                logger.info("流式事件循环已启动")
+            return self._loop
+    
+    def configure_buffer(self, capacity: int):
+        """调整帧缓冲容量，对之后开始的流生效"""
+        self.buffer_capacity = max(1, int(capacity))
+        logger.info(f"流式帧缓冲容量: {self.buffer_capacity}")
+    
+    def get_buffer_stats(self) -> Dict[str, Any]:
+        """获取帧缓冲统计：各溢出策略的触发次数、背压等待时间、最高水位"""
+        with self._lock:
+            totals = BufferStats()
+            totals.add(self._buffer_stats)
+            active = {}
+            for handle_id, handle in self._streams.items():
+                totals.add(handle.buffer.stats)
+                active[handle_id] = len(handle.buffer)
+            finished_streams = self._finished_streams
+        stats = totals.snapshot()
+        stats["capacity"] = self.buffer_capacity
+        stats["finished_streams"] = finished_streams
+        stats["active_streams"] = active
+        return stats
+    
+    def reset_buffer_stats(self):
+        """清空已结束流的缓冲统计"""
+        with self._lock:
+            self._buffer_stats = BufferStats()
+            self._finished_streams = 0
+    
+    def start(self, stream_factory: Callable[[], AsyncIterator[StreamFrame]]) -> str:
+        """
+        在后台事件循环上启动一个流
+        
+        参数:
+            stream_factory: 返回StreamFrame异步生成器的工厂函数（在事件循环线程中调用）
+        
+        返回:
+            流句柄ID
+        """
+        handle = StreamHandle(f"stream-{next(self._ids)}", self.buffer_capacity)
+        with self._lock:
+            self._streams[handle.handle_id] = handle
+        handle.future = asyncio.run_coroutine_threadsafe(self._pump(handle, stream_factory), self.loop)
+        logger.info(f"启动流 {handle.handle_id}，当前活动流数量: {len(self._streams)}")
+        return handle.handle_id
+    
+    async def _pump(self, handle: StreamHandle, stream_factory):
+        """把生成器产生的帧写入句柄的有界缓冲，缓冲满时在这里等待消费者"""
+        handle.task = asyncio.current_task()
+        # 任务有自己的上下文，流中的工具线程和MCP调用据此登记到本流的取消范围
+        enter_scope(handle.scope)
+        final_frame = None
+        stream = stream_factory()
+        try:
+            async for frame in stream:
+                if handle.cancelled or not await handle.buffer.put(frame):
+                    break
+        except asyncio.CancelledError:
+            logger.info(f"流 {handle.handle_id} 已取消")
+            final_frame = cancelled_frame("用户取消了流式处理")
+        except Exception as e:
+            logger.error(f"流 {handle.handle_id} 异常结束: {e}")
+        finally:
+            if hasattr(stream, 'aclose'):
+                try:
+                    await stream.aclose()
+                except (Exception, asyncio.CancelledError) as e:
+                    logger.debug(f"关闭流 {handle.handle_id} 的生成器时出错: {e}")
+            if handle.cancelled and final_frame is None:
+                final_frame = cancelled_frame("用户取消了流式处理")
+            handle.end(final_frame)
+            handle.stopped.set()
+    
+    def poll(self, handle_id: str, max_frames: int = 64, timeout_ms: int = 100) -> Optional[List[str]]:
+        """
+        批量拉取帧：最多等待timeout_ms毫秒拿到第一帧，然后不阻塞地取出剩余帧
+        
+        等待期间释放GIL（缓冲基于条件变量超时等待）。
+        
+        参数:
+            handle_id: 流句柄ID
+            max_frames: 本次最多返回的帧数
+            timeout_ms: 没有帧时的最长等待时间
+        
+        返回:
+            JSON帧列表；句柄不存在时返回None
+        """
+        handle = self._streams.get(handle_id)
+        if handle is None:
+            return None
+        if handle.finished:
+            return []
+        
+        frames, drained = handle.buffer.get_batch(max(1, max_frames), max(0, timeout_ms) / 1000.0)
+        if drained:
+            self._finish(handle)
+        return [frame.to_json() for frame in frames]
+    
+    def cancel(self, handle_id: str, deadline_seconds: float = 2.0,
+               on_cancel: Optional[Callable[[CancelScope], Any]] = None) -> Dict[str, Any]:
+        """
+        取消流：取消生成器所在的asyncio任务，并保证在期限内写入最终的cancelled帧
+        
+        参数:
+            handle_id: 流句柄ID
+            deadline_seconds: 等待生成器完成清理的最长时间
+            on_cancel: 标记取消后、取消任务前以本流的取消范围调用（用于通知Agent停止工具执行），
+                返回值放入结果的detail字段；未提供时直接取消该范围
+        
+        返回:
+            取消结果字典
+        """
+        handle = self._streams.get(handle_id)
+        if handle is None or handle.finished:
+            return {"handle": handle_id, "cancelled": False, "stopped": True, "elapsed_ms": 0}
+        
+        started = time.monotonic()
+        # 先标记取消，之后生成器产生的帧（包括正常完成帧）都不再发送
+        handle.cancelled = True
+        try:
+            detail = on_cancel(handle.scope) if on_cancel is not None else handle.scope.cancel()
+        except Exception as e:
+            detail = None
+            logger.warning(f"流 {handle_id} 取消回调出错: {e}")
+        
+        def cancel_task():
+            if handle.task is not None:
+                handle.task.cancel()
+            elif handle.future is not None:
+                handle.future.cancel()
+        
+        self.loop.call_soon_threadsafe(cancel_task)
+        stopped = handle.stopped.wait(deadline_seconds)
+        if not stopped:
+            # 生成器仍在清理（例如阻塞的工具线程），先结束句柄，让宿主不再等待
+            logger.warning(f"流 {handle_id} 未能在 {deadline_seconds}秒内停止，提前发送取消帧")
+            handle.end(cancelled_frame("用户取消了流式处理（后台仍在清理）"))
+        
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        logger.info(f"流 {handle_id} 取消完成，耗时 {elapsed_ms}ms")
+        return {"handle": handle_id, "cancelled": True, "stopped": stopped, "elapsed_ms": elapsed_ms, "detail": detail}
+    
+    def is_finished(self, handle_id: str) -> bool:
+        """流是否已结束（或句柄不存在）"""
+        handle = self._streams.get(handle_id)
+        return handle is None or handle.finished
+    
+    def close(self, handle_id: str):
+        """关闭流：取消仍在运行的生成器并释放句柄"""
+        handle = self._streams.get(handle_id)
+        if handle is None:
+            return
+        if handle.future is not None and not handle.future.done():
+            self.loop.call_soon_threadsafe(handle.future.cancel)
+        # 结束缓冲，唤醒可能在等待空间的生产者
+        handle.end()
+        self._finish(handle)
+    
+    def _finish(self, handle: StreamHandle):
+        handle.finished = True
+        with self._lock:
+            if self._streams.pop(handle.handle_id, None) is not None:
+                self._buffer_stats.add(handle.buffer.stats)
+                self._finished_streams += 1
+    
+    def active_streams(self) -> List[str]:
+        """获取所有活动流的句柄ID"""
+        with self._lock:
+            return list(self._streams.keys())
+
+
+# 全局流式运行时实例
+_stream_runtime: Optional[StreamRuntime] = None
+
+def get_stream_runtime() -> StreamRuntime:
+    """获取全局流式运行时实例"""
+    global _stream_runtime
+    if _stream_runtime is None:
+        _stream_runtime = StreamRuntime()
+    return _stream_runtime
@@ -0,0 +1,255 @@
+"""
+增量JSON解析模块
+Bedrock事件流中的工具参数以JSON字符串片段的形式分多次到达（contentBlockDelta.delta.toolUse.input）。
+这里逐片段扫描顶层对象，每个顶层键值对完整后立即解析并返回，不会在每个增量时重新解析整个缓冲，
+总开销与参数长度成线性关系
+"""
+
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 顶层扫描状态
+_START = 0        # 等待 '{'
+_KEY_OR_END = 1   # 等待键或 '}'
+_KEY = 2          # 键字符串中
+_COLON = 3        # 等待 ':'
+_VALUE_START = 4  # 等待值
+_VALUE = 5        # 值中
+_AFTER_VALUE = 6  # 等待 ',' 或 '}'
+_DONE = 7
+_ERROR = 8
+
+# 值类型
+_STRING = 0
+_CONTAINER = 1
+_LITERAL = 2
+
+# 字符串中需要关注的字符
+_STRING_SPECIAL = re.compile(r'["\\]')
+# 嵌套对象/数组中（字符串外）需要关注的字符
+_CONTAINER_SPECIAL = re.compile(r'["{}\[\]]')
+# 数字/true/false/null的结束位置
+_LITERAL_END = re.compile(r'[,}\s]')
+_NON_WHITESPACE = re.compile(r'\S')
+
+
+class StreamingJSONObject:
+    """单个工具参数对象的增量解析器"""
+    
+    def __init__(self):
+        self._parts: List[str] = []
+        self._state = _START
+        self._token: List[str] = []
+        self._key: Optional[str] = None
+        self._value_kind = None
+        self._in_string = False
+        self._escape = False
+        self._depth = 0
+        self.size = 0
+        # 已完整解析的顶层字段
+        self.fields: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+    
+    @property
+    def text(self) -> str:
+        """已收到的参数文本"""
+        return ''.join(self._parts)
+    
+    @property
+    def complete(self) -> bool:
+        """顶层对象是否已结束"""
+        return self._state == _DONE
+    
+    def feed(self, fragment: str) -> List[Tuple[str, Any]]:
+        """
+        追加一个片段
+        
+        参数:
+            fragment: JSON文本片段
+        
+        返回:
+            本次片段中完整解析的顶层(键, 值)列表
+        """
+        if not fragment:
+            return []
+        self._parts.append(fragment)
+        self.size += len(fragment)
+        if self._state in (_DONE, _ERROR):
+            return []
+        
+        completed = []
+        try:
+            self._scan(fragment, completed)
+        except ValueError as e:
+            self._fail(str(e))
+        return completed
+    
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """
+        参数输入结束（contentBlockStop）时获取最终参数
+        
+        返回:
+            解析后的参数字典，无法解析时返回None
+        """
+        if self._state == _DONE:
+            return dict(self.fields)
+        if not self._parts:
+            return {}
+        # 增量扫描失败或对象未结束时，按完整文本再尝试一次
+        try:
+            value = json.loads(self.text)
+        except ValueError as e:
+            logger.warning(f"工具参数JSON解析失败: {e}")
+            return None
+        return value if isinstance(value, dict) else None
+    
+    def _fail(self, reason: str):
+        self._state = _ERROR
+        self.error = reason
+        self._token = []
+    
+    def _scan(self, fragment: str, completed: List[Tuple[str, Any]]):
+        i = 0
+        n = len(fragment)
+        while i < n:
+            state = self._state
+            if state == _KEY or (state == _VALUE and self._value_kind == _STRING):
+                i = self._scan_string(fragment, i)
+                if not self._in_string:
+                    self._end_token(completed)
+                continue
+            if state == _VALUE:
+                if self._value_kind == _CONTAINER:
+                    i = self._scan_container(fragment, i)
+                    if self._depth == 0:
+                        self._end_token(completed)
+                else:
+                    match = _LITERAL_END.search(fragment, i)
+                    if match is None:
+                        self._token.append(fragment[i:])
+                        return
+                    self._token.append(fragment[i:match.start()])
+                    i = match.start()
+                    self._end_token(completed)
+                continue
+            
+            match = _NON_WHITESPACE.search(fragment, i)
+            if match is None:
+                return
+            i = match.start()
+            char = fragment[i]
+            i += 1
+            
+            if state == _START:
+                if char != '{':
+                    raise ValueError(f"参数不是JSON对象: {char!r}")
+                self._state = _KEY_OR_END
+            elif state == _KEY_OR_END:
+                if char == '}' and not self.fields:
+                    self._state = _DONE
+                    return
+                if char != '"':
+                    raise ValueError(f"期望键名，得到 {char!r}")
+                self._start_string(_KEY)
+            elif state == _COLON:
+                if char != ':':
+                    raise ValueError(f"期望 ':'，得到 {char!r}")
+                self._state = _VALUE_START
+            elif state == _VALUE_START:
+                self._state = _VALUE
+                if char == '"':
+                    self._value_kind = _STRING
+                    self._start_string(_VALUE)
+                elif char in '{[':
+                    self._value_kind = _CONTAINER
+                    self._depth = 1
+                    self._token = [char]
+                else:
+                    self._value_kind = _LITERAL
+                    self._token = [char]
+            elif state == _AFTER_VALUE:
+                if char == ',':
+                    self._state = _KEY_OR_END
+                elif char == '}':
+                    self._state = _DONE
+                    return
+                else:
+                    raise ValueError(f"期望 ',' 或 '}}'，得到 {char!r}")
+            else:
+                return
+    
+    def _start_string(self, state: int):
+        self._state = state
+        self._in_string = True
+        self._escape = False
+        self._token = ['"']
+    
+    def _scan_string(self, fragment: str, i: int) -> int:
+        """扫描字符串内容，返回下一个未处理的位置"""
+        n = len(fragment)
+        token = self._token
+        while i < n:
+            if self._escape:
+                token.append(fragment[i])
+                self._escape = False
+                i += 1
+                continue
+            match = _STRING_SPECIAL.search(fragment, i)
+            if match is None:
+                token.append(fragment[i:])
+                return n
+            end = match.end()
+            token.append(fragment[i:end])
+            if match.group() == '\\':
+                self._escape = True
+                i = end
+                continue
+            self._in_string = False
+            return end
+        return i
+    
+    def _scan_container(self, fragment: str, i: int) -> int:
+        """扫描嵌套对象/数组，返回下一个未处理的位置"""
+        n = len(fragment)
+        token = self._token
+        while i < n:
+            if self._in_string:
+                i = self._scan_string(fragment, i)
+                continue
+            match = _CONTAINER_SPECIAL.search(fragment, i)
+            if match is None:
+                token.append(fragment[i:])
+                return n
+            end = match.end()
+            token.append(fragment[i:end])
+            char = match.group()
+            i = end
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return i
+        return i
+    
+    def _end_token(self, completed: List[Tuple[str, Any]]):
+        """当前键或值已完整"""
+        raw = ''.join(self._token)
+        self._token = []
+        if self._state == _KEY:
+            self._key = json.loads(raw)
+            self._state = _COLON
+            return
+        value = json.loads(raw)
+        self.fields[self._key] = value
+        completed.append((self._key, value))
+        self._key = None
+        self._value_kind = None
+        self._state = _AFTER_VALUE
@@ -6,12 +6,43 @@
 import json
 import logging
 import asyncio
-from typing import Dict, Any, AsyncGenerator
-from tool_tracker import get_tool_tracker
+from typing import Any, AsyncGenerator, List
+from tool_tracker import ToolTracker
+from chunk_dispatcher import (
+    ChunkDispatcher, classify_chunk, iter_message_tool_blocks, first_text,
+    TEXT_DELTA, TOOL_USE_START, TOOL_INPUT_DELTA, BLOCK_STOP, MESSAGE,
+    TOOL_RESULT, TOOL_STREAM, TOOL_USE, TEXT, IGNORED
+)
+from stream_coalescer import FrameCoalescer
+from tool_result_view import chunk_tool_results
+from tool_heartbeat import ToolHeartbeat
+from stream_metrics import StreamMetrics, StreamTimer
+from stream_frames import (
+    StreamFrame, FRAME_TEXT, tool_frame, status_frame, complete_frame, error_frame
+)
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+class StreamContext:
+    """单次流式处理的状态，供各chunk处理器共享"""
+    
+    __slots__ = ('tool_tracker', 'chunk_count', 'start_time', 'current_time',
+                 'last_tool_time', 'text_parts', 'timer', 'heartbeat')
+    
+    def __init__(self, tool_tracker, start_time: float, timer: StreamTimer = None,
+                 heartbeat: ToolHeartbeat = None):
+        self.tool_tracker = tool_tracker
+        self.timer = timer or StreamTimer()
+        # 执行中工具的进度心跳，不依赖chunk到达
+        self.heartbeat = heartbeat or ToolHeartbeat()
+        self.chunk_count = 0
+        self.start_time = start_time
+        self.current_time = start_time
+        self.last_tool_time = start_time
+        # 当前assistant消息已输出的正文，取消时写回对话历史
+        self.text_parts = []
+
 class StreamingProcessor:
     """负责处理Agent的流式响应"""
     
@@ -23,6 +54,42 @@ class StreamingProcessor:
             agent_instance: Unity Agent实例
         """
         self.agent_instance = agent_instance
+        self.dispatcher = ChunkDispatcher()
+        self._register_handlers(self.dispatcher)
+        # 正文增量合并阶段，减少发送给Unity的帧数
+        self.coalescer = FrameCoalescer()
+        # 最近N个流的延迟统计
+        self.metrics = StreamMetrics()
+    
+    def _register_handlers(self, dispatcher: ChunkDispatcher):
+        """注册各类chunk的处理器，新增UI提示只需在这里注册，不会增加对chunk的扫描次数"""
+        # 正文文本
+        dispatcher.register(TEXT_DELTA, self._handle_text, FRAME_TEXT)
+        dispatcher.register(TEXT, self._handle_text, FRAME_TEXT)
+        
+        # 工具调用开始
+        dispatcher.register(TOOL_USE_START, self._handle_file_read_start)
+        dispatcher.register(TOOL_USE_START, self._handle_tracker_start)
+        
+        # 工具参数增量（跟踪器先增量解析参数片段，file_read检查读取解析出的字段）
+        dispatcher.register(TOOL_INPUT_DELTA, self._handle_tracker_input)
+        dispatcher.register(TOOL_INPUT_DELTA, self._handle_file_read_input)
+        
+        # 内容块结束
+        dispatcher.register(BLOCK_STOP, self._handle_file_read_stop)
+        dispatcher.register(BLOCK_STOP, self._handle_tracker_stop)
+        
+        # 完整消息中的工具使用和工具结果
+        dispatcher.register(MESSAGE, self._handle_file_read_result)
+        dispatcher.register(MESSAGE, self._handle_message_tool_details)
+        dispatcher.register(MESSAGE, self._handle_tracker_message)
+        dispatcher.register(MESSAGE, self._handle_message_boundary)
+        
+        # 工具执行结果事件
+        dispatcher.register(TOOL_RESULT, self._handle_tool_result_event)
+        
+        # 直接的工具使用chunk
+        dispatcher.register(TOOL_USE, self._handle_direct_tool_use)
     
     async def process_stream(self, message: str) -> AsyncGenerator[str, None]:
         """
@@ -30,65 +97,93 @@ class StreamingProcessor:
         
         参数:
             message: 用户输入消息
-            
+        
         生成:
             包含响应块的JSON字符串
         """
+        frames = self.process_frames(message)
+        try:
+            async for frame in frames:
+                yield frame.to_json()
+        finally:
+            # 提前关闭时确保上游生成器也被关闭
+            await frames.aclose()
+    
+    def process_frames(self, message: str) -> AsyncGenerator[StreamFrame, None]:
+        """
+        处理消息并返回合并后的StreamFrame帧（供流式运行时按帧类别缓冲）
+        
+        参数:
+            message: 用户输入消息
+        
+        返回:
+            StreamFrame异步生成器
+        """
+        return self.coalescer.coalesce(self._generate_frames(message))
+    
+    async def _generate_frames(self, message: str) -> AsyncGenerator[StreamFrame, None]:
+        """
+        处理消息并生成未合并的流式帧
+        
+        参数:
+            message: 用户输入消息
+        
+        生成:
+            StreamFrame帧
+        """
+        timer = StreamTimer()
+        heartbeat = ToolHeartbeat()
+        status = 'error'
+        # 所有流共用同一个Agent，已有流进行时拒绝新的流（流进行时同时推迟MCP工具表的变更）
+        if not self.agent_instance.begin_stream():
+            logger.warning("已有流正在使用Agent，拒绝新的流")
+            self.metrics.record(timer.finish('rejected'))
+            yield error_frame("已有响应正在进行，请等待其完成或取消后再发送新消息")
+            return
         try:
             logger.info(f"============ 开始流式处理消息 ============")
             logger.info(f"消息内容: {message}")
             logger.info(f"Agent类型: {type(self.agent_instance.agent)}")
             logger.info(f"可用工具数量: {len(self.agent_instance._available_tools) if hasattr(self.agent_instance, '_available_tools') else 0}")
             
-            # 获取工具跟踪器
-            tool_tracker = get_tool_tracker()
-            tool_tracker.reset()
-            logger.info("工具跟踪器已重置")
-            
-            # 工具执行状态跟踪
-            tool_start_time = None
-            last_tool_progress_time = None
+            # 每个流使用独立的工具跟踪器，并发的流互不影响
+            tool_tracker = ToolTracker()
             
             start_time = asyncio.get_event_loop().time()
+            context = StreamContext(tool_tracker, start_time, timer, heartbeat)
             
             # 使用Strands Agent的流式API
             logger.info("准备调用agent.stream_async()...")
-            logger.info(f"Agent对象: {self.agent_instance.agent}")
-            logger.info(f"Agent类型: {type(self.agent_instance.agent)}")
             logger.info(f"Stream_async方法存在: {hasattr(self.agent_instance.agent, 'stream_async')}")
             
-            # 先测试agent是否正常工作
-            try:
-                logger.info("测试agent是否响应...")
-                test_response = self.agent_instance.agent("简单回答：你好")
-                logger.info(f"Agent测试响应: {test_response[:100]}...")
-            except Exception as test_error:
-                logger.error(f"Agent测试失败: {test_error}")
-                logger.error("这可能是导致流式处理异常的原因")
+            # 使用缓存的就绪状态，只有已知不健康时才等待重新探测
+            if hasattr(self.agent_instance, 'readiness'):
+                await self.agent_instance.readiness.ensure_ready()
+            timer.on_ready()
             
             chunk_count = 0
-            
-            logger.info("开始遍历流式响应...")
-            
-            # 静默启动，不显示工具系统提示
-            pass
+            # 启用事件录制时记录每个chunk，供离线重放
+            tool_trace = getattr(self.agent_instance, 'tool_trace', None)
+            event_writer = tool_trace.event_writer if tool_trace is not None else None
             
             logger.info("=== 开始进入流式处理循环 ===")
             
             try:
                 # 添加强制完成信号检测
-                chunk_count = 0
                 completed_normally = False
-                last_tool_time = asyncio.get_event_loop().time()
                 
-                async for chunk in self.agent_instance.agent.stream_async(message):
-                    chunk_count += 1
-                    current_time = asyncio.get_event_loop().time()
+                heartbeat.start()
+                async for chunk in heartbeat.merge(self.agent_instance.agent.stream_async(message)):
+                    if isinstance(chunk, StreamFrame):
+                        # 心跳产生的工具进度帧
+                        yield chunk
+                        continue
                     
-                    logger.info(f"========== Chunk #{chunk_count} ==========")
-                    logger.info(f"耗时: {current_time - start_time:.1f}s")
-                    logger.info(f"Chunk类型: {type(chunk)}")
-                    logger.info(f"Chunk内容: {str(chunk)[:500]}...")
+                    received_at = timer.on_chunk(isinstance(chunk, dict) and 'event' in chunk)
+                    if event_writer is not None:
+                        event_writer.write(chunk)
+                    context.chunk_count += 1
+                    chunk_count = context.chunk_count
                     
                     # 立即检查是否是空的或无效的chunk
                     if chunk is None:
@@ -99,173 +194,22 @@ class StreamingProcessor:
                         logger.warning(f"收到空chunk #{chunk_count}")
                         continue
                     
-                    # 检查chunk中是否包含工具信息并记录详细日志
-                    if isinstance(chunk, dict):
-                        self._log_chunk_details(chunk, chunk_count)
-                        
-                        # 专门检查file_read工具调用
-                        file_read_msg = self._check_file_read_tool(chunk, chunk_count)
-                        if file_read_msg:
-                            yield json.dumps({
-                                "type": "chunk",
-                                "content": file_read_msg,
-                                "done": False
-                            }, ensure_ascii=False)
-                        
-                        # 强制检查所有可能的工具调用格式并输出到聊天
-                        tool_msg = self._force_check_tool_calls(chunk, chunk_count)
-                        if tool_msg:
-                            yield json.dumps({
-                                "type": "chunk",
-                                "content": tool_msg,
-                                "done": False
-                            }, ensure_ascii=False)
-                
-                    # 提取工具调用信息
-                    tool_info_generated = False
-                    if isinstance(chunk, dict):
-                        # 检查事件字段
-                        if 'event' in chunk:
-                            tool_info = tool_tracker.process_event(chunk['event'])
-                            if tool_info:
-                                logger.info(f"生成工具信息: {tool_info}")
-                                yield json.dumps({
-                                    "type": "chunk",
-                                    "content": tool_info,
-                                    "done": False
-                                }, ensure_ascii=False)
-                                tool_info_generated = True
-                        
-                        # 也检查是否直接包含工具相关信息
-                        if any(key in chunk for key in ['contentBlockStart', 'contentBlockDelta', 'contentBlockStop', 'message']):
-                            tool_info = tool_tracker.process_event(chunk)
-                            if tool_info:
-                                logger.info(f"生成工具信息: {tool_info}")
-                                yield json.dumps({
-                                    "type": "chunk",
-                                    "content": tool_info,
-                                    "done": False
-                                }, ensure_ascii=False)
-                                tool_info_generated = True
-                        
-                        # 检查是否有工具使用但未被上面的逻辑捕获
-                        if 'type' in chunk and chunk['type'] == 'tool_use':
-                            tool_name = chunk.get('name', '未知工具')
-                            tool_input = chunk.get('input', {})
-                            logger.info(f"检测到工具使用: {tool_name}")
-                            
-                            # 更新工具执行时间
-                            last_tool_time = current_time
-                            
-                            # 特别监控shell工具
-                            if 'shell' in tool_name.lower():
-                                command = tool_input.get('command', '')
-                                logger.info(f"💻 [SHELL_MONITOR] 检测到shell工具调用: {command}")
-                                yield json.dumps({
-                                    "type": "chunk", 
-                                    "content": f"\n<details>\n<summary>Shell工具执行 - {tool_name}</summary>\n\n**命令**: `{command}`\n\n⏳ 正在执行shell命令...\n</details>\n",
-                                    "done": False
-                                }, ensure_ascii=False)
-                            elif 'file_read' in tool_name.lower():
-                                file_path = tool_input.get('path', tool_input.get('file_path', ''))
-                                logger.info(f"📖 [FILE_READ_MONITOR] 检测到file_read工具调用: {file_path}")
-                                if file_path == '.':
-                                    logger.warning(f"⚠️ [FILE_READ_MONITOR] 警告：尝试读取当前目录，这可能导致卡死！")
-                                    yield json.dumps({
-                                        "type": "chunk", 
-                                        "content": f"\n<details>\n<summary>安全提示 - 文件读取操作</summary>\n\n**工具**: {tool_name}  \n**路径**: `{file_path}`  \n\n⚠️ **注意**: 检测到尝试读取目录，建议使用shell工具进行目录浏览\n</details>\n",
-                                        "done": False
-                                    }, ensure_ascii=False)
-                                else:
-                                    yield json.dumps({
-                                        "type": "chunk", 
-                                        "content": f"\n<details>\n<summary>文件读取 - {tool_name}</summary>\n\n**文件路径**: `{file_path}`\n\n⏳ 正在读取文件...\n</details>\n",
-                                        "done": False
-                                    }, ensure_ascii=False)
-                            else:
-                                # 生成工具图标
-                                tool_icon = self._get_tool_icon(tool_name)
-                                
-                                # 格式化输入参数
-                                formatted_input = json.dumps(tool_input, ensure_ascii=False, indent=2)
-                                # 增加截断长度限制，避免过度截断
-                                if len(formatted_input) > 1000:
-                                    formatted_input = formatted_input[:1000] + "...\n}"
-                                
-                                yield json.dumps({
-                                    "type": "chunk", 
-                                    "content": f"\n<details>\n<summary>工具执行 - {tool_name}</summary>\n\n**输入参数**:\n```json\n{formatted_input}\n```\n\n⏳ 正在执行...\n</details>\n",
-                                    "done": False
-                                }, ensure_ascii=False)
-                            tool_info_generated = True
-                    
-                    # 然后提取常规文本内容
-                    text_content = self._extract_text_from_chunk(chunk)
-                    
-                    if text_content:
-                        logger.debug(f"提取文本内容: {text_content}")
-                        yield json.dumps({
-                            "type": "chunk",
-                            "content": text_content,
-                            "done": False
-                        }, ensure_ascii=False)
-                    elif not tool_info_generated:
-                        # 如果既没有工具信息也没有文本内容，检查是否需要显示进度
-                        if tool_tracker.current_tool:
-                            # 检查工具是否执行时间过长
-                            if tool_start_time is None:
-                                tool_start_time = current_time
-                                last_tool_progress_time = current_time
-                            
-                            # 每15秒显示一次进度
-                            if current_time - last_tool_progress_time >= 15:
-                                elapsed = current_time - tool_start_time
-                                progress_msg = f"   ⏳ {tool_tracker.current_tool} 仍在执行中... (已执行 {elapsed:.1f}秒，处理了 {chunk_count} 个数据块)"
-                                yield json.dumps({
-                                    "type": "chunk",
-                                    "content": progress_msg,
-                                    "done": False
-                                }, ensure_ascii=False)
-                                last_tool_progress_time = current_time
-                                
-                                # 如果工具执行超过60秒，发出警告
-                                if elapsed > 60:
-                                    warning_msg = f"   ⚠️ 警告: {tool_tracker.current_tool} 执行时间已超过60秒，可能需要重新启动"
-                                    yield json.dumps({
-                                        "type": "chunk",
-                                        "content": warning_msg,
-                                        "done": False
-                                    }, ensure_ascii=False)
-                        else:
-                            # 检查工具是否执行过长时间
-                            time_since_last_tool = current_time - last_tool_time
-                            if time_since_last_tool > 30:  # 30秒无工具活动
-                                logger.warning(f"⚠️ [TOOL_TIMEOUT] 工具执行超过30秒无响应，可能卡死")
-                                yield json.dumps({
-                                    "type": "chunk",
-                                    "content": f"\n<details>\n<summary>执行状态 - 工具超时提醒</summary>\n\n**状态**: 已超过30秒无响应  \n**可能原因**: 工具处理大文件或遇到问题  \n**建议**: 如持续无响应可停止执行\n</details>\n",
-                                    "done": False
-                                }, ensure_ascii=False)
-                                last_tool_time = current_time  # 重置以避免重复警告
-                            
-                            # 工具执行完成，重置时间
-                            tool_start_time = None
-                            last_tool_progress_time = None
-                            # 静默跳过
-                            logger.debug(f"跳过无内容chunk: {str(chunk)[:100]}")
-                            pass
+                    frames = self.process_chunk(chunk, context)
+                    timer.on_processed(received_at)
+                    for frame in frames:
+                        if frame.kind == FRAME_TEXT:
+                            timer.on_text()
+                        yield frame
+                    timer.resume()
                 
                 # 检查是否真的有内容输出
                 if chunk_count <= 0:
                     logger.warning("=== 警告：没有收到任何有效chunk！ ===")
-                    yield json.dumps({
-                        "type": "chunk",
-                        "content": "\n⚠️ **警告**：没有收到Agent的响应内容，可能存在问题\n",
-                        "done": False
-                    }, ensure_ascii=False)
+                    yield status_frame("\n⚠️ **警告**：没有收到Agent的响应内容，可能存在问题\n")
                 
                 # 标记正常完成
                 completed_normally = True
+                status = 'complete'
                 
                 # 信号完成
                 total_time = asyncio.get_event_loop().time() - start_time
@@ -273,22 +217,14 @@ class StreamingProcessor:
                 logger.info(f"总共处理了 {chunk_count} 个chunk，耗时 {total_time:.1f}秒")
                 
                 # 检查是否有工具还在执行中
-                if tool_tracker.current_tool:
-                    logger.warning(f"工具 {tool_tracker.current_tool} 可能仍在执行中")
-                    yield json.dumps({
-                        "type": "chunk",
-                        "content": f"\n⚠️ 工具 {tool_tracker.current_tool} 可能仍在执行中或已完成但未收到结果\n",
-                        "done": False
-                    }, ensure_ascii=False)
+                for call in tool_tracker.in_flight():
+                    logger.warning(f"工具 {call.name} ({call.tool_use_id}) 可能仍在执行中")
+                    yield tool_frame(f"\n⚠️ 工具 {call.name} 可能仍在执行中或已完成但未收到结果\n")
                 
                 # 强制发送完成信号
                 logger.info("=== 强制发送完成信号 ===")
-                yield json.dumps({
-                    "type": "complete",
-                    "content": "",
-                    "done": True
-                }, ensure_ascii=False)
-                
+                yield complete_frame()
+            
             except Exception as stream_error:
                 logger.error(f"流式循环异常: {stream_error}")
                 logger.error(f"流式异常类型: {type(stream_error).__name__}")
@@ -304,31 +240,31 @@ class StreamingProcessor:
                 error_message += full_traceback
                 error_message += "```\n"
                 
-                yield json.dumps({
-                    "type": "chunk",
-                    "content": error_message,
-                    "done": False
-                }, ensure_ascii=False)
-                
-                yield json.dumps({
-                    "type": "error",
-                    "error": f"流式循环错误: {str(stream_error)}",
-                    "done": True
-                }, ensure_ascii=False)
+                yield status_frame(error_message)
+                yield error_frame(f"流式循环错误: {str(stream_error)}")
                 return
             
             # 如果没有正常完成，强制发送完成信号
             if not completed_normally:
                 logger.warning("=== 流式处理未正常完成，强制发送完成信号 ===")
-                yield json.dumps({
-                    "type": "complete",
-                    "content": "",
-                    "done": True
-                }, ensure_ascii=False)
-                
+                yield complete_frame()
+            
             # 流式正常结束
             logger.info(f"流式响应正常结束，共处理{chunk_count}个chunk")
-            
+        
+        except asyncio.CancelledError:
+            # 取消时stream_async已经展开，补齐对话历史后继续传递取消
+            logger.info("🛑 流式处理已取消")
+            status = 'cancelled'
+            if 'context' in locals():
+                self.agent_instance.repair_history_after_cancel(''.join(context.text_parts))
+            raise
+        
+        except GeneratorExit:
+            # 下游提前关闭了生成器
+            status = 'closed'
+            raise
+        
         except Exception as e:
             logger.error(f"========== 流式处理顶层异常 ==========")
             logger.error(f"异常类型: {type(e).__name__}")
@@ -349,282 +285,174 @@ class StreamingProcessor:
             error_message += "```\n"
             
             # 先发送错误信息作为聊天内容
-            yield json.dumps({
-                "type": "chunk",
-                "content": error_message,
-                "done": False
-            }, ensure_ascii=False)
+            yield status_frame(error_message)
             
             # 确保即使出错也发送完成信号
-            yield json.dumps({
-                "type": "error",
-                "error": f"流式处理错误 ({type(e).__name__}): {str(e)}",
-                "done": True
-            }, ensure_ascii=False)
+            yield error_frame(f"流式处理错误 ({type(e).__name__}): {str(e)}")
         finally:
-            # 清理工具跟踪器状态
-            try:
-                tool_tracker = get_tool_tracker()
-                tool_tracker.reset()
-                logger.info("工具跟踪器状态已重置")
-            except Exception as cleanup_error:
-                logger.warning(f"清理工具跟踪器时出错: {cleanup_error}")
-            
-            # 清理MCP客户端连接和文件描述符
-            try:
-                if hasattr(self.agent_instance, 'mcp_manager'):
-                    self.agent_instance.mcp_manager.cleanup()
-                    
-                # 强制垃圾回收以清理未关闭的资源
-                import gc
-                gc.collect()
-                
-            except Exception as cleanup_error:
-                logger.warning(f"清理MCP资源时出错: {cleanup_error}")
+            await heartbeat.stop()
+            self.agent_instance.end_stream()
+            self.metrics.record(timer.finish(status))
+            # MCP会话由MCPManager持有并跨消息复用，这里不再关闭
     
-    def _log_chunk_details(self, chunk, chunk_count):
-        """记录chunk的详细信息，特别是工具调用相关的信息"""
-        try:
-            if 'type' in chunk:
-                logger.info(f"Chunk #{chunk_count} 类型: {chunk['type']}")
-            
-            if 'event' in chunk:
-                event = chunk['event']
-                if isinstance(event, dict):
-                    if 'contentBlockStart' in event:
-                        content_block = event['contentBlockStart'].get('contentBlock', {})
-                        if content_block.get('type') == 'tool_use':
-                            tool_name = content_block.get('name', '未知')
-                            logger.info(f"🔧 工具调用开始: {tool_name}")
-                            # 专门为file_read工具记录详细日志
-                            if 'file_read' in tool_name:
-                                logger.info(f"📖 [FILE_READ] 工具开始执行")
-                    elif 'contentBlockDelta' in event:
-                        logger.info(f"📋 工具参数更新中...")
-                    elif 'contentBlockStop' in event:
-                        logger.info(f"⏳ 工具调用准备完成")
-                    elif 'message' in event:
-                        logger.info(f"📥 收到消息事件")
-            
-            if any(key in chunk for key in ['contentBlockStart', 'contentBlockDelta', 'contentBlockStop', 'message']):
-                logger.info(f"Chunk #{chunk_count} 包含工具相关信息")
-        except Exception as e:
-            logger.warning(f"记录chunk详情时出错: {e}")
+    def process_chunk(self, chunk: Any, context: StreamContext) -> List[StreamFrame]:
+        """
+        对单个chunk只分类一次，再交给已注册的处理器
+        
+        参数:
+            chunk: agent.stream_async产生的chunk
+            context: 当前流的状态
+        
+        返回:
+            需要发送给Unity的帧列表
+        """
+        context.current_time = asyncio.get_event_loop().time()
+        item = classify_chunk(chunk)
+        
+        # 工具耗时：模型开始输出调用块 -> 完整消息到达开始执行 -> 收到结果
+        if item.kind == TOOL_USE_START:
+            context.timer.tool_requested(item.payload['toolUseId'], item.payload['name'])
+        elif item.kind == MESSAGE:
+            for block in iter_message_tool_blocks(item.payload):
+                if block[0] == 'tool_use':
+                    context.timer.tool_started(block[1], block[2])
+                    context.heartbeat.tool_started(block[1], block[2])
+                else:
+                    context.timer.tool_finished(block[1])
+                    context.heartbeat.tool_finished(block[1])
+        elif item.kind == TOOL_RESULT and isinstance(item.payload, dict):
+            context.timer.tool_finished(item.payload.get('toolUseId', ''))
+            context.heartbeat.tool_finished(item.payload.get('toolUseId', ''))
+        elif item.kind == TOOL_STREAM and isinstance(item.payload, dict):
+            tool_use = item.payload.get('tool_use') or {}
+            context.heartbeat.add_output(tool_use.get('toolUseId', ''), item.payload.get('data'))
+        
+        if item.kind != TEXT_DELTA and item.kind != IGNORED:
+            logger.debug("Chunk #%d 类型: %s", context.chunk_count, item.kind)
+        
+        return self.dispatcher.dispatch_classified(item, context)
     
-    def _check_file_read_tool(self, chunk, chunk_count):
-        """专门检查file_read工具的调用和结果"""
-        try:
-            # 检查工具调用开始
-            if 'event' in chunk:
-                event = chunk['event']
-                if isinstance(event, dict):
-                    if 'contentBlockStart' in event:
-                        content_block = event['contentBlockStart'].get('contentBlock', {})
-                        if content_block.get('type') == 'tool_use':
-                            tool_name = content_block.get('name', '')
-                            if 'file_read' in tool_name:
-                                logger.info(f"📖 [FILE_READ] 检测到file_read工具调用开始 (Chunk #{chunk_count})")
-                                return f"\n📖 **[FILE_READ]** 工具调用开始 (Chunk #{chunk_count})\n   🔍 准备读取文件..."
-                    
-                    elif 'contentBlockDelta' in event:
-                        delta = event['contentBlockDelta']
-                        if 'delta' in delta and 'input' in delta['delta']:
-                            input_data = delta['delta']['input']
-                            if 'path' in input_data or 'file_path' in input_data:
-                                file_path = input_data.get('path') or input_data.get('file_path')
-                                logger.info(f"📖 [FILE_READ] 检测到文件路径参数: {file_path}")
-                                return f"   📂 **[FILE_READ]** 目标文件: {file_path}"
-                    
-                    elif 'contentBlockStop' in event:
-                        # 检查当前是否是file_read工具
-                        tool_tracker = get_tool_tracker()
-                        if tool_tracker.current_tool and 'file_read' in tool_tracker.current_tool:
-                            logger.info(f"📖 [FILE_READ] 工具参数准备完成，开始执行文件读取...")
-                            return f"   ⏳ **[FILE_READ]** 参数准备完成，开始读取文件..."
-            
-            # 检查工具执行结果
-            if 'message' in chunk:
-                message = chunk['message']
-                if 'content' in message:
-                    for content in message['content']:
-                        if content.get('type') == 'tool_result':
-                            # 检查是否是file_read的结果
-                            result = content.get('content', [])
-                            if result and isinstance(result, list) and len(result) > 0:
-                                result_text = result[0].get('text', '')
-                                # 简单检查是否可能是文件内容
-                                if len(result_text) > 100:  # 假设文件内容较长
-                                    logger.info(f"📖 [FILE_READ] 检测到可能的文件读取结果，长度: {len(result_text)}字符")
-                                    lines = result_text.split('\n')
-                                    return f"   ✅ **[FILE_READ]** 文件读取完成\n   📄 文件大小: {len(result_text)}字符，{len(lines)}行\n   📝 内容预览: {result_text[:100]}..."
-            
-            return None
-        except Exception as e:
-            logger.warning(f"检查file_read工具时出错: {e}")
-            return None
-
-    def _force_check_tool_calls(self, chunk, chunk_count):
-        """强制检查chunk中的工具调用信息，返回要输出到聊天的消息"""
-        try:
-            # 检查所有可能包含工具信息的字段
-            found_tool_info = False
-            detected_pattern = None
-            
-            # 检查各种可能的工具调用格式
-            tool_patterns = [
-                'tool_use', 'tool_call', 'function_call', 'action',
-                'contentBlockStart', 'contentBlockDelta', 'contentBlockStop',
-                'message', 'tool_result', 'input', 'output'
-            ]
-            
-            for pattern in tool_patterns:
-                if pattern in chunk:
-                    logger.info(f"🔍 在chunk #{chunk_count}中发现工具相关字段: {pattern}")
-                    found_tool_info = True
-                    detected_pattern = pattern
-                    break
-            
-            # 如果发现工具信息，返回要输出到聊天的消息
-            if found_tool_info:
-                # 更详细地解析工具信息
-                tool_details = self._parse_tool_details(chunk, detected_pattern)
-                tool_msg = f"\n<details>\n<summary>🔧 工具调用</summary>\n\n{tool_details}\n</details>\n"
-                logger.info(f"强制输出工具信息: {tool_msg}")
-                return tool_msg
-                
-            return None
-        except Exception as e:
-            logger.warning(f"强制检查工具调用时出错: {e}")
+    def _handle_text(self, item, context):
+        """输出正文文本"""
+        context.text_parts.append(item.payload)
+        return item.payload
+    
+    def _handle_message_boundary(self, item, context):
+        """完整消息已写入对话历史，清空当前消息的正文记录"""
+        context.text_parts = []
+        return None
+    
+    def _handle_tracker_start(self, item, context):
+        """工具跟踪器：工具调用开始"""
+        tool_name = item.payload['name']
+        logger.info(f"🔧 工具调用开始: {tool_name}")
+        return context.tool_tracker.on_tool_start(tool_name, item.payload['toolUseId'], item.index)
+    
+    def _handle_tracker_input(self, item, context):
+        """工具跟踪器：工具参数"""
+        return context.tool_tracker.on_tool_input(item.payload, item.index)
+    
+    def _handle_tracker_stop(self, item, context):
+        """工具跟踪器：参数准备完成"""
+        return context.tool_tracker.on_block_stop(item.index)
+    
+    def _handle_tracker_message(self, item, context):
+        """工具跟踪器：消息中的工具结果"""
+        return context.tool_tracker.on_message(item.payload, chunk_tool_results(item))
+    
+    def _handle_file_read_start(self, item, context):
+        """专门检查file_read工具的调用开始"""
+        if 'file_read' in item.payload['name']:
+            logger.info(f"📖 [FILE_READ] 检测到file_read工具调用开始 (Chunk #{context.chunk_count})")
+            return f"\n📖 **[FILE_READ]** 工具调用开始 (Chunk #{context.chunk_count})\n   🔍 准备读取文件..."
+        return None
+    
+    def _handle_file_read_input(self, item, context):
+        """专门检查file_read工具的目标文件参数"""
+        call = context.tool_tracker.call_for_index(item.index)
+        if call is None or 'file_read' not in call.name:
             return None
-
-    def _parse_tool_details(self, chunk, pattern):
-        """解析工具详情"""
-        try:
-            if pattern == 'message' and 'message' in chunk:
-                message = chunk['message']
-                if 'content' in message:
-                    content = message['content']
-                    for item in content:
-                        if isinstance(item, dict):
-                            if item.get('type') == 'tool_use':
-                                tool_name = item.get('name', '未知工具')
-                                tool_input = item.get('input', {})
-                                # 格式化工具输入，支持更长的内容显示
-                                formatted_input = json.dumps(tool_input, ensure_ascii=False, indent=2)
-                                if len(formatted_input) > 800:
-                                    formatted_input = formatted_input[:800] + "..."
-                                return f"   🔧 工具: {tool_name}\n   📋 输入:\n```json\n{formatted_input}\n```"
-                            elif item.get('type') == 'tool_result':
-                                result = item.get('content', [])
-                                if result:
-                                    result_text = result[0].get('text', '无结果') if isinstance(result, list) else str(result)
-                                    # 显示更多工具结果内容
-                                    if len(result_text) > 500:
-                                        result_text = result_text[:500] + "..."
-                                    return f"   ✅ 工具结果: {result_text}"
-            elif 'toolUse' in chunk:
-                tool_info = chunk['toolUse']
-                tool_name = tool_info.get('name', '未知工具')
-                tool_input = tool_info.get('input', {})
+        for key, value in call.new_fields:
+            if key == 'path' or key == 'file_path':
+                logger.info(f"📖 [FILE_READ] 检测到文件路径参数: {value}")
+                return f"   📂 **[FILE_READ]** 目标文件: {value}"
+        return None
+    
+    def _handle_file_read_stop(self, item, context):
+        """专门检查file_read工具的参数准备完成"""
+        call = context.tool_tracker.call_for_index(item.index)
+        if call is not None and 'file_read' in call.name:
+            logger.info(f"📖 [FILE_READ] 工具参数准备完成，开始执行文件读取...")
+            return f"   ⏳ **[FILE_READ]** 参数准备完成，开始读取文件..."
+        return None
+    
+    def _handle_file_read_result(self, item, context):
+        """专门检查file_read工具的结果"""
+        for view in chunk_tool_results(item):
+            # 简单检查是否可能是文件内容
+            if view.size > 100:  # 假设文件内容较长
+                logger.info(f"📖 [FILE_READ] 检测到可能的文件读取结果，长度: {view.size}字符")
+                return f"   ✅ **[FILE_READ]** 文件读取完成\n   📄 文件大小: {view.size}字符，{view.line_count}行\n   📝 内容预览: {view.head(100)}..."
+        return None
+    
+    def _handle_message_tool_details(self, item, context):
+        """输出消息中工具使用或工具结果的详情"""
+        for block_type, _tool_id, name_or_content, input_or_status in iter_message_tool_blocks(item.payload):
+            if block_type == 'tool_use':
+                # 更新工具执行时间
+                context.last_tool_time = context.current_time
                 # 格式化工具输入，支持更长的内容显示
-                formatted_input = json.dumps(tool_input, ensure_ascii=False, indent=2)
+                formatted_input = json.dumps(input_or_status, ensure_ascii=False, indent=2)
                 if len(formatted_input) > 800:
                     formatted_input = formatted_input[:800] + "..."
-                return f"   🔧 工具: {tool_name}\n   📋 输入:\n```json\n{formatted_input}\n```"
-            
-            # 显示更多原始数据内容
-            chunk_str = str(chunk)
-            if len(chunk_str) > 800:
-                chunk_str = chunk_str[:800] + "..."
-            return f"   📋 原始数据: {chunk_str}"
-        except Exception as e:
-            return f"   ❌ 解析错误: {str(e)}"
-
-    def _extract_text_from_chunk(self, chunk):
-        """从chunk中提取纯文本内容，过滤掉元数据，但保留工具调用信息"""
-        try:
-            # 如果是字符串，直接返回
-            if isinstance(chunk, str):
-                return chunk
-            
-            # 如果是字节，解码
-            if isinstance(chunk, bytes):
-                return chunk.decode('utf-8')
-            
-            # 如果是字典，尝试提取文本和工具信息
-            if isinstance(chunk, dict):
-                # 跳过元数据事件
-                if any(key in chunk for key in ['init_event_loop', 'start', 'start_event_loop']):
-                    return None
-                
-                # 检测工具调用事件
-                if 'event' in chunk:
-                    event = chunk['event']
-                    
-                    # 工具调用信息已由tool_tracker处理，这里不重复处理
-                    if 'contentBlockStart' in event:
-                        return None
-                    
-                    # 检测工具使用结束
-                    if 'contentBlockStop' in event:
-                        # 可以添加工具完成标记
-                        return None
-                    
-                    # 提取常规文本内容
-                    if 'contentBlockDelta' in event:
-                        delta = event['contentBlockDelta']
-                        if 'delta' in delta and 'text' in delta['delta']:
-                            return delta['delta']['text']
-                    
-                    # 跳过其他事件类型
-                    return None
-                
-                # 检测工具执行结果
-                if 'tool_result' in chunk:
-                    tool_result = chunk['tool_result']
-                    tool_name = tool_result.get('tool_name', '未知工具')
-                    success = tool_result.get('success', False)
-                    if success:
-                        return f"✅ **工具 {tool_name} 执行成功**\n"
-                    else:
-                        return f"❌ **工具 {tool_name} 执行失败**\n"
-                
-                # 跳过包含复杂元数据的响应
-                if any(key in chunk for key in ['agent', 'event_loop_metrics', 'traces', 'spans']):
-                    return None
-                
-                # 如果有text字段，提取它
-                if 'text' in chunk:
-                    return chunk['text']
-                
-                # 如果有content字段，提取它
-                if 'content' in chunk:
-                    return chunk['content']
-            
-            # 其他情况返回None，过滤掉
-            return None
-            
-        except Exception as e:
-            logger.warning(f"提取chunk文本时出错: {e}")
+                tool_details = f"   🔧 工具: {name_or_content}\n   📋 输入:\n```json\n{formatted_input}\n```"
+            else:
+                # 显示更多工具结果内容
+                views = chunk_tool_results(item)
+                result_text = views[0].preview(500) if views else first_text(name_or_content, '无结果')
+                tool_details = f"   ✅ 工具结果: {result_text}"
+            return f"\n<details>\n<summary>🔧 工具调用</summary>\n\n{tool_details}\n</details>\n"
+        return None
+    
+    def _handle_tool_result_event(self, item, context):
+        """工具执行结果事件"""
+        tool_result = item.payload
+        if not isinstance(tool_result, dict):
             return None
+        call = context.tool_tracker.get_call(tool_result.get('toolUseId', ''))
+        tool_name = tool_result.get('tool_name') or (call.name if call else None) or context.tool_tracker.current_tool or '未知工具'
+        success = tool_result.get('success', tool_result.get('status') == 'success')
+        if success:
+            return f"✅ **工具 {tool_name} 执行成功**\n"
+        else:
+            return f"❌ **工具 {tool_name} 执行失败**\n"
     
-    def _get_tool_icon(self, tool_name):
-        """根据工具名称获取对应的图标"""
-        tool_name_lower = tool_name.lower()
+    def _handle_direct_tool_use(self, item, context):
+        """检查是否有工具使用但未被contentBlock事件捕获"""
+        chunk = item.payload
+        tool_name = chunk.get('name', '未知工具')
+        tool_input = chunk.get('input', {})
+        logger.info(f"检测到工具使用: {tool_name}")
         
-        if 'python' in tool_name_lower:
-            return "🐍"
-        elif 'calculator' in tool_name_lower:
-            return "🧮"
-        elif 'memory' in tool_name_lower:
-            return "🧠"
-        elif 'http' in tool_name_lower:
-            return "🌐"
-        elif 'time' in tool_name_lower:
-            return "⏰"
-        elif 'write' in tool_name_lower:
-            return "✏️"
-        elif 'editor' in tool_name_lower:
-            return "📝"
-        else:
-            return "🔧"
\ No newline at end of file
+        # 更新工具执行时间
+        context.last_tool_time = context.current_time
+        
+        # 特别监控shell工具
+        if 'shell' in tool_name.lower():
+            command = tool_input.get('command', '')
+            logger.info(f"💻 [SHELL_MONITOR] 检测到shell工具调用: {command}")
+            return f"\n<details>\n<summary>Shell工具执行 - {tool_name}</summary>\n\n**命令**: `{command}`\n\n⏳ 正在执行shell命令...\n</details>\n"
+        elif 'file_read' in tool_name.lower():
+            file_path = tool_input.get('path', tool_input.get('file_path', ''))
+            logger.info(f"📖 [FILE_READ_MONITOR] 检测到file_read工具调用: {file_path}")
+            if file_path == '.':
+                logger.warning(f"⚠️ [FILE_READ_MONITOR] 警告：尝试读取当前目录，这可能导致卡死！")
+                return f"\n<details>\n<summary>安全提示 - 文件读取操作</summary>\n\n**工具**: {tool_name}  \n**路径**: `{file_path}`  \n\n⚠️ **注意**: 检测到尝试读取目录，建议使用shell工具进行目录浏览\n</details>\n"
+            return f"\n<details>\n<summary>文件读取 - {tool_name}</summary>\n\n**文件路径**: `{file_path}`\n\n⏳ 正在读取文件...\n</details>\n"
+        
+        # 格式化输入参数
+        formatted_input = json.dumps(tool_input, ensure_ascii=False, indent=2)
+        # 增加截断长度限制，避免过度截断
+        if len(formatted_input) > 1000:
+            formatted_input = formatted_input[:1000] + "...\n}"
+        return f"\n<details>\n<summary>工具执行 - {tool_name}</summary>\n\n**输入参数**:\n```json\n{formatted_input}\n```\n\n⏳ 正在执行...\n</details>\n"
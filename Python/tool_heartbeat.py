@@ -0,0 +1,193 @@
+"""
+工具执行心跳
+长时间运行的工具执行期间Strands流没有任何chunk，进度提示不能依赖chunk到达。
+心跳协程与流消费并行运行，按固定间隔为每个执行中的工具发布进度帧；
+没有工具执行时协程挂起等待，不产生任何开销
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+from stream_frames import StreamFrame, progress_frame, status_frame
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 心跳间隔（秒）
+DEFAULT_INTERVAL_SECONDS = float(os.environ.get('UNITY_AGENT_HEARTBEAT_SECONDS', '5'))
+# 工具没有任何输出超过该时间时提醒一次
+STALL_SECONDS = 30
+# 工具执行超过该时间时警告一次
+WARN_SECONDS = 60
+
+
+class _ToolProgress:
+    """单个执行中工具的进度"""
+    
+    __slots__ = ('name', 'started', 'last_output', 'output_bytes', 'stall_reported', 'warned')
+    
+    def __init__(self, name: str, now: float):
+        self.name = name
+        self.started = now
+        self.last_output = now
+        self.output_bytes = 0
+        self.stall_reported = False
+        self.warned = False
+
+
+class ToolHeartbeat:
+    """单个流的工具心跳"""
+    
+    def __init__(self, interval: float = DEFAULT_INTERVAL_SECONDS):
+        """
+        参数:
+            interval: 发布进度帧的间隔（秒）
+        """
+        self.interval = max(0.1, interval)
+        self._tools: Dict[str, _ToolProgress] = {}
+        self._active = asyncio.Event()
+        self._frames: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.beats = 0
+    
+    @property
+    def active(self) -> bool:
+        """是否有工具正在执行"""
+        return bool(self._tools)
+    
+    def tool_started(self, tool_use_id: str, name: str):
+        """工具开始执行"""
+        if not tool_use_id or tool_use_id in self._tools:
+            return
+        self._tools[tool_use_id] = _ToolProgress(name, asyncio.get_running_loop().time())
+        self._active.set()
+    
+    def add_output(self, tool_use_id: str, data: Any):
+        """记录工具执行过程中产出的数据"""
+        progress = self._tools.get(tool_use_id)
+        if progress is None or data is None:
+            return
+        if isinstance(data, bytes):
+            size = len(data)
+        elif isinstance(data, str):
+            size = len(data.encode('utf-8'))
+        else:
+            size = len(str(data))
+        progress.output_bytes += size
+        progress.last_output = asyncio.get_running_loop().time()
+    
+    def tool_finished(self, tool_use_id: str):
+        """工具执行结束"""
+        self._tools.pop(tool_use_id, None)
+    
+    def start(self):
+        """在当前事件循环上启动心跳协程"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """停止心跳协程"""
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._tools:
+                # 没有工具执行时挂起，直到有工具开始
+                self._active.clear()
+                await self._active.wait()
+            await asyncio.sleep(self.interval)
+            if not self._tools:
+                continue
+            self.beats += 1
+            for frame in self._progress_frames(loop.time()):
+                self._frames.put_nowait(frame)
+    
+    def _progress_frames(self, now: float) -> List[StreamFrame]:
+        """为每个执行中的工具生成进度帧"""
+        frames = []
+        for tool_use_id, progress in list(self._tools.items()):
+            elapsed = now - progress.started
+            frames.append(progress_frame(
+                f"   ⏳ {progress.name} 仍在执行中... (已执行 {elapsed:.1f}秒，已输出 {progress.output_bytes} 字节)",
+                tool_use_id
+            ))
+            
+            if not progress.stall_reported and now - progress.last_output > STALL_SECONDS:
+                logger.warning(f"⚠️ [TOOL_TIMEOUT] 工具 {progress.name} 超过{STALL_SECONDS}秒没有输出，可能卡死")
+                progress.stall_reported = True
+                frames.append(status_frame(
+                    f"\n<details>\n<summary>执行状态 - 工具超时提醒</summary>\n\n**状态**: {progress.name} 已超过{STALL_SECONDS}秒无响应  \n**可能原因**: 工具处理大文件或遇到问题  \n**建议**: 如持续无响应可停止执行\n</details>\n"
+                ))
+            
+            if not progress.warned and elapsed > WARN_SECONDS:
+                progress.warned = True
+                frames.append(status_frame(
+                    f"   ⚠️ 警告: {progress.name} 执行时间已超过{WARN_SECONDS}秒，可能需要重新启动"
+                ))
+        return frames
+    
+    async def merge(self, chunks: AsyncIterator[Any]) -> AsyncGenerator[Any, None]:
+        """
+        将心跳帧并入chunk流：有工具执行时同时等待下一个chunk和心跳帧，
+        否则直接等待下一个chunk
+        
+        参数:
+            chunks: agent.stream_async产生的chunk流
+        
+        生成:
+            原始chunk或心跳产生的StreamFrame
+        """
+        iterator = chunks.__aiter__()
+        pending = None
+        beat = None
+        try:
+            while True:
+                if pending is None:
+                    if not self._tools and self._frames.empty():
+                        if beat is not None and not beat.done():
+                            beat.cancel()
+                            beat = None
+                    if beat is None and not self._tools and self._frames.empty():
+                        try:
+                            chunk = await iterator.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        yield chunk
+                        continue
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                if beat is None:
+                    beat = asyncio.ensure_future(self._frames.get())
+                
+                done, _ = await asyncio.wait({pending, beat}, return_when=asyncio.FIRST_COMPLETED)
+                if beat in done:
+                    frame, beat = beat.result(), None
+                    yield frame
+                    continue
+                
+                task, pending = pending, None
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            if beat is not None:
+                beat.cancel()
+            if pending is not None and not pending.done():
+                # 上游仍在运行时取消，并等待其完成清理
+                pending.cancel()
+                await asyncio.wait({pending})
+                if not pending.cancelled():
+                    pending.exception()
+            else:
+                if pending is not None and not pending.cancelled():
+                    # 已取到但未消费的chunk
+                    pending.exception()
+                if hasattr(iterator, 'aclose'):
+                    await iterator.aclose()
@@ -0,0 +1,356 @@
+"""
+工具调用录制与回放
+通过Agent的工具调用钩子记录每次调用（内置strands_tools和MCP工具都经过同一路径）：
+名称、参数、结果、耗时和输出大小，追加写入紧凑的JSONL轨迹文件；
+回放模式下直接返回录制的结果而不执行任何工具，配合录制的事件流可以离线重放整个会话
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from stream_metrics import percentile
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 工具调用钩子（不同SDK版本事件名称不同）
+try:
+    from strands.hooks import BeforeToolCallEvent, AfterToolCallEvent
+    HOOKS_AVAILABLE = True
+except ImportError:
+    try:
+        from strands.experimental.hooks import (
+            BeforeToolInvocationEvent as BeforeToolCallEvent,
+            AfterToolInvocationEvent as AfterToolCallEvent
+        )
+        HOOKS_AVAILABLE = True
+    except ImportError:
+        BeforeToolCallEvent = AfterToolCallEvent = None
+        HOOKS_AVAILABLE = False
+
+try:
+    from strands.types.tools import AgentTool
+except ImportError:
+    AgentTool = object
+
+# 通过环境变量启用录制/回放
+TOOL_TRACE_ENV = 'UNITY_AGENT_TOOL_TRACE'
+EVENT_TRACE_ENV = 'UNITY_AGENT_EVENT_TRACE'
+TOOL_REPLAY_ENV = 'UNITY_AGENT_TOOL_REPLAY'
+
+
+def _unserializable(value: Any) -> str:
+    return f"<{type(value).__name__}>"
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_unserializable)
+
+
+def _input_key(name: str, tool_input: Any) -> Tuple[str, str]:
+    """按工具名称和规范化的参数匹配录制的调用"""
+    return name, json.dumps(tool_input, sort_keys=True, ensure_ascii=False, default=_unserializable)
+
+
+def result_size(result: Any) -> int:
+    """工具结果中文本内容的字节数"""
+    if not isinstance(result, dict):
+        return 0
+    size = 0
+    for block in result.get('content') or []:
+        if isinstance(block, dict):
+            text = block.get('text')
+            if isinstance(text, str):
+                size += len(text.encode('utf-8'))
+            elif 'json' in block:
+                size += len(_dumps(block['json']).encode('utf-8'))
+    return size
+
+
+class JsonlWriter:
+    """线程安全的追加写JSONL文件"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self.records = 0
+    
+    def write(self, record: Any):
+        line = _dumps(record)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.write('\n')
+            self._file.flush()
+            self.records += 1
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_jsonl(path: str) -> List[Any]:
+    """读取JSONL文件，跳过空行和写了一半的行"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"跳过无法解析的轨迹行: {line[:80]}")
+    return records
+
+
+class ToolReplayer:
+    """按名称和参数提供录制的工具结果"""
+    
+    def __init__(self, records: List[Dict[str, Any]]):
+        self._by_input: Dict[Tuple[str, str], deque] = {}
+        self._by_name: Dict[str, deque] = {}
+        for index, record in enumerate(records):
+            entry = (index, record)
+            self._by_input.setdefault(_input_key(record.get('name', ''), record.get('input')), deque()).append(entry)
+            self._by_name.setdefault(record.get('name', ''), deque()).append(entry)
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+    
+    @classmethod
+    def from_file(cls, path: str) -> 'ToolReplayer':
+        return cls(load_jsonl(path))
+    
+    def _pop(self, queue: Optional[deque]) -> Optional[Dict[str, Any]]:
+        while queue:
+            index, record = queue.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                return record
+        return None
+    
+    def take(self, name: str, tool_input: Any) -> Optional[Dict[str, Any]]:
+        """
+        取出下一条匹配的录制记录：参数完全相同的优先，否则按同名工具的录制顺序
+        
+        参数:
+            name: 工具名称
+            tool_input: 工具参数
+        
+        返回:
+            录制记录，没有匹配时返回None
+        """
+        record = self._pop(self._by_input.get(_input_key(name, tool_input)))
+        if record is None:
+            record = self._pop(self._by_name.get(name))
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+
+class ReplayTool(AgentTool):
+    """回放时替换真实工具，直接返回录制的结果"""
+    
+    def __init__(self, tool_name: str, tool_spec: Optional[Dict[str, Any]], record: Optional[Dict[str, Any]]):
+        super().__init__()
+        self._tool_name = tool_name
+        self._tool_spec = tool_spec or {"name": tool_name, "description": "", "inputSchema": {"json": {}}}
+        self._record = record
+    
+    @property
+    def tool_name(self) -> str:
+        return self._tool_name
+    
+    @property
+    def tool_spec(self):
+        return self._tool_spec
+    
+    @property
+    def tool_type(self) -> str:
+        return "replay"
+    
+    def _result(self, tool_use) -> Dict[str, Any]:
+        if self._record is None:
+            return {
+                "toolUseId": tool_use["toolUseId"],
+                "status": "error",
+                "content": [{"text": f"回放轨迹中没有工具 {self._tool_name} 的调用记录"}]
+            }
+        return {
+            "toolUseId": tool_use["toolUseId"],
+            "status": self._record.get('status', 'success'),
+            "content": self._record.get('content') or []
+        }
+    
+    async def stream(self, tool_use, invocation_state, **kwargs):
+        yield self._result(tool_use)
+    
+    def invoke(self, tool_use, *args, **kwargs):
+        return self._result(tool_use)
+
+
+class ToolTrace:
+    """
+    工具调用录制/回放钩子
+    注册到Agent后一直存在，未启用录制和回放时每次工具调用只有一次判断的开销
+    """
+    
+    def __init__(self):
+        self.tool_writer: Optional[JsonlWriter] = None
+        self.event_writer: Optional[JsonlWriter] = None
+        self.replayer: Optional[ToolReplayer] = None
+        self._started: Dict[str, float] = {}
+        self.attached = False
+    
+    def attach(self, agent) -> bool:
+        """注册到Agent的钩子系统"""
+        if not HOOKS_AVAILABLE or not hasattr(agent, 'hooks'):
+            logger.warning("当前Strands SDK不支持工具调用钩子，工具录制/回放不可用")
+            return False
+        agent.hooks.add_hook(self)
+        self.attached = True
+        return True
+    
+    def register_hooks(self, registry, **kwargs):
+        """HookProvider接口"""
+        registry.add_callback(BeforeToolCallEvent, self._before_tool_call)
+        registry.add_callback(AfterToolCallEvent, self._after_tool_call)
+    
+    def configure(self, record_path: Optional[str] = None, events_path: Optional[str] = None,
+                  replay_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        设置录制和回放，传入None的项关闭
+        
+        参数:
+            record_path: 工具调用轨迹文件
+            events_path: 流式事件轨迹文件（可用于chunk分发和流重放基准测试）
+            replay_path: 回放使用的工具调用轨迹文件
+        
+        返回:
+            当前状态
+        """
+        self.close()
+        if record_path:
+            self.tool_writer = JsonlWriter(record_path)
+        if events_path:
+            self.event_writer = JsonlWriter(events_path)
+        if replay_path:
+            self.replayer = ToolReplayer.from_file(replay_path)
+        logger.info(f"工具轨迹: 录制={record_path}, 事件={events_path}, 回放={replay_path}")
+        return self.status()
+    
+    def configure_from_env(self):
+        """根据环境变量启用录制/回放"""
+        record_path = os.environ.get(TOOL_TRACE_ENV)
+        events_path = os.environ.get(EVENT_TRACE_ENV)
+        replay_path = os.environ.get(TOOL_REPLAY_ENV)
+        if record_path or events_path or replay_path:
+            self.configure(record_path, events_path, replay_path)
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "attached": self.attached,
+            "recording": self.tool_writer.path if self.tool_writer else None,
+            "recorded_calls": self.tool_writer.records if self.tool_writer else 0,
+            "events": self.event_writer.path if self.event_writer else None,
+            "recorded_events": self.event_writer.records if self.event_writer else 0,
+            "replaying": self.replayer is not None,
+            "replay_hits": self.replayer.hits if self.replayer else 0,
+            "replay_misses": self.replayer.misses if self.replayer else 0
+        }
+    
+    def close(self):
+        """关闭录制文件并停止回放"""
+        for writer in (self.tool_writer, self.event_writer):
+            if writer is not None:
+                writer.close()
+        self.tool_writer = None
+        self.event_writer = None
+        self.replayer = None
+        self._started.clear()
+    
+    def _before_tool_call(self, event):
+        if self.tool_writer is None and self.replayer is None:
+            return
+        tool_use = event.tool_use
+        self._started[tool_use.get('toolUseId', '')] = time.perf_counter()
+        replayer = self.replayer
+        if replayer is not None:
+            name = tool_use.get('name', '')
+            record = replayer.take(name, tool_use.get('input'))
+            selected = event.selected_tool
+            spec = getattr(selected, 'tool_spec', None) if selected is not None else None
+            event.selected_tool = ReplayTool(name, spec, record)
+            if record is None:
+                logger.warning(f"回放轨迹中没有匹配的工具调用: {name}")
+    
+    def _after_tool_call(self, event):
+        writer = self.tool_writer
+        if writer is None:
+            return
+        tool_use = event.tool_use
+        tool_use_id = tool_use.get('toolUseId', '')
+        started = self._started.pop(tool_use_id, None)
+        # 新版SDK在事件上提供执行耗时，否则使用调用前记录的时间
+        duration = getattr(event, 'duration', None)
+        if not duration:
+            duration = time.perf_counter() - started if started is not None else 0.0
+        result = event.result if isinstance(event.result, dict) else {}
+        writer.write({
+            "ts": round(time.time(), 3),
+            "id": tool_use_id,
+            "name": tool_use.get('name', ''),
+            "input": tool_use.get('input'),
+            "status": result.get('status', 'error'),
+            "content": result.get('content') or [],
+            "ms": round(duration * 1000, 1),
+            "bytes": result_size(result)
+        })
+
+
+def summarize_tool_trace(path: str) -> Dict[str, Any]:
+    """
+    统计录制轨迹中各工具的耗时和输出大小，按p95耗时从高到低排序
+    
+    参数:
+        path: 工具调用轨迹文件
+    
+    返回:
+        统计结果
+    """
+    by_name: Dict[str, List[Dict[str, Any]]] = {}
+    records = load_jsonl(path)
+    for record in records:
+        by_name.setdefault(record.get('name', ''), []).append(record)
+    
+    tools = []
+    for name, calls in by_name.items():
+        durations = [call.get('ms', 0.0) for call in calls]
+        sizes = [call.get('bytes', 0) for call in calls]
+        tools.append({
+            "name": name,
+            "calls": len(calls),
+            "errors": sum(1 for call in calls if call.get('status') == 'error'),
+            "p50_ms": percentile(durations, 50),
+            "p95_ms": percentile(durations, 95),
+            "max_ms": max(durations),
+            "total_ms": round(sum(durations), 1),
+            "avg_bytes": round(sum(sizes) / len(sizes), 1),
+            "max_bytes": max(sizes)
+        })
+    tools.sort(key=lambda item: item["p95_ms"] or 0, reverse=True)
+    return {"path": path, "calls": len(records), "tools": tools}
@@ -0,0 +1,121 @@
+"""
+工具结果视图
+每个工具结果只构建一次，长度、行数、预览、错误标记都按需计算并缓存，
+避免对大型file_read/shell输出反复切片和split
+"""
+
+import logging
+from typing import Any, List, Optional
+
+from chunk_dispatcher import ClassifiedChunk, iter_message_tool_blocks, first_text
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+
+class ToolResultView:
+    """单个工具结果的只读视图"""
+    
+    __slots__ = ('tool_use_id', 'content', 'status', '_default', '_text', '_line_count', '_is_blank')
+    
+    def __init__(self, tool_use_id: str, content: Any, status: str = 'success', default: str = '无结果'):
+        """
+        参数:
+            tool_use_id: 工具调用ID
+            content: toolResult的content（内容块列表或字符串）
+            status: toolResult的status
+            default: 没有文本块时使用的文本
+        """
+        self.tool_use_id = tool_use_id
+        self.content = content
+        self.status = status
+        self._default = default
+        self._text = None
+        self._line_count = None
+        self._is_blank = _UNSET
+    
+    @property
+    def text(self) -> str:
+        """第一个文本块（不复制）"""
+        if self._text is None:
+            self._text = first_text(self.content, self._default)
+        return self._text
+    
+    @property
+    def size(self) -> int:
+        """字符数"""
+        return len(self.text)
+    
+    @property
+    def line_count(self) -> int:
+        """行数（单次扫描计数，不分配行列表）"""
+        if self._line_count is None:
+            self._line_count = self.text.count('\n') + 1
+        return self._line_count
+    
+    @property
+    def is_error(self) -> bool:
+        """工具是否执行失败"""
+        return self.status == 'error' or self.text.startswith('Error')
+    
+    @property
+    def is_blank(self) -> bool:
+        """结果是否为空白"""
+        if self._is_blank is _UNSET:
+            text = self.text
+            self._is_blank = not text or text.isspace()
+        return self._is_blank
+    
+    def head(self, limit: int) -> str:
+        """前limit个字符"""
+        return self.text[:limit]
+    
+    def preview(self, limit: int, suffix: str = "...") -> str:
+        """前limit个字符，超出时追加省略号"""
+        text = self.text
+        if len(text) > limit:
+            return text[:limit] + suffix
+        return text
+    
+    def first_line(self, limit: int) -> str:
+        """第一行的前limit个字符（只查找到limit为止）"""
+        text = self.text
+        end = text.find('\n', 0, limit)
+        return text[:end] if end >= 0 else text[:limit]
+
+
+def tool_result_views(message: Any, default: str = '无结果') -> List[ToolResultView]:
+    """
+    为消息中的每个工具结果构建视图
+    
+    参数:
+        message: 完整消息
+        default: 没有文本块时使用的文本
+    
+    返回:
+        ToolResultView列表
+    """
+    views = []
+    for block_type, tool_id, content, status in iter_message_tool_blocks(message):
+        if block_type == 'tool_result' and content and isinstance(content, list):
+            views.append(ToolResultView(tool_id, content, status, default))
+    return views
+
+
+def chunk_tool_results(item: ClassifiedChunk) -> List[ToolResultView]:
+    """
+    获取MESSAGE类chunk的工具结果视图，同一个chunk的所有处理器共享
+    
+    参数:
+        item: 分类后的MESSAGE chunk
+    
+    返回:
+        ToolResultView列表
+    """
+    views: Optional[List[ToolResultView]] = item.tool_results
+    if views is None:
+        views = tool_result_views(item.payload)
+        item.tool_results = views
+    return views
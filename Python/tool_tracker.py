@@ -5,76 +5,208 @@
 
 import json
 import logging
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional
+from chunk_dispatcher import (
+    classify_chunk, iter_message_tool_blocks, TOOL_USE_START, TOOL_INPUT_DELTA, BLOCK_STOP, MESSAGE
+)
+from tool_result_view import ToolResultView, tool_result_views
+from streaming_json import StreamingJSONObject
 
 logger = logging.getLogger(__name__)
 
+# 流式参数中这些顶层键完整时立即显示参数
+DISPLAY_KEYS = frozenset(('path', 'file_path', 'command', 'url', 'expression', 'code'))
+
+class ToolCall:
+    """单个工具调用的状态"""
+    
+    __slots__ = ('tool_use_id', 'name', 'index', 'number', 'started', 'args', 'new_fields', 'input', 'status',
+                 'finished', 'input_shown')
+    
+    def __init__(self, tool_use_id: str, name: str, index: Optional[int], number: int):
+        self.tool_use_id = tool_use_id
+        self.name = name
+        self.index = index
+        self.number = number
+        self.started = time.monotonic()
+        # 流式参数增量解析，new_fields为最近一个增量中完整的顶层字段，input为最终参数
+        self.args = StreamingJSONObject()
+        self.new_fields: List[tuple] = []
+        self.input = None
+        self.input_shown = False
+        # preparing -> running -> success/error
+        self.status = 'preparing'
+        self.finished = None
+    
+    @property
+    def elapsed(self) -> float:
+        """已执行时间（秒）"""
+        return (self.finished or time.monotonic()) - self.started
+    
+    @property
+    def raw_input(self) -> str:
+        """已收到的流式参数文本"""
+        return self.args.text
+
 class ToolTracker:
-    """跟踪工具调用并生成用户友好的消息"""
+    """
+    跟踪单个流中的工具调用并生成用户友好的消息
+    每个流创建一个实例，执行中的调用按toolUseId记录，结果按toolUseId匹配
+    """
     
     def __init__(self):
-        self.current_tool = None
-        self.tool_input = None
-        self.tool_output = None
         self.tool_count = 0
-        self.current_tool_id = None
+        # 执行中的调用: toolUseId -> ToolCall
+        self.calls: Dict[str, ToolCall] = {}
+        # 当前消息中内容块索引 -> toolUseId
+        self._index_to_id: Dict[int, str] = {}
+        self._last_call: Optional[ToolCall] = None
+        
+    @property
+    def current_tool(self) -> Optional[str]:
+        """最近开始且仍在执行的工具名称"""
+        call = self._last_call
+        if call is not None and call.tool_use_id in self.calls:
+            return call.name
+        return None
+    
+    def in_flight(self) -> List[ToolCall]:
+        """所有执行中的调用"""
+        return list(self.calls.values())
+    
+    def get_call(self, tool_use_id: str) -> Optional[ToolCall]:
+        """按toolUseId获取执行中的调用"""
+        return self.calls.get(tool_use_id)
+    
+    def call_for_index(self, index: Optional[int]) -> Optional[ToolCall]:
+        """
+        按内容块索引获取调用，索引未知时使用最近开始且仍在准备参数的调用
         
+        参数:
+            index: contentBlockIndex
+        
+        返回:
+            对应的ToolCall或None
+        """
+        if index is not None:
+            tool_use_id = self._index_to_id.get(index)
+            return self.calls.get(tool_use_id) if tool_use_id else None
+        call = self._last_call
+        if call is not None and call.status == 'preparing' and call.tool_use_id in self.calls:
+            return call
+        return None
+    
     def process_event(self, event: Dict[str, Any]) -> Optional[str]:
         """处理Strands事件，返回格式化的工具调用信息"""
         
         try:
-            # 检测工具调用开始
-            if 'contentBlockStart' in event:
-                content_block = event['contentBlockStart'].get('contentBlock', {})
-                if content_block.get('type') == 'tool_use':
-                    self.current_tool = content_block.get('name', '未知工具')
-                    self.current_tool_id = content_block.get('id', '')
-                    self.tool_count += 1
-                    self.tool_input = None
-                    self.tool_output = None
-                    
-                    # 获取工具的中文描述
-                    tool_desc = self._get_tool_description(self.current_tool)
-                    return f"\n🔧 **工具调用 #{self.tool_count}: {self.current_tool}**\n   {tool_desc}\n   ⏳ 正在准备参数..."
-            
-            # 检测工具输入
-            if 'contentBlockDelta' in event:
-                delta = event['contentBlockDelta']
-                if delta.get('contentBlockIndex') is not None and self.current_tool:
-                    # 这是工具输入的一部分
-                    if 'delta' in delta and 'input' in delta['delta']:
-                        input_data = delta['delta']['input']
-                        # 格式化输入参数以便更好的显示
-                        formatted_input = self._format_tool_input(self.current_tool, input_data)
-                        return f"   📋 参数: {formatted_input}"
-            
-            # 检测工具调用完成
-            if 'contentBlockStop' in event and self.current_tool:
-                # 工具输入收集完成
-                return f"   ⏳ 参数准备完成，开始执行工具..."
-            
-            # 检测消息中的工具结果
+            # 兼容直接传入模型事件（contentBlock*）或包含message的chunk
             if 'message' in event:
-                message = event['message']
-                if 'content' in message:
-                    for content in message['content']:
-                        if content.get('type') == 'tool_result':
-                            tool_id = content.get('tool_use_id', '')
-                            result = content.get('content', [])
-                            if result and isinstance(result, list) and len(result) > 0:
-                                result_text = result[0].get('text', '无结果')
-                                # 格式化结果显示
-                                formatted_result = self._format_tool_result(self.current_tool, result_text)
-                                tool_name = self.current_tool
-                                self.current_tool = None  # 重置当前工具
-                                return f"   ✅ 工具执行完成: {formatted_result}\n   📋 工具 **{tool_name}** 执行结束\n"
+                item = classify_chunk(event)
+            else:
+                item = classify_chunk({'event': event})
             
+            if item.kind == TOOL_USE_START:
+                return self.on_tool_start(item.payload['name'], item.payload['toolUseId'], item.index)
+            if item.kind == TOOL_INPUT_DELTA:
+                return self.on_tool_input(item.payload, item.index)
+            if item.kind == BLOCK_STOP:
+                return self.on_block_stop(item.index)
+            if item.kind == MESSAGE:
+                return self.on_message(item.payload)
             return None
             
         except Exception as e:
             logger.warning(f"处理工具事件时出错: {e}")
             return None
     
+    def on_tool_start(self, tool_name: str, tool_id: str, index: Optional[int] = None) -> Optional[str]:
+        """检测到工具调用开始"""
+        self.tool_count += 1
+        call = ToolCall(tool_id, tool_name, index, self.tool_count)
+        self.calls[tool_id] = call
+        if index is not None:
+            self._index_to_id[index] = tool_id
+        self._last_call = call
+        
+        # 获取工具的中文描述
+        tool_desc = self._get_tool_description(tool_name)
+        return f"\n🔧 **工具调用 #{call.number}: {tool_name}**\n   {tool_desc}\n   ⏳ 正在准备参数..."
+    
+    def on_tool_input(self, input_data, index: Optional[int] = None) -> Optional[str]:
+        """
+        检测到工具输入参数：字符串片段交给增量解析器，
+        只有关键参数（路径、命令、URL等）完整时才输出
+        """
+        call = self.call_for_index(index)
+        if call is None or input_data is None:
+            return None
+        if isinstance(input_data, dict):
+            # 已解析的参数（非流式格式）
+            call.new_fields = list(input_data.items())
+            call.args.fields.update(input_data)
+            call.input_shown = True
+            return f"   📋 参数: {self._format_tool_input(call.name, input_data)}"
+        
+        call.new_fields = call.args.feed(input_data if isinstance(input_data, str) else str(input_data))
+        if call.input_shown or not any(key in DISPLAY_KEYS for key, _value in call.new_fields):
+            return None
+        call.input_shown = True
+        # 格式化输入参数以便更好的显示
+        formatted_input = self._format_tool_input(call.name, call.args.fields)
+        return f"   📋 参数: {formatted_input}"
+    
+    def on_block_stop(self, index: Optional[int] = None) -> Optional[str]:
+        """检测到内容块结束"""
+        call = self.call_for_index(index)
+        if call is None:
+            return None
+        # 工具输入收集完成
+        call.status = 'running'
+        call.new_fields = []
+        if call.input is None:
+            call.input = call.args.finish()
+        if not call.input_shown and call.input:
+            call.input_shown = True
+            return f"   📋 参数: {self._format_tool_input(call.name, call.input)}\n   ⏳ 参数准备完成，开始执行工具..."
+        return f"   ⏳ 参数准备完成，开始执行工具..."
+    
+    def on_message(self, message: Dict[str, Any], views: Optional[List[ToolResultView]] = None) -> Optional[str]:
+        """检测消息中的工具使用和工具结果（views为已构建的工具结果视图，未提供时从消息构建）"""
+        for block_type, tool_id, name, tool_input in iter_message_tool_blocks(message):
+            if block_type != 'tool_use':
+                continue
+            call = self.calls.get(tool_id)
+            if call is None:
+                # 没有经过流式contentBlockStart的调用
+                self.tool_count += 1
+                call = self.calls[tool_id] = ToolCall(tool_id, name, None, self.tool_count)
+                self._last_call = call
+            call.input = tool_input
+            call.status = 'running'
+        # 完整消息结束了当前消息的内容块索引
+        self._index_to_id.clear()
+        
+        if views is None:
+            views = tool_result_views(message)
+        results = [result for result in (self.on_tool_result(view) for view in views) if result]
+        return ''.join(results) if results else None
+    
+    def on_tool_result(self, view: ToolResultView) -> Optional[str]:
+        """检测到工具执行结果，按toolUseId匹配调用"""
+        call = self.calls.pop(view.tool_use_id, None)
+        if call is None and not view.tool_use_id and len(self.calls) == 1:
+            # 旧格式结果没有toolUseId，唯一的执行中调用即为结果所属
+            call = self.calls.pop(next(iter(self.calls)))
+        if call is None:
+            return None
+        call.finished = time.monotonic()
+        call.status = 'error' if view.is_error else 'success'
+        # 格式化结果显示
+        formatted_result = self._format_tool_result(call.name, view)
+        return f"   ✅ 工具执行完成: {formatted_result}\n   📋 工具 **{call.name}** 执行结束（{call.elapsed:.1f}秒）\n"
+    
     def _get_tool_description(self, tool_name: str) -> str:
         """获取工具的中文描述"""
         # 标准化工具名称（移除模块前缀）
@@ -138,68 +270,58 @@ class ToolTracker:
         except Exception as e:
             return f"参数解析错误: {str(e)}"
     
-    def _format_tool_result(self, tool_name: str, result_text: str) -> str:
+    def _format_tool_result(self, tool_name: str, view: ToolResultView) -> str:
         """格式化工具执行结果以便用户友好的显示"""
         try:
             # 标准化工具名称
             clean_name = tool_name.split('.')[-1] if '.' in tool_name else tool_name
             
-            # 截断过长的结果
-            if len(result_text) > 300:
-                result_text = result_text[:300] + "..."
-            
             if clean_name == 'file_read':
                 # 增加详细的file_read结果日志
-                logger.info(f"📖 [TOOL_TRACKER] file_read工具结果长度: {len(result_text)}字符")
-                logger.info(f"📖 [TOOL_TRACKER] file_read结果前100字符: {result_text[:100]}")
+                logger.info(f"📖 [TOOL_TRACKER] file_read工具结果长度: {view.size}字符")
+                logger.info(f"📖 [TOOL_TRACKER] file_read结果前100字符: {view.head(100)}")
                 
-                if result_text.startswith('Error'):
-                    logger.info(f"📖 [TOOL_TRACKER] file_read执行失败: {result_text}")
-                    return f"❌ 文件读取失败: {result_text}"
+                if view.is_error:
+                    logger.info(f"📖 [TOOL_TRACKER] file_read执行失败: {view.preview(300)}")
+                    return f"❌ 文件读取失败: {view.preview(300)}"
                 else:
-                    lines = result_text.split('\n')
-                    logger.info(f"📖 [TOOL_TRACKER] file_read成功，文件有{len(lines)}行")
-                    if len(lines) > 10:
-                        return f"📖 文件内容 ({len(lines)}行): {lines[0][:50]}..."
+                    line_count = view.line_count
+                    logger.info(f"📖 [TOOL_TRACKER] file_read成功，文件有{line_count}行")
+                    if line_count > 10:
+                        return f"📖 文件内容 ({line_count}行): {view.first_line(50)}..."
                     else:
-                        return f"📖 文件内容: {result_text[:100]}..."
+                        return f"📖 文件内容: {view.head(100)}..."
             elif clean_name == 'file_write':
-                if 'successfully' in result_text.lower() or 'success' in result_text.lower():
+                head = view.head(300).lower()
+                if 'successfully' in head or 'success' in head:
                     return f"✅ 文件写入成功"
                 else:
-                    return f"❌ 文件写入失败: {result_text}"
+                    return f"❌ 文件写入失败: {view.preview(300)}"
             elif clean_name == 'python_repl':
-                if result_text.strip():
-                    return f"🐍 执行结果: {result_text}"
+                if not view.is_blank:
+                    return f"🐍 执行结果: {view.preview(300)}"
                 else:
                     return f"🐍 代码执行完成"
             elif clean_name == 'shell' or clean_name == 'unity_shell':
-                if result_text.strip():
-                    return f"💻 命令输出: {result_text}"
+                if not view.is_blank:
+                    return f"💻 命令输出: {view.preview(300)}"
                 else:
                     return f"💻 命令执行完成"
             elif clean_name == 'calculator':
-                return f"🔢 计算结果: {result_text}"
+                return f"🔢 计算结果: {view.preview(300)}"
             elif clean_name == 'http_request':
-                if result_text.startswith('{') or result_text.startswith('['):
-                    return f"🌐 HTTP响应: JSON数据 ({len(result_text)}字符)"
+                if view.text.startswith('{') or view.text.startswith('['):
+                    return f"🌐 HTTP响应: JSON数据 ({view.size}字符)"
                 else:
-                    return f"🌐 HTTP响应: {result_text[:100]}..."
+                    return f"🌐 HTTP响应: {view.head(100)}..."
             
-            # 默认格式化
-            return result_text
+            # 默认格式化（截断过长的结果）
+            return view.preview(300)
         except Exception as e:
             return f"结果格式化错误: {str(e)}"
     
     def reset(self):
         """重置跟踪器状态"""
-        self.current_tool = None
-        self.tool_input = None
-        self.tool_output = None
-
-# 全局工具跟踪器实例
-_tool_tracker = ToolTracker()
-
-def get_tool_tracker() -> ToolTracker:
-    """获取全局工具跟踪器实例"""
-    return _tool_tracker
\ No newline at end of file
+        self.calls.clear()
+        self._index_to_id.clear()
+        self._last_call = None
@@ -4,6 +4,7 @@ Unity代理核心类
 """
 
 import logging
+import threading
 from typing import Dict, Any
 from strands import Agent
 from unity_system_prompt import UNITY_SYSTEM_PROMPT
@@ -68,6 +69,26 @@ class UnityAgent:
             
             # 存储工具列表以供将来使用
             self._available_tools = unity_tools if unity_tools else []
+            
+            # 启动期限之后才就绪的MCP服务器，其工具在流开始前附加到Agent
+            self._pending_mcp_tools = []
+            self._pending_tools_lock = threading.Lock()
+            # 进行中的流数量（Agent不能并发调用，同时最多一个流）
+            self._active_streams = 0
+            self.mcp_manager.set_tool_listener(self._attach_mcp_tools)
+            # 配置文件变化时（watch_config）自动增量重载
+            self.mcp_manager.set_config_listener(self._on_mcp_config_changed)
+            
+            # 工具调用录制/回放钩子（内置工具和MCP工具都经过Agent的工具调用路径）
+            from tool_recorder import ToolTrace
+            self.tool_trace = ToolTrace()
+            self.tool_trace.attach(self.agent)
+            self.tool_trace.configure_from_env()
+            
+            # 就绪状态管理：后台探测模型可用性，结果带TTL缓存
+            from agent_readiness import AgentReadiness
+            self.readiness = AgentReadiness(self)
+            self.readiness.refresh_async()
                 
         except Exception as e:
             logger.error(f"代理初始化失败: {str(e)}")
@@ -89,8 +110,13 @@ class UnityAgent:
         try:
             # 清理MCP资源
             if hasattr(self, 'mcp_manager'):
+                self.mcp_manager.set_config_listener(None)
                 self.mcp_manager.cleanup()
             
+            # 关闭工具轨迹文件
+            if hasattr(self, 'tool_trace'):
+                self.tool_trace.close()
+            
             logger.info("所有资源清理完成")
             
         except Exception as e:
@@ -205,19 +231,193 @@ class UnityAgent:
         async for chunk in self.streaming_processor.process_stream(message):
             yield chunk
     
-    def health_check(self) -> Dict[str, Any]:
+    def _attach_mcp_tools(self, tools, removed_tools=None):
+        """
+        接收MCP工具变更：停止的服务器的工具立即移除；晚就绪的工具在流进行中时暂存，
+        等下一个流开始前再注册，避免修改正在使用的工具表
+        
+        参数:
+            tools: MCP工具列表
+            removed_tools: 需要从Agent移除的MCP工具（配置重载时停止的服务器的工具）
+        """
+        if removed_tools:
+            self._remove_mcp_tools(removed_tools)
+        if not tools:
+            return
+        with self._pending_tools_lock:
+            self._pending_mcp_tools.extend(tools)
+        if not self._active_streams:
+            self._register_pending_mcp_tools()
+    
+    def _remove_mcp_tools(self, removed_tools):
+        """
+        立即从Agent移除MCP工具（在MCPManager停止会话的同一临界区中调用）
+        
+        替换工具表而不是原地删除，进行中的流正在遍历的旧表不受影响，下一次模型调用就看不到这些工具。
+        
+        参数:
+            removed_tools: 要移除的MCP工具
+        """
+        with self._pending_tools_lock:
+            # 尚未注册的工具直接丢弃
+            self._pending_mcp_tools = [tool for tool in self._pending_mcp_tools if tool not in removed_tools]
+            registry = getattr(self.agent, 'tool_registry', None)
+            if registry is not None and hasattr(registry, 'registry'):
+                # 同名工具可能已被其他服务器的工具替换，只移除这个工具对象本身
+                stale = {tool.tool_name for tool in removed_tools if registry.registry.get(tool.tool_name) is tool}
+                if stale:
+                    registry.registry = {name: tool for name, tool in registry.registry.items() if name not in stale}
+                    registry.dynamic_tools = {name: tool for name, tool in registry.dynamic_tools.items()
+                                              if name not in stale}
+            self._available_tools = [tool for tool in self._available_tools if tool not in removed_tools]
+        logger.info(f"已移除 {len(removed_tools)} 个MCP工具")
+    
+    def _register_pending_mcp_tools(self):
+        """把暂存的晚就绪MCP工具注册到Agent"""
+        with self._pending_tools_lock:
+            tools, self._pending_mcp_tools = self._pending_mcp_tools, []
+            if not tools:
+                return
+            registry = getattr(self.agent, 'tool_registry', None)
+            if registry is None or not hasattr(registry, 'register_tool'):
+                logger.warning(f"Agent不支持动态注册工具，忽略 {len(tools)} 个晚就绪的MCP工具")
+                return
+            for tool in tools:
+                try:
+                    registry.register_tool(tool)
+                    self._available_tools.append(tool)
+                except Exception as e:
+                    logger.warning(f"注册MCP工具 {getattr(tool, 'tool_name', tool)} 失败: {e}")
+        logger.info(f"已附加 {len(tools)} 个晚就绪的MCP工具")
+    
+    def begin_stream(self) -> bool:
+        """
+        标记流开始，并先应用暂存的MCP工具变更
+        
+        Strands Agent不允许并发调用（默认ConcurrentInvocationMode.THROW），所有流共用同一个Agent，
+        已有流进行时直接拒绝，避免新的流在stream_async中途抛出ConcurrencyException
+        
+        返回:
+            是否开始成功；返回False时没有计数，调用方不需要调用end_stream
+        """
+        with self._pending_tools_lock:
+            if self._active_streams:
+                return False
+            self._active_streams = 1
+        if self._pending_mcp_tools:
+            self._register_pending_mcp_tools()
+        return True
+    
+    def end_stream(self):
+        """标记流已结束"""
+        with self._pending_tools_lock:
+            self._active_streams = max(0, self._active_streams - 1)
+    
+    def reload_mcp_config(self) -> Dict[str, Any]:
+        """
+        增量重新加载MCP配置：只启动、停止或重启配置有变化的服务器，并替换Agent中受影响的工具，
+        对话历史和未变化的会话保持不变（停止的服务器的工具由MCPManager在停止会话时立即移除，
+        新工具在流进行中时推迟到下一个流开始前注册）
+        
+        返回:
+            结果字典，包含新增/删除/重启/未变化的服务器和工具变更
+        """
+        result, added_tools, _ = self.mcp_manager.reload_incremental()
+        if result.get("success") and added_tools:
+            self._attach_mcp_tools(added_tools)
+        return result
+    
+    def _on_mcp_config_changed(self, change: Dict[str, Any]):
+        """
+        配置文件变化时自动增量重载（在配置监视线程中调用）
+        
+        参数:
+            change: 配置服务的变更事件
+        """
+        logger.info(f"MCP配置文件已变化，自动重新加载: {change['diff']['servers']}")
+        result = self.reload_mcp_config()
+        if not result.get("success"):
+            logger.warning(f"自动重新加载MCP配置失败: {result.get('message')}")
+    
+    def cancel(self, scope=None) -> Dict[str, Any]:
+        """
+        取消一个流中的工具执行
+        
+        通知Agent停止，并只终止这个流的工具启动的子进程、中止这个流等待中的MCP调用，
+        MCP服务器进程和其他流的调用不受影响。asyncio任务本身由流式运行时取消。
+        
+        参数:
+            scope: 要取消的流的取消范围（stream_cancel.CancelScope）
+        
+        返回:
+            取消结果字典
+        """
+        if scope is None or scope.cancelled:
+            return {"cancelled": False, "killed_processes": 0, "cancelled_mcp_calls": 0}
+        
+        logger.info(f"🛑 取消流式处理 {scope.name}")
+        
+        # 新版SDK支持协作式取消，会在模型流和工具执行之间的安全点停止
+        if hasattr(self.agent, 'cancel'):
+            try:
+                self.agent.cancel()
+            except Exception as e:
+                logger.warning(f"通知Agent取消失败: {e}")
+        
+        result = scope.cancel()
+        if result["killed_processes"]:
+            logger.info(f"已终止工具子进程: {result['killed_processes']}")
+        if result["cancelled_mcp_calls"]:
+            logger.info(f"已取消 {result['cancelled_mcp_calls']} 个等待中的MCP工具调用")
+        
+        return {
+            "cancelled": True,
+            "killed_processes": len(result["killed_processes"]),
+            "cancelled_mcp_calls": result["cancelled_mcp_calls"]
+        }
+    
+    def repair_history_after_cancel(self, partial_text: str = ""):
+        """
+        取消后修复对话历史，补齐未完成的工具结果和assistant消息
+        
+        参数:
+            partial_text: 被中断时已输出的正文
+        """
+        from stream_cancel import repair_history
+        messages = getattr(self.agent, 'messages', None)
+        if messages is None:
+            return
+        added = repair_history(messages, partial_text)
+        if added:
+            logger.info(f"已修复取消后的对话历史，追加 {added} 条消息")
+    
+    def health_check(self, reset_stats: bool = False) -> Dict[str, Any]:
         """
         检查代理是否健康且就绪
         
+        参数:
+            reset_stats: 读取后是否清空MCP调用统计
+        
         返回:
             状态字典
         """
         try:
-            # Simple health check - try to get agent info
+            # 使用缓存的探测结果，不在这里发起模型调用
+            readiness = self.readiness.get_status() if hasattr(self, 'readiness') else None
+            if readiness is not None and readiness["stale"]:
+                self.readiness.refresh_async()
+            healthy = readiness is None or readiness["healthy"] is not False
+            # 各MCP服务器的监督状态（up/restarting/open/idle）、重启次数和最近的错误
+            mcp_servers = self.mcp_manager.get_server_health() if hasattr(self, 'mcp_manager') else {}
+            # 各MCP服务器的调用次数、错误和往返时间分位数（明细见get_mcp_stats）
+            mcp_stats = self.mcp_manager.get_mcp_stats(reset=reset_stats, detailed=False) if hasattr(self, 'mcp_manager') else {}
             return {
-                "status": "healthy",
+                "status": "healthy" if healthy else "unhealthy",
                 "agent_type": type(self.agent).__name__,
-                "ready": True
+                "ready": healthy,
+                "readiness": readiness,
+                "mcp_servers": mcp_servers,
+                "mcp_stats": mcp_stats
             }
         except Exception as e:
             return {
@@ -163,6 +163,10 @@ class UnityToolsManager:
             # 过滤掉None值并存储
             self.tool_modules = {k: v for k, v in tool_modules.items() if v is not None}
             
+            # shell和python_repl启动的子进程登记到所在流的取消范围，取消流时只终止这些进程
+            from stream_cancel import track_tool_processes
+            track_tool_processes(shell_module, python_repl_module)
+            
             print(f"[Python] Strands预定义工具导入成功，总共{len(self.tool_modules)}个工具")
             print(f"[Python] 已导入的工具: {list(self.tool_modules.keys())}")
             TOOLS_AVAILABLE = True
@@ -313,6 +317,10 @@ class UnityToolsManager:
                         logger.info(f"✓ 添加MCP工具: {len(mcp_tools)} 个工具")
                         # 存储MCP工具引用
                         self.mcp_tools = mcp_tools
+                    # 分页读取被截断的大型MCP结果（晚就绪的服务器也可能返回大结果，始终注册）
+                    from mcp_spill import read_mcp_result
+                    if read_mcp_result is not None:
+                        unity_tools.append(read_mcp_result)
                 else:
                     logger.warning("Agent实例不支持MCP工具加载")
             except Exception as e: